@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Measures the cost of combining and applying metadata policies on synthetic trust chains.
+
+    python benchmark/policy_bench.py -d 3 -c 50 -o results.json
+    python benchmark/policy_bench.py -d 3 -c 50 -b results.json -s 1.25
+
+With a baseline the script exits with a non-zero status if any benchmark is more than
+max slowdown times slower than in the baseline.
+"""
+import argparse
+import copy
+import json
+import random
+import sys
+
+from fedservice.entity.function.policy import CompiledPolicy
+from fedservice.entity.function.policy import TrustChainPolicy
+from fedservice.entity.function.policy import combine
+from fedservice.entity_statement.cache import ESCache
+from fedservice.entity_statement.statement import TrustChain
+
+from utils import check_regressions
+from utils import environment
+from utils import measure
+from utils import write_results
+
+ENTITY_TYPE = "openid_relying_party"
+
+OPERATORS = ["value", "add", "default", "one_of", "subset_of", "superset_of", "essential"]
+
+
+def claim_policy(operator: str, claim: str, level: int, depth: int, set_size: int) -> dict:
+    """
+    The policy for a claim as set by the statement at one level of the chain.
+    Chosen such that the policies of all levels can be combined.
+    """
+    _values = [f"{claim}-{n}" for n in range(set_size)]
+    if operator == "value":
+        return {"value": f"{claim}-value"}
+    elif operator == "add":
+        return {"add": [f"{claim}-add-{level}"]}
+    elif operator == "default":
+        return {"default": f"{claim}-default"}
+    elif operator == "one_of":
+        return {"one_of": _values}
+    elif operator == "subset_of":
+        # Gets more restrictive further down the chain
+        return {"subset_of": _values[:max(1, set_size - level)], "essential": True}
+    elif operator == "superset_of":
+        return {"superset_of": _values[:min(set_size, level + 1)]}
+    return {"essential": True}
+
+
+def leaf_value(operator: str, claim: str, set_size: int):
+    _values = [f"{claim}-{n}" for n in range(set_size)]
+    if operator == "default":
+        return None
+    elif operator == "one_of":
+        return _values[0]
+    elif operator in ["subset_of", "superset_of"]:
+        return _values
+    elif operator == "add":
+        return [f"{claim}-leaf"]
+    return f"{claim}-leaf"
+
+
+def make_chain(depth: int, claims: int, operators: list, set_size: int, seed: int) -> list:
+    """
+    :param depth: The number of statements with metadata policies, the trust anchor's included
+    :param claims: The number of claims with policies
+    :param operators: The operators to choose from
+    :param set_size: The number of values in one_of, subset_of and superset_of
+    :return: The statements of a trust chain, the trust anchor's first and the leaf's last
+    """
+    _random = random.Random(seed)
+    _claims = {f"claim_{n}": _random.choice(operators) for n in range(claims)}
+
+    chain = []
+    for level in range(depth):
+        _policy = {claim: claim_policy(op, claim, level, depth, set_size)
+                   for claim, op in _claims.items()}
+        chain.append({
+            "iss": f"https://level{level}.example.org",
+            "sub": f"https://level{level + 1}.example.org",
+            "metadata_policy": {ENTITY_TYPE: _policy}
+        })
+
+    _metadata = {}
+    for claim, op in _claims.items():
+        _val = leaf_value(op, claim, set_size)
+        if _val is not None:
+            _metadata[claim] = _val
+    chain.append({
+        "iss": f"https://level{depth}.example.org",
+        "sub": f"https://level{depth}.example.org",
+        "metadata": {ENTITY_TYPE: _metadata}
+    })
+    return chain
+
+
+def combine_chain(chain: list) -> dict:
+    _rule = {"metadata_policy": copy.deepcopy(chain[0]["metadata_policy"][ENTITY_TYPE]),
+             "metadata": {}}
+    for _statement in chain[1:]:
+        _rule = combine(_rule, {"metadata_policy": _statement["metadata_policy"][ENTITY_TYPE],
+                                "metadata": {}})
+    return _rule
+
+
+def run(args) -> dict:
+    _operators = args.operators.split(",")
+    for _op in _operators:
+        if _op not in OPERATORS:
+            raise ValueError(f"Unknown operator: {_op}")
+
+    chain = make_chain(args.depth, args.claims, _operators, args.set_size, args.seed)
+    _superiors = chain[:-1]
+    _leaf_metadata = chain[-1]["metadata"][ENTITY_TYPE]
+
+    _policy = TrustChainPolicy(upstream_get=None)
+    _combined = copy.deepcopy(_policy.gather_policies(_superiors, ENTITY_TYPE))
+    _compiled = CompiledPolicy(_combined, _policy.policy_operators)
+
+    def _cached():
+        _trust_chain = TrustChain(verified_chain=chain)
+        _policy(_trust_chain, ENTITY_TYPE)
+
+    def _uncached():
+        _trust_chain = TrustChain(verified_chain=chain)
+        _policy.policy_cache = ESCache(allowed_delta=0, max_size=1)
+        _policy(_trust_chain, ENTITY_TYPE)
+
+    _benchmarks = {
+        "combine": lambda: combine_chain(_superiors),
+        "gather": lambda: _policy.gather_policies(_superiors, ENTITY_TYPE),
+        "compile": lambda: CompiledPolicy(_combined, _policy.policy_operators),
+        "apply": lambda: _compiled(_leaf_metadata),
+        "chain_uncached": _uncached,
+        "chain_cached": _cached
+    }
+
+    results = {}
+    for name, func in _benchmarks.items():
+        if args.only and name not in args.only.split(","):
+            continue
+        results[name] = measure(func, number=args.number, repeat=args.repeat)
+
+    return {
+        "benchmark": "policy",
+        "environment": environment(),
+        "parameters": {
+            "depth": args.depth,
+            "claims": args.claims,
+            "operators": _operators,
+            "set_size": args.set_size,
+            "seed": args.seed,
+            "number": args.number,
+            "repeat": args.repeat
+        },
+        "results": results
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', dest='depth', type=int, default=3,
+                        help="Statements with policies in the chain")
+    parser.add_argument('-c', dest='claims', type=int, default=20,
+                        help="Claims with policies")
+    parser.add_argument('-p', dest='operators', default=",".join(OPERATORS[:-1]),
+                        help="Comma separated list of operators to choose from")
+    parser.add_argument('-z', dest='set_size', type=int, default=5,
+                        help="Values in set valued operators")
+    parser.add_argument('-r', dest='seed', type=int, default=0)
+    parser.add_argument('-n', dest='number', type=int, default=200,
+                        help="Calls per round")
+    parser.add_argument('-R', dest='repeat', type=int, default=5, help="Rounds")
+    parser.add_argument('--only', dest='only', default="",
+                        help="Comma separated list of benchmarks to run")
+    parser.add_argument('-o', dest='output', default="", help="Where to write the results")
+    parser.add_argument('-b', dest='baseline', default="",
+                        help="Results of a previous run to compare with")
+    parser.add_argument('-s', dest='max_slowdown', type=float, default=1.25)
+    args = parser.parse_args()
+
+    _results = run(args)
+    write_results(_results, args.output)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            if json.load(fp).get("parameters") != _results["parameters"]:
+                print("Baseline was run with other parameters", file=sys.stderr)
+        _regressions = check_regressions(_results["results"], args.baseline, args.max_slowdown)
+        if _regressions:
+            for _regression in _regressions:
+                print(f"Regression: {_regression}", file=sys.stderr)
+            sys.exit(1)
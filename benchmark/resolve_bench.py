@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Measures trust chain resolution in a synthetic federation that is run in-process.
+
+The federation has one or more trust anchors, a number of levels of intermediates and
+a number of leaves. Every entity below the trust anchors can have more than one
+superior. All HTTP requests are served by the entities' own endpoints through an
+in-memory stand-in for the HTTP client, with optional added latency.
+
+    python benchmark/resolve_bench.py -a 1 -d 2 -w 5 -l 100 -m 2 -o results.json
+
+Reports latency (p50, p99), requests per second, HTTP calls and signature operations
+per scenario. With a baseline, -b, the script exits with a non-zero status if any
+scenario is more than max slowdown, -s, times slower than in the baseline.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable
+from typing import List
+from typing import Optional
+from urllib.parse import parse_qs
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+
+from cryptojwt.jws.jws import JWS
+from idpyoidc.message import Message
+from requests.structures import CaseInsensitiveDict
+
+from fedservice.entity.function import get_verified_trust_chains
+from fedservice.utils import make_federation_entity
+
+from utils import check_regressions
+from utils import environment
+from utils import percentile
+from utils import summarize
+from utils import write_results
+
+# Statements are signed with RS256
+KEY_CONFIG = {"key_defs": [{"type": "RSA", "use": ["sig"]}]}
+
+TA_ENDPOINTS = ["entity_configuration", "fetch", "list", "resolve"]
+INTERMEDIATE_ENDPOINTS = ["entity_configuration", "fetch", "list"]
+LEAF_ENDPOINTS = ["entity_configuration"]
+
+# Counts signature operations, all signing and verification goes through these
+SIGNATURES = Counter()
+_signature_lock = threading.Lock()
+
+
+def count_calls(cls, method: str, name: str):
+    _method = getattr(cls, method)
+
+    def wrapper(*args, **kwargs):
+        with _signature_lock:
+            SIGNATURES[name] += 1
+        return _method(*args, **kwargs)
+
+    setattr(cls, method, wrapper)
+
+
+count_calls(JWS, "sign_compact", "sign")
+count_calls(JWS, "verify_compact", "verify")
+
+
+class Response(object):
+    """The parts of a requests.Response that are used."""
+
+    def __init__(self, url: str, status_code: int, text: str, headers: Optional[dict] = None):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.headers = CaseInsensitiveDict(headers or {})
+
+    @property
+    def content(self) -> bytes:
+        return self.text.encode()
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class InMemoryFederation(object):
+    """
+    Routes requests to the endpoints of the entities in the federation. Called the same
+    way as requests.request, so it can be used as the entities' HTTP client.
+    """
+
+    def __init__(self, latency: Optional[float] = 0.0, jitter: Optional[float] = 0.0):
+        """
+        :param latency: Seconds added to every request
+        :param jitter: Up to this many seconds more are added at random
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.route = {}
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, entity):
+        for _endpoint in entity.server.endpoint.values():
+            self.route[_endpoint.full_path] = _endpoint
+        self.attach(entity)
+
+    def attach(self, entity):
+        # The entity and its parts may all hold a reference to a HTTP client
+        for _unit in [entity, entity.client, entity.server, entity.function]:
+            if _unit is not None and hasattr(_unit, "httpc"):
+                _unit.httpc = self
+
+    def __call__(self, method: str, url: str, **kwargs) -> Response:
+        _delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if _delay:
+            time.sleep(_delay)
+        with self._lock:
+            self.calls[urlsplit(url).path or "/"] += 1
+        return self.handle(method, url, headers=kwargs.get("headers"))
+
+    def handle(self, method: str, url: str, headers: Optional[dict] = None) -> Response:
+        _url = urlsplit(url)
+        _endpoint = self.route.get(f"{_url.scheme}://{_url.netloc}{_url.path}")
+        if _endpoint is None:
+            return Response(url, 404, "")
+
+        _query = {k: v[0] for k, v in parse_qs(_url.query).items()}
+        _http_info = {"headers": {k.lower(): v for k, v in (headers or {}).items()}}
+        _request = _endpoint.parse_request(_query)
+        if isinstance(_request, Message) and "error" in _request:
+            return Response(url, 400, _request.to_json(), {"Content-Type": "application/json"})
+
+        _args = _endpoint.process_request(_request, http_info=_http_info)
+        if isinstance(_args, Message) and "error" in _args:
+            return Response(url, 400, _args.to_json(), {"Content-Type": "application/json"})
+
+        if "http_response" in _args:
+            return Response(url, 200, _args["http_response"])
+
+        _resp = _endpoint.do_response(request=_request, **_args)
+        _body = _resp["response"]
+        if not isinstance(_body, str):
+            # Streamed
+            _body = "".join(_body)
+        return Response(url, _args.get("response_code", 200), _body,
+                        dict(_resp.get("http_headers", [])))
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+
+def superiors(index: int, upper: List[str], homes: int) -> List[str]:
+    return [upper[(index + n) % len(upper)] for n in range(min(homes, len(upper)))]
+
+
+def build_federation(anchors: int, depth: int, width: int, leaves: int, homes: int,
+                     httpc: InMemoryFederation) -> dict:
+    """
+    :param anchors: The number of trust anchors
+    :param depth: The number of levels of intermediates
+    :param width: The number of intermediates on each level
+    :param leaves: The number of leaves
+    :param homes: The number of superiors each entity below the trust anchors has
+    :return: Dictionary with the trust anchors, intermediates and leaves as lists of entities
+    """
+    _anchors = []
+    for n in range(anchors):
+        _entity_id = f"https://ta{n}.example.org"
+        _entity = make_federation_entity(_entity_id, key_config=KEY_CONFIG, endpoints=TA_ENDPOINTS,
+                                         preference={"organization_name": f"TA {n}"})
+        _entity.server.policy["federation_entity"] = {
+            "metadata_policy": {"contacts": {"add": [f"ops@ta{n}.example.org"]}}
+        }
+        _anchors.append(_entity)
+    _trust_anchors = {ta.entity_id: ta.keyjar.export_jwks() for ta in _anchors}
+    for ta in _anchors:
+        for _id, _jwks in _trust_anchors.items():
+            ta.add_trust_anchor(_id, _jwks)
+
+    _levels = [_anchors]
+    for level in range(depth):
+        _upper = [e.entity_id for e in _levels[-1]]
+        _levels.append([
+            make_federation_entity(f"https://im{level}-{n}.example.org", key_config=KEY_CONFIG,
+                                   endpoints=INTERMEDIATE_ENDPOINTS,
+                                   authority_hints=superiors(n, _upper, homes),
+                                   trust_anchors=_trust_anchors,
+                                   preference={"organization_name": f"IM {level}-{n}"})
+            for n in range(width)])
+
+    _upper = [e.entity_id for e in _levels[-1]]
+    _leaves = [
+        make_federation_entity(f"https://leaf{n}.example.org", key_config=KEY_CONFIG,
+                               endpoints=LEAF_ENDPOINTS,
+                               authority_hints=superiors(n, _upper, homes),
+                               trust_anchors=_trust_anchors,
+                               preference={"organization_name": f"Leaf {n}",
+                                           "contacts": [f"ops@leaf{n}.example.org"]})
+        for n in range(leaves)]
+    _levels.append(_leaves)
+
+    _by_id = {e.entity_id: e for _level in _levels for e in _level}
+    for _level in _levels[1:]:
+        for _entity in _level:
+            _authority_hints = _entity.context.authority_hints
+            for _superior in _authority_hints:
+                _by_id[_superior].server.subordinate[_entity.entity_id] = {
+                    "jwks": _entity.keyjar.export_jwks(),
+                    "entity_types": ["federation_entity"],
+                    "authority_hints": _authority_hints,
+                    "intermediate": _level is not _leaves
+                }
+
+    for _entity in _by_id.values():
+        httpc.add(_entity)
+
+    return {"anchors": _anchors, "intermediates": _levels[1:-1], "leaves": _leaves,
+            "trust_anchors": _trust_anchors}
+
+
+def make_client(n: int, trust_anchors: dict, httpc: InMemoryFederation):
+    _client = make_federation_entity(f"https://client{n}.example.org", key_config=KEY_CONFIG,
+                                     endpoints=LEAF_ENDPOINTS, trust_anchors=trust_anchors)
+    httpc.attach(_client)
+    return _client
+
+
+def scenario(calls: List[Callable], httpc: InMemoryFederation) -> dict:
+    """
+    Make the calls one after the other.
+
+    :return: Latency summary, throughput, HTTP calls and signature operations
+    """
+    _http_calls = httpc.total_calls()
+    _signatures = SIGNATURES.copy()
+    _samples = []
+    _start = time.perf_counter()
+    for _call in calls:
+        _begin = time.perf_counter()
+        _call()
+        _samples.append(time.perf_counter() - _begin)
+    _elapsed = time.perf_counter() - _start
+
+    res = summarize(_samples)
+    res.update({
+        "p50_us": round(percentile(_samples, 50) * 1e6, 2),
+        "requests_per_second": round(len(_samples) / _elapsed, 2) if _elapsed else 0,
+        "http_calls": httpc.total_calls() - _http_calls,
+        "sign": SIGNATURES["sign"] - _signatures["sign"],
+        "verify": SIGNATURES["verify"] - _signatures["verify"]
+    })
+    return res
+
+
+def _check_chains(client, entity_id: str):
+    if not get_verified_trust_chains(client, entity_id):
+        raise ValueError(f"No trust chain for {entity_id}")
+
+
+def _check_response(httpc: InMemoryFederation, url: str):
+    _response = httpc.handle("GET", url)
+    if _response.status_code != 200:
+        raise ValueError(f"{url}: {_response.status_code} {_response.text}")
+
+
+def run(args) -> dict:
+    httpc = InMemoryFederation(latency=args.latency / 1000, jitter=args.jitter / 1000)
+    federation = build_federation(args.anchors, args.depth, args.width, args.leaves,
+                                  args.homes, httpc)
+    _random = random.Random(args.seed)
+    _sample = _random.sample(federation["leaves"], min(args.sample, len(federation["leaves"])))
+    _ta = federation["anchors"][0]
+
+    results = {}
+
+    # A new client for every call, nothing cached on the client side
+    _clients = [make_client(n, federation["trust_anchors"], httpc) for n in range(len(_sample))]
+    results["trust_chains_cold"] = scenario(
+        [lambda c=c, leaf=leaf: _check_chains(c, leaf.entity_id)
+         for c, leaf in zip(_clients, _sample)], httpc)
+
+    _client = make_client(len(_sample), federation["trust_anchors"], httpc)
+    for leaf in _sample:
+        _check_chains(_client, leaf.entity_id)
+    results["trust_chains_warm"] = scenario(
+        [lambda leaf=leaf: _check_chains(_client, leaf.entity_id)
+         for _ in range(args.rounds) for leaf in _sample], httpc)
+
+    _resolve = _ta.server.get_endpoint("resolve").full_path
+    _resolve_urls = [f"{_resolve}?{urlencode({'sub': leaf.entity_id, 'anchor': _ta.entity_id})}"
+                     for leaf in _sample]
+    results["resolve_cold"] = scenario(
+        [lambda url=url: _check_response(httpc, url) for url in _resolve_urls], httpc)
+    results["resolve_warm"] = scenario(
+        [lambda url=url: _check_response(httpc, url)
+         for _ in range(args.rounds) for url in _resolve_urls], httpc)
+
+    _fetch = _ta.server.get_endpoint("fetch").full_path
+    _fetch_urls = [f"{_fetch}?{urlencode({'sub': sub})}" for sub in _ta.server.subordinate.keys()]
+    results["fetch"] = scenario(
+        [lambda url=url: _check_response(httpc, url)
+         for _ in range(args.rounds) for url in _fetch_urls], httpc)
+
+    _list = _ta.server.get_endpoint("list").full_path
+    results["list"] = scenario(
+        [lambda: _check_response(httpc, _list) for _ in range(args.rounds)], httpc)
+
+    return {
+        "benchmark": "resolve",
+        "environment": environment(),
+        "parameters": {
+            "anchors": args.anchors,
+            "depth": args.depth,
+            "width": args.width,
+            "leaves": args.leaves,
+            "homes": args.homes,
+            "latency_ms": args.latency,
+            "jitter_ms": args.jitter,
+            "sample": len(_sample),
+            "rounds": args.rounds,
+            "seed": args.seed
+        },
+        "http_calls": dict(httpc.calls),
+        "results": results
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-a', dest='anchors', type=int, default=1, help="Trust anchors")
+    parser.add_argument('-d', dest='depth', type=int, default=1, help="Levels of intermediates")
+    parser.add_argument('-w', dest='width', type=int, default=3,
+                        help="Intermediates on each level")
+    parser.add_argument('-l', dest='leaves', type=int, default=20, help="Leaves")
+    parser.add_argument('-m', dest='homes', type=int, default=1,
+                        help="Superiors of each entity below the trust anchors")
+    parser.add_argument('-L', dest='latency', type=float, default=0.0,
+                        help="Milliseconds added to each HTTP request")
+    parser.add_argument('-j', dest='jitter', type=float, default=0.0,
+                        help="Up to this many milliseconds more are added at random")
+    parser.add_argument('-n', dest='sample', type=int, default=10,
+                        help="Leaves to resolve")
+    parser.add_argument('-R', dest='rounds', type=int, default=5,
+                        help="Rounds for the warm scenarios")
+    parser.add_argument('-r', dest='seed', type=int, default=0)
+    parser.add_argument('-o', dest='output', default="", help="Where to write the results")
+    parser.add_argument('-b', dest='baseline', default="",
+                        help="Results of a previous run to compare with")
+    parser.add_argument('-s', dest='max_slowdown', type=float, default=1.25)
+    args = parser.parse_args()
+
+    _results = run(args)
+    write_results(_results, args.output)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            if json.load(fp).get("parameters") != _results["parameters"]:
+                print("Baseline was run with other parameters", file=sys.stderr)
+        _regressions = check_regressions(_results["results"], args.baseline, args.max_slowdown)
+        if _regressions:
+            for _regression in _regressions:
+                print(f"Regression: {_regression}", file=sys.stderr)
+            sys.exit(1)
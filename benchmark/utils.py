@@ -0,0 +1,91 @@
+import json
+import platform
+import statistics
+import time
+from typing import Callable
+from typing import Optional
+
+
+def percentile(values: list, pct: float) -> float:
+    """
+    :param values: Measured values
+    :param pct: Percentile, 0-100
+    :return: The value at the given percentile, nearest rank
+    """
+    if not values:
+        return 0.0
+    _sorted = sorted(values)
+    _index = max(0, min(len(_sorted) - 1, round(pct / 100 * len(_sorted) + 0.5) - 1))
+    return _sorted[_index]
+
+
+def summarize(samples: list) -> dict:
+    """
+    :param samples: Durations in seconds
+    :return: Summary in microseconds
+    """
+    return {
+        "n": len(samples),
+        "min_us": round(min(samples) * 1e6, 2),
+        "median_us": round(statistics.median(samples) * 1e6, 2),
+        "mean_us": round(statistics.fmean(samples) * 1e6, 2),
+        "p99_us": round(percentile(samples, 99) * 1e6, 2)
+    }
+
+
+def measure(func: Callable, number: Optional[int] = 100, repeat: Optional[int] = 5) -> dict:
+    """
+    Time a function. It is called number times in each of repeat rounds.
+
+    :return: Summary of the time per call
+    """
+    _samples = []
+    for _ in range(repeat):
+        _start = time.perf_counter()
+        for _ in range(number):
+            func()
+        _samples.append((time.perf_counter() - _start) / number)
+    return summarize(_samples)
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "time": int(time.time())
+    }
+
+
+def write_results(results: dict, path: Optional[str] = ""):
+    _text = json.dumps(results, indent=2, sort_keys=True)
+    if path:
+        with open(path, "w") as fp:
+            fp.write(_text)
+    else:
+        print(_text)
+
+
+def check_regressions(results: dict, baseline_path: str, max_slowdown: float,
+                      key: Optional[str] = "median_us") -> list:
+    """
+    Compare results with a previous run.
+
+    :param results: Dictionary with benchmark names as keys and summaries as values
+    :param baseline_path: File with the results of a previous run
+    :param max_slowdown: How many times slower than the baseline a benchmark may be
+    :param key: Which value in the summary to compare
+    :return: List of descriptions of the benchmarks that got too slow
+    """
+    with open(baseline_path) as fp:
+        _baseline = json.load(fp)["results"]
+
+    _regressions = []
+    for name, _summary in results.items():
+        _before = _baseline.get(name, {}).get(key)
+        if not _before or key not in _summary:
+            continue
+        _ratio = _summary[key] / _before
+        if _ratio > max_slowdown:
+            _regressions.append(f"{name}: {_summary[key]} vs {_before} ({_ratio:.2f}x)")
+    return _regressions
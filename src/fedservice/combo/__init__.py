@@ -10,9 +10,9 @@ from idpyoidc.configure import Configuration
 from idpyoidc.message import Message
 from idpyoidc.node import Unit
 from idpyoidc.server.util import execute
-from requests import request
 
 from fedservice.entity import FederationEntity
+from fedservice.http_client import init_httpc
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +34,8 @@ class Combo(Unit):
                       httpc_params=httpc_params)
         self._part = {}
         for key, spec in config.items():
+            if key == "httpc":  # HTTP client specification, not a part
+                continue
             if isinstance(spec, dict) and 'class' in spec:
                 if httpc_params:
                     self._add_httpc_params(spec, httpc_params)
@@ -91,8 +93,9 @@ class FederationCombo(Combo):
                  keyjar: Optional[Union[KeyJar, bool]] = None,
                  httpc_params: Optional[dict] = None
                  ):
-        if httpc is None:
-            httpc = request
+        # One pooled HTTP client shared by all the parts, unless one is given.
+        # Can be configured with 'httpc' in the configuration.
+        httpc = init_httpc(httpc or config.get("httpc"))
 
         if 'keyjar' not in config and 'key_conf' not in config:
             Combo.__init__(self, config=config, httpc=httpc, entity_id=entity_id, keyjar=False,
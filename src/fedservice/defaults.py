@@ -70,6 +70,10 @@ SERVICES = {
         "class": 'fedservice.entity.client.resolve.Resolve',
         "kwargs": {}
     },
+    "bulk_resolve": {
+        "class": 'fedservice.entity.client.bulk_resolve.BulkResolve',
+        "kwargs": {}
+    },
     "list": {
         "class": 'fedservice.entity.client.list.List',
         "kwargs": {}
@@ -147,6 +151,11 @@ FEDERATION_ENDPOINTS = {
         "class": 'fedservice.entity.server.resolve.Resolve',
         "kwargs": {}
     },
+    "bulk_resolve": {
+        "path": "bulk_resolve",
+        "class": 'fedservice.entity.server.bulk_resolve.BulkResolve',
+        "kwargs": {}
+    },
     "trust_mark_status": {
         "path": "trust_mark_status",
         "class": 'fedservice.trust_mark_entity.server.trust_mark_status.TrustMarkStatus',
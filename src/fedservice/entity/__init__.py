@@ -8,7 +8,6 @@ from cryptojwt.utils import importer
 from idpyoidc.client.client_auth import client_auth_setup
 from idpyoidc.server.util import execute
 from idpyoidc.util import instantiate
-from requests import request
 
 from fedservice import message
 from fedservice.entity.function import apply_policies
@@ -16,6 +15,9 @@ from fedservice.entity.function import collect_trust_chains
 from fedservice.entity.function import get_payload
 from fedservice.entity.function import get_verified_trust_chains
 from fedservice.entity.function import verify_trust_chains
+from fedservice.entity_statement.cache import TrustChainCache
+from fedservice.entity_statement.cache import TrustMarkStatusCache
+from fedservice.http_client import init_httpc
 
 __author__ = 'Roland Hedberg'
 
@@ -44,11 +46,15 @@ class FederationEntity(Unit):
                  authority_hints: Optional[Union[list, str, Callable]] = None,
                  persistence: Optional[dict] = None,
                  client_authn_methods: Optional[list] = None,
+                 trust_chain_cache_size: Optional[int] = 1000,
+                 trust_mark_status_ttl: Optional[int] = 300,
+                 trust_mark_status_negative_ttl: Optional[int] = 60,
                  **kwargs
                  ):
 
-        if upstream_get is None and httpc is None:
-            httpc = request
+        if upstream_get is None:
+            # A pooled HTTP client unless one is given
+            httpc = init_httpc(httpc)
 
         if not keyjar and not key_conf:
             keyjar = False
@@ -84,7 +90,11 @@ class FederationEntity(Unit):
         if client_authn_methods:
             self.context.client_authn_methods = client_auth_setup(client_authn_methods)
 
-        self.trust_chain = {}
+        # Verified trust chains per entity ID and trust anchor
+        self.trust_chain = TrustChainCache(max_size=trust_chain_cache_size)
+        # Answers from trust mark issuers' status endpoints
+        self.trust_mark_status = TrustMarkStatusCache(positive_ttl=trust_mark_status_ttl,
+                                                      negative_ttl=trust_mark_status_negative_ttl)
 
         self.context.provider_info = self.context.claims.get_server_metadata(
             endpoints=self.server.endpoint.values(),
@@ -270,15 +280,8 @@ class FederationEntity(Unit):
         return _info
 
     def get_trust_chains(self, entity_id):
-        _trust_chains = self.trust_chain.get(entity_id, None)
-        if _trust_chains is None:
-            _trust_chains = get_verified_trust_chains(self, entity_id)
-            if _trust_chains:
-                self.store_trust_chain(entity_id, _trust_chains)
-            else:
-                return []
-
-        return _trust_chains
+        # Cached in self.trust_chain until the trust chains expire
+        return get_verified_trust_chains(self, entity_id)
 
     def store_trust_chain(self, entity_id, trust_chains):
         self.trust_chain[entity_id] = trust_chains
@@ -287,12 +290,7 @@ class FederationEntity(Unit):
         self.trust_chain[entity_id] = chains
 
     def get_verified_metadata(self, entity_id: str, *args):
-        _trust_chains = self.trust_chain.get(entity_id)
-        if _trust_chains is None:
-            _trust_chains = get_verified_trust_chains(self, entity_id)
-            if _trust_chains:
-                self.store_trust_chain(entity_id, _trust_chains)
-
+        _trust_chains = self.get_trust_chains(entity_id)
         if _trust_chains:
             return _trust_chains[0].metadata
         else:
@@ -376,21 +374,29 @@ class FederationEntity(Unit):
 
         if check_with_issuer:
             # This to check that the Trust Mark is still valid according to the Trust Mark Issuer
-            resp = self.do_request("trust_mark_status",
-                                   request_args={
-                                       'sub': verified_trust_mark['sub'],
-                                       'trust_mark_id': verified_trust_mark['trust_mark_id']
-                                   },
-                                   fetch_endpoint=_tmi_trust_chain.metadata["federation_entity"][
-                                       "federation_trust_mark_status_endpoint"]
-                                   )
-            if "active" in resp and resp["active"] == True:
-                pass
-            else:
+            _key = self.trust_mark_status.key(verified_trust_mark['iss'],
+                                              verified_trust_mark['trust_mark_id'],
+                                              verified_trust_mark['sub'],
+                                              verified_trust_mark.get('iat'))
+            _active = self.trust_mark_status.check(
+                _key, lambda: self._trust_mark_status(verified_trust_mark, _tmi_trust_chain),
+                exp=verified_trust_mark.get('exp'))
+            if not _active:
                 return None
 
         return verified_trust_mark
 
+    def _trust_mark_status(self, verified_trust_mark, trust_chain) -> bool:
+        resp = self.do_request("trust_mark_status",
+                               request_args={
+                                   'sub': verified_trust_mark['sub'],
+                                   'trust_mark_id': verified_trust_mark['trust_mark_id']
+                               },
+                               fetch_endpoint=trust_chain.metadata["federation_entity"][
+                                   "federation_trust_mark_status_endpoint"]
+                               )
+        return "active" in resp and resp["active"] == True
+
     @property
     def trust_anchors(self):
         return self.get_function("trust_chain_collector").trust_anchors
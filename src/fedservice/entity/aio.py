@@ -0,0 +1,160 @@
+import inspect
+import logging
+from typing import Callable
+from typing import Optional
+from typing import Union
+
+from cryptojwt import KeyJar
+
+from fedservice.entity import FederationEntity
+from fedservice.entity.client.aio import AsyncHTTPClient
+from fedservice.entity.function import get_payload
+from fedservice.entity.function.aio import get_verified_trust_anchor_statement
+from fedservice.entity.function.aio import get_verified_trust_chains
+
+logger = logging.getLogger(__name__)
+
+SYNC2ASYNC = {
+    'fedservice.entity.client.FederationClient':
+        'fedservice.entity.client.aio.AsyncFederationClient',
+    'fedservice.entity.function.trust_chain_collector.TrustChainCollector':
+        'fedservice.entity.function.aio.AsyncTrustChainCollector'
+}
+
+
+def _asyncify(spec: Optional[dict]) -> Optional[dict]:
+    """
+    Replace the blocking classes in a client or trust chain collector specification
+    with their asynchronous counterparts. The specification is not modified in place.
+    """
+    if not spec:
+        return spec
+
+    _spec = spec.copy()
+    if isinstance(_spec.get("class"), str):
+        _spec["class"] = SYNC2ASYNC.get(_spec["class"], _spec["class"])
+
+    _functions = _spec.get("kwargs", {}).get("functions")
+    if _functions and "trust_chain_collector" in _functions:
+        _spec["kwargs"] = _spec["kwargs"].copy()
+        _spec["kwargs"]["functions"] = _functions.copy()
+        _spec["kwargs"]["functions"]["trust_chain_collector"] = _asyncify(
+            _functions["trust_chain_collector"])
+    return _spec
+
+
+def _is_async(httpc) -> bool:
+    return inspect.iscoroutinefunction(httpc) or inspect.iscoroutinefunction(
+        getattr(httpc, "__call__", None))
+
+
+class AsyncFederationEntity(FederationEntity):
+    """
+    A federation entity for use in an asyncio event loop. Every method that talks to
+    other entities is a coroutine.
+    """
+
+    def __init__(self,
+                 upstream_get: Optional[Callable] = None,
+                 entity_id: str = "",
+                 keyjar: Optional[KeyJar] = None,
+                 key_conf: Optional[dict] = None,
+                 client: Optional[dict] = None,
+                 server: Optional[dict] = None,
+                 function: Optional[dict] = None,
+                 httpc: Optional[object] = None,
+                 httpc_params: Optional[dict] = None,
+                 preference: Optional[dict] = None,
+                 authority_hints: Optional[Union[list, str, Callable]] = None,
+                 persistence: Optional[dict] = None,
+                 client_authn_methods: Optional[list] = None,
+                 **kwargs
+                 ):
+        # Also within a combo, where the HTTP client handed down is a blocking one
+        if not _is_async(httpc):
+            httpc = AsyncHTTPClient()
+
+        FederationEntity.__init__(self, upstream_get=upstream_get, entity_id=entity_id,
+                                  keyjar=keyjar, key_conf=key_conf, client=_asyncify(client),
+                                  server=server, function=_asyncify(function), httpc=httpc,
+                                  httpc_params=httpc_params, preference=preference,
+                                  authority_hints=authority_hints, persistence=persistence,
+                                  client_authn_methods=client_authn_methods, **kwargs)
+
+    async def do_request(
+            self,
+            request_type: str,
+            response_body_type: Optional[str] = "",
+            request_args: Optional[dict] = None,
+            behaviour_args: Optional[dict] = None,
+            **kwargs):
+        return await self.client.do_request(request_type=request_type,
+                                            response_body_type=response_body_type,
+                                            request_args=request_args,
+                                            behaviour_args=behaviour_args,
+                                            **kwargs)
+
+    async def get_trust_chains(self, entity_id):
+        # Cached in self.trust_chain until the trust chains expire
+        return await get_verified_trust_chains(self, entity_id)
+
+    async def get_verified_metadata(self, entity_id: str, *args):
+        _trust_chains = await self.get_trust_chains(entity_id)
+        if _trust_chains:
+            return _trust_chains[0].metadata
+        else:
+            return None
+
+    async def get_federation_entity_metadata(self, entity_id: str, *args):
+        metadata = await self.get_verified_metadata(entity_id, *args)
+        if metadata:
+            return metadata["federation_entity"]
+        else:
+            return metadata
+
+    async def verify_trust_mark(self, trust_mark: str, check_with_issuer: Optional[bool] = True):
+        _trust_mark_payload = get_payload(trust_mark)
+        _tmi_trust_chains = await self.get_trust_chains(_trust_mark_payload['iss'])
+        if not _tmi_trust_chains:
+            return None
+
+        _tmi_trust_chain = _tmi_trust_chains[0]
+        _trust_anchor_statement = await get_verified_trust_anchor_statement(
+            self, _tmi_trust_chain.anchor)
+
+        # Everything that needs to be fetched is now at hand, what remains is local
+        verified_trust_mark = self.function.trust_mark_verifier(
+            trust_mark=trust_mark, trust_anchor=_tmi_trust_chain.anchor,
+            trust_anchor_statement=_trust_anchor_statement, trust_chains=_tmi_trust_chains)
+        if not verified_trust_mark:
+            return None
+
+        if check_with_issuer:
+            _key = self.trust_mark_status.key(verified_trust_mark['iss'],
+                                              verified_trust_mark['trust_mark_id'],
+                                              verified_trust_mark['sub'],
+                                              verified_trust_mark.get('iat'))
+            _active = await self.trust_mark_status.acheck(
+                _key, lambda: self._atrust_mark_status(verified_trust_mark, _tmi_trust_chain),
+                exp=verified_trust_mark.get('exp'))
+            if not _active:
+                return None
+
+        return verified_trust_mark
+
+    async def _atrust_mark_status(self, verified_trust_mark, trust_chain) -> bool:
+        resp = await self.do_request(
+            "trust_mark_status",
+            request_args={
+                'sub': verified_trust_mark['sub'],
+                'trust_mark_id': verified_trust_mark['trust_mark_id']
+            },
+            fetch_endpoint=trust_chain.metadata["federation_entity"][
+                "federation_trust_mark_status_endpoint"]
+        )
+        return "active" in resp and resp["active"] == True
+
+    async def aclose(self):
+        _aclose = getattr(self.httpc, "aclose", None)
+        if _aclose:
+            await _aclose()
@@ -27,6 +27,7 @@ from requests import request
 
 from fedservice.defaults import DEFAULT_FEDERATION_ENTITY_SERVICES
 from fedservice.entity import FederationContext
+from fedservice.http_cache import HTTPCache
 
 logger = logging.getLogger(__name__)
 
@@ -279,6 +280,8 @@ class FederationClient(FederationClientEntity):
         )
 
         self.httpc = httpc or request
+        # Validators and freshness of responses to GET requests
+        self.http_cache = HTTPCache()
 
         if isinstance(config, Configuration):
             _add_ons = config.conf.get("add_ons")
@@ -341,12 +344,37 @@ class FederationClient(FederationClientEntity):
         if _data and not body:
             body = _data
 
+        if method == "GET":
+            _cached = self.http_cache.fresh(url)
+            if _cached:
+                return self._handle_response(service, _cached, body, response_body_type,
+                                             **kwargs)
+            headers = self._conditional_headers(url, headers)
+
         try:
             resp = self.httpc(method, url, data=body, headers=headers, **self.httpc_params)
         except Exception as err:
             logger.error("Exception on request: {}".format(err))
             raise
 
+        if method == "GET":
+            resp = self.http_cache.update(url, resp)
+        return self._handle_response(service, resp, body, response_body_type, **kwargs)
+
+    def _conditional_headers(self, url: str, headers: Optional[dict] = None) -> dict:
+        _headers = self.http_cache.conditional_headers(url)
+        if headers:
+            _headers.update(headers)
+        return _headers
+
+    def _handle_response(
+            self,
+            service: Service,
+            resp,
+            body: Optional[dict] = None,
+            response_body_type: Optional[str] = "",
+            **kwargs
+    ):
         if 300 <= resp.status_code < 400:
             return {"http_response": resp}
         elif resp.status_code >= 400:
@@ -0,0 +1,182 @@
+import importlib.util
+import logging
+from typing import Optional
+
+from idpyoidc.client.service import REQUEST_INFO
+from idpyoidc.client.service import Service
+from idpyoidc.message import Message
+
+from fedservice.entity.client import FederationClient
+from fedservice.entity.function.aio import get_verified_endpoint
+from fedservice.entity.utils import get_federation_entity
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncHTTPClient(object):
+    """
+    Pooled asynchronous HTTP client. Called the same way as requests.request but
+    returns a coroutine. Connections are kept alive and reused between requests.
+    """
+
+    def __init__(self,
+                 max_connections: Optional[int] = 100,
+                 max_keepalive_connections: Optional[int] = 20,
+                 timeout: Optional[float] = 10.0,
+                 http2: Optional[bool] = True):
+        if httpx is None:
+            raise ImportError("AsyncHTTPClient needs the httpx package")
+
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive_connections)
+        self.timeout = timeout
+        # HTTP/2 is only possible if the h2 package is installed
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        # One connection pool per TLS verification setting
+        self._client = {}
+
+    def _get_client(self, verify):
+        _client = self._client.get(verify)
+        if _client is None:
+            _client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout, verify=verify,
+                                        http2=self.http2)
+            self._client[verify] = _client
+        return _client
+
+    async def __call__(self,
+                       method: str,
+                       url: str,
+                       data: Optional[str] = None,
+                       headers: Optional[dict] = None,
+                       verify: Optional[bool] = True,
+                       timeout: Optional[float] = None,
+                       allow_redirects: Optional[bool] = True,
+                       **kwargs):
+        if kwargs:
+            logger.debug(f"Ignored HTTP client arguments: {list(kwargs.keys())}")
+
+        _kwargs = {"headers": headers, "follow_redirects": allow_redirects}
+        if timeout:
+            _kwargs["timeout"] = timeout
+        if isinstance(data, dict):
+            _kwargs["data"] = data
+        elif data:
+            _kwargs["content"] = data
+
+        return await self._get_client(verify).request(method, url, **_kwargs)
+
+    async def aclose(self):
+        for _client in self._client.values():
+            await _client.aclose()
+        self._client = {}
+
+
+class AsyncFederationClient(FederationClient):
+    """
+    A federation client whose requests are coroutines. The HTTP client must be an
+    asynchronous one like :py:class:`AsyncHTTPClient`.
+    """
+
+    async def _get_endpoint(self, service: Service, **kwargs) -> dict:
+        # Services that would otherwise do a blocking lookup of the endpoint to use
+        if service.service_name == "entity_statement" and not kwargs.get("fetch_endpoint"):
+            _collector = get_federation_entity(self).function.trust_chain_collector
+            return {
+                "fetch_endpoint": await _collector.get_federation_fetch_endpoint(
+                    kwargs.get("issuer"))
+            }
+        elif service.service_name == "list" and not kwargs.get("endpoint"):
+            return {
+                "endpoint": await get_verified_endpoint(self, kwargs.get("entity_id"),
+                                                        service.endpoint_name)
+            }
+        return {}
+
+    async def do_request(
+            self,
+            request_type: str,
+            response_body_type: Optional[str] = "",
+            request_args: Optional[dict] = None,
+            behaviour_args: Optional[dict] = None,
+            **kwargs
+    ):
+        _srv = self.service[request_type]
+        self.context.issuer = kwargs.get("entity_id", kwargs.get("issuer"))
+        kwargs.update(await self._get_endpoint(_srv, **kwargs))
+        _info = _srv.get_request_parameters(request_args=request_args,
+                                            behaviour_args=behaviour_args, **kwargs)
+        if not _info:
+            return None
+
+        if not response_body_type:
+            response_body_type = _srv.response_body_type
+
+        logger.debug("do_request info: {}".format(_info))
+
+        _state = kwargs.get("state", "")
+        return await self.service_request(
+            _srv, response_body_type=response_body_type, state=_state,
+            behaviour_args=behaviour_args, **_info
+        )
+
+    async def get_response(
+            self,
+            service: Service,
+            url: str,
+            method: Optional[str] = "GET",
+            body: Optional[dict] = None,
+            response_body_type: Optional[str] = "",
+            headers: Optional[dict] = None,
+            **kwargs
+    ):
+        _data = kwargs.get("data")
+        if _data and not body:
+            body = _data
+
+        if method == "GET":
+            _cached = self.http_cache.fresh(url)
+            if _cached:
+                return self._handle_response(service, _cached, body, response_body_type,
+                                             **kwargs)
+            headers = self._conditional_headers(url, headers)
+
+        try:
+            resp = await self.httpc(method, url, data=body, headers=headers, **self.httpc_params)
+        except Exception as err:
+            logger.error("Exception on request: {}".format(err))
+            raise
+
+        if method == "GET":
+            resp = self.http_cache.update(url, resp)
+        return self._handle_response(service, resp, body, response_body_type, **kwargs)
+
+    async def service_request(
+            self,
+            service: Service,
+            url: str,
+            method: Optional[str] = "GET",
+            body: Optional[dict] = None,
+            response_body_type: Optional[str] = "",
+            headers: Optional[dict] = None,
+            **kwargs
+    ) -> Message:
+        if headers is None:
+            headers = {}
+
+        logger.debug(REQUEST_INFO.format(url, method, body, headers))
+
+        _get_response_func = getattr(self, "get_response_ext", getattr(self, "get_response"))
+        response = await _get_response_func(
+            service, url, method, body, response_body_type, headers, **kwargs
+        )
+
+        if "error" in response:
+            pass
+        else:
+            service.update_service_context(response, key=kwargs.get("state"), **kwargs)
+        return response
@@ -47,7 +47,8 @@ class List(FederationService):
             endpoint = get_verified_endpoint(self, entity_id, self.endpoint_name)
 
         qpart = {}
-        for arg in ["entity_type", "trust_marked", "trust_mark_id", "intermediate"]:
+        for arg in ["entity_type", "trust_marked", "trust_mark_id", "intermediate", "limit",
+                    "from_entity_id"]:
             val = kwargs.get(arg)
             if val:
                 qpart[arg] = val
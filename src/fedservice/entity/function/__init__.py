@@ -1,40 +1,59 @@
+import inspect
 import logging
 from typing import Callable
 from typing import List
 from typing import Optional
 
-from cryptojwt import as_unicode
-from cryptojwt.jws.jws import factory
+from cryptojwt import KeyBundle
+from cryptojwt.exception import VerificationError
 from cryptojwt.jwt import JWT
+from cryptojwt.jwt import utc_time_sans_frac
 from cryptojwt.key_jar import KeyJar
 from idpyoidc.impexp import ImpExp
 from idpyoidc.key_import import import_jwks
 
 from fedservice.entity.utils import get_federation_entity
+from fedservice.entity_statement.statement import parse_statement
 
 logger = logging.getLogger(__name__)
 
 
 def unverified_entity_statement(signed_jwt):
-    _jws = factory(signed_jwt)
-    return _jws.jwt.payload()
+    return parse_statement(signed_jwt).payload()
 
 
-def verify_self_signed_signature(token):
+def verify_self_signed(token) -> dict:
     """
     Verify signature using only keys in the entity statement.
-    Will raise exception if signature verification fails.
+    Will raise exception if signature verification fails or the statement has expired.
 
     :param token: Signed JWT
     :return: Payload of the signed JWT
     """
+    _statement = parse_statement(token)
+    if _statement.jws is None:
+        raise ValueError(f"Not a proper signed JWT: {token}")
+
+    _keys = KeyBundle(keys=_statement.payload()['jwks']['keys']).keys()
+    _val = _statement.jws.verify_compact(keys=_keys)
+
+    _now = utc_time_sans_frac()
+    if "nbf" in _val and _now < int(_val["nbf"]):
+        raise VerificationError("Token not yet valid")
+    if "exp" in _val and _now >= int(_val["exp"]):
+        raise VerificationError("Token expired")
+    return _val
 
-    payload = unverified_entity_statement(token)
-    keyjar = KeyJar()
-    keyjar = import_jwks(keyjar, payload['jwks'], payload['iss'])
 
-    _jwt = JWT(key_jar=keyjar)
-    _val = _jwt.unpack(token)
+def verify_self_signed_signature(token):
+    """
+    Verify signature using only keys in the entity statement.
+    Will raise exception if signature verification fails.
+
+    :param token: Signed JWT
+    :return: Payload of the signed JWT
+    """
+    _val = verify_self_signed(token)
     _val["_jws"] = token
     return _val
 
@@ -69,6 +88,19 @@ def tree2chains(unit):
     return res
 
 
+def get_trust_chain_collector(federation_entity):
+    """
+    The trust chain collector of a federation entity, for use by blocking code.
+    The collector of an :py:class:`fedservice.entity.aio.AsyncFederationEntity` has to be
+    used through the coroutines in :py:mod:`fedservice.entity.function.aio`.
+    """
+    _collector = federation_entity.function.trust_chain_collector
+    if inspect.iscoroutinefunction(_collector.get_entity_configuration):
+        raise TypeError(f"{_collector.__class__.__name__} is asynchronous, "
+                        "use the functions in fedservice.entity.function.aio")
+    return _collector
+
+
 def collect_trust_chains(unit,
                          entity_id: str,
                          signed_entity_configuration: Optional[str] = "",
@@ -76,7 +108,7 @@ def collect_trust_chains(unit,
                          authority_hints: Optional[list] = None):
     _federation_entity = get_federation_entity(unit)
 
-    _collector = _federation_entity.function.trust_chain_collector
+    _collector = get_trust_chain_collector(_federation_entity)
 
     # Collect the trust chains
     if signed_entity_configuration:
@@ -146,9 +178,7 @@ def apply_policies(unit, trust_chains):
 
 
 def get_payload(self_signed_statement):
-    _jws = as_unicode(self_signed_statement)
-    _jwt = factory(_jws)
-    return _jwt.jwt.payload()
+    return parse_statement(self_signed_statement).payload()
 
 
 class Function(ImpExp):
@@ -159,12 +189,36 @@ class Function(ImpExp):
 
 
 def get_verified_trust_chains(unit, entity_id):
+    _federation_entity = get_federation_entity(unit)
+    # Already verified and not expired trust chains are cached
+    _cache = getattr(_federation_entity, "trust_chain", None)
+    if _cache is None:
+        return _resolve_trust_chains(unit, entity_id, None)
+
+    _trust_chains = _cache.get(entity_id)
+    if _trust_chains:
+        return _trust_chains
+    # Concurrent callers asking for the same entity wait for one resolution. The trust
+    # chains are kept by the cache, each caller gets copies of its own.
+    _trust_chains = _cache.single_flight.do(entity_id, _resolve_trust_chains, unit, entity_id,
+                                            _cache)
+    return [_tc.copy() for _tc in _trust_chains]
+
+
+def _resolve_trust_chains(unit, entity_id, cache):
+    _federation_entity = get_federation_entity(unit)
     chains, leaf_ec = collect_trust_chains(unit, entity_id)
     if len(chains) == 0:
         return []
 
     trust_chains = verify_trust_chains(unit, chains, leaf_ec)
     trust_chains = apply_policies(unit, trust_chains)
+    if trust_chains and cache is not None:
+        cache[entity_id] = trust_chains
+        # Keep them fresh if so configured
+        _refresher = getattr(_federation_entity.function, "trust_chain_refresher", None)
+        if _refresher:
+            _refresher.schedule(entity_id, trust_chains)
     return trust_chains
 
 
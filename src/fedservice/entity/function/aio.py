@@ -0,0 +1,417 @@
+"""
+Asyncio versions of the trust chain collection and verification functions.
+The HTTP client used must be a coroutine function with the same calling convention
+as requests.request, for instance :py:class:`fedservice.entity.client.aio.AsyncHTTPClient`.
+"""
+import asyncio
+import logging
+from typing import Callable
+from typing import List
+from typing import Optional
+from typing import Union
+
+from cryptojwt import KeyJar
+from idpyoidc.exception import MissingPage
+from idpyoidc.message import Message
+
+from fedservice.entity.function import apply_policies
+from fedservice.entity.function import tree2chains
+from fedservice.entity.function import verify_self_signed_signature
+from fedservice.entity.function import verify_trust_chains as sync_verify_trust_chains
+from fedservice.entity.function.trust_anchor import verify_trust_anchor_statement
+from fedservice.entity.function.trust_chain_collector import cache_key
+from fedservice.entity.function.trust_chain_collector import get_endpoint
+from fedservice.entity.function.trust_chain_collector import TrustChainCollector
+from fedservice.entity.utils import get_federation_entity
+from fedservice.utils import statement_is_expired
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTrustChainCollector(TrustChainCollector):
+    """
+    Collects the superiors of an entity without blocking. All the branches on one level
+    of the tree are collected at the same time. At most max_concurrency HTTP requests
+    are outstanding per collection.
+    """
+
+    def __init__(self,
+                 upstream_get: Callable,
+                 trust_anchors: dict,
+                 allowed_delta: int = 300,
+                 keyjar: Optional[KeyJar] = None,
+                 max_concurrency: Optional[int] = 10,
+                 **kwargs
+                 ):
+        TrustChainCollector.__init__(self, upstream_get=upstream_get,
+                                     trust_anchors=trust_anchors, allowed_delta=allowed_delta,
+                                     keyjar=keyjar, max_concurrency=max_concurrency, **kwargs)
+
+    async def get_document(self, url: str):
+        """
+
+        :param url: Target URL
+        :return: Signed EntityStatement
+        """
+        _cached = self.http_cache.fresh(url)
+        if _cached:
+            return self._parse_document_response(url, _cached)
+        # Concurrent requests for the same document share one HTTP request
+        return await self.single_flight.ado(url, self._fetch_document, url)
+
+    async def _fetch_document(self, url: str):
+        _httpc_params = self._conditional_httpc_params(url)
+        try:
+            response = await self.upstream_get('attribute', 'httpc')("GET", url, **_httpc_params)
+        except Exception as err:
+            logger.error(f'Could not connect to {url}:{err}')
+            raise
+
+        return self._parse_document_response(url, self.http_cache.update(url, response))
+
+    async def get_entity_configuration(self, entity_id):
+        """
+        Get configuration information about an entity from itself.
+
+        :param entity_id: About whom the entity statement should be
+        :return: Configuration information as a signed JWT
+        """
+        logger.debug(f"--get_configuration_information({entity_id})")
+        _serv = self._get_service('entity_configuration')
+        _res = _serv.get_request_parameters(request_args={"entity_id": entity_id})
+        logger.debug(f"Get configuration from: {_res['url']}")
+        try:
+            return await self.get_document(_res['url'])
+        except MissingPage:  # if tenant involved
+            _tres = _serv.get_request_parameters(request_args={"entity_id": entity_id}, tenant=True)
+            logger.debug(f"Get configuration from (tenant): '{entity_id}'")
+            if _tres["url"] != _res["url"]:
+                return await self.get_document(_tres["url"])
+            else:
+                raise MissingPage(f"No such page: '{_tres['url']}'")
+
+    async def get_metadata(self, entity_id):
+        _ec = self.config_cache.get(entity_id)
+        if _ec and statement_is_expired(_ec):
+            _ec = None
+
+        if _ec is None:
+            _federation_entity = get_federation_entity(self)
+            _chains, _ = await collect_trust_chains(_federation_entity, entity_id)
+            await verify_trust_chains(_federation_entity, _chains)
+            _ec = self.config_cache[entity_id]
+
+        return _ec['metadata']
+
+    async def get_verified_self_signed_entity_configuration(self, entity_id: str):
+        signed_entity_config = await self.get_entity_configuration(entity_id)
+        if signed_entity_config is None:
+            return ''
+
+        return verify_self_signed_signature(signed_entity_config)
+
+    async def get_federation_fetch_endpoint(self, intermediate: str) -> str:
+        logger.debug(f'--get_federation_fetch_endpoint({intermediate})')
+        fed_fetch_endpoint = self._cached_fetch_endpoint(intermediate)
+
+        if not fed_fetch_endpoint:
+            signed_entity_config = await self.get_entity_configuration(intermediate)
+            if signed_entity_config is None:
+                return ''
+
+            entity_config = self._store_entity_configuration(intermediate, signed_entity_config)
+            fed_fetch_endpoint = get_endpoint("fetch", entity_config)
+
+        return fed_fetch_endpoint
+
+    async def get_entity_statement(self, fetch_endpoint, issuer, subject):
+        _serv = self._get_service('entity_statement')
+        _res = _serv.get_request_parameters(subject=subject, fetch_endpoint=fetch_endpoint,
+                                            issuer=issuer)
+        return await self.get_document(_res['url'])
+
+    async def _get_entity_statement(self, entity: str, authority: str) -> Optional[str]:
+        entity_statement = self._cached_entity_statement(entity, authority)
+
+        if entity_statement is None:
+            fed_fetch_endpoint = await self.get_federation_fetch_endpoint(authority)
+            if not fed_fetch_endpoint:
+                return None
+            entity_statement = await self.get_entity_statement(fed_fetch_endpoint, authority,
+                                                               entity)
+            self._store_entity_statement(entity, authority, entity_statement)
+
+        return entity_statement
+
+    async def refresh_entity_configuration(self, entity_id: str) -> dict:
+        """See :py:meth:`TrustChainCollector.refresh_entity_configuration`."""
+        signed_entity_config = await self.get_entity_configuration(entity_id)
+        return self._store_entity_configuration(entity_id, signed_entity_config)
+
+    async def refresh_entity_statement(self, entity: str, authority: str) -> str:
+        """See :py:meth:`TrustChainCollector.refresh_entity_statement`."""
+        fed_fetch_endpoint = await self.get_federation_fetch_endpoint(authority)
+        entity_statement = await self.get_entity_statement(fed_fetch_endpoint, authority, entity)
+        self._store_entity_statement(entity, authority, entity_statement)
+        return entity_statement
+
+    async def collect_branch(self, entity, authority, seen=None, max_superiors=10, stop_at=""):
+        """See :py:meth:`TrustChainCollector.collect_branch`."""
+        logger.debug(f'Get view of "{entity}" from "{authority}"')
+        if entity == authority and entity in self.trust_anchors:
+            return None
+
+        _seen = [] if seen is None else seen[:]
+        _seen.append(authority)
+
+        entity_statement = await self._get_entity_statement(entity, authority)
+        if entity_statement:
+            _entity_configuration = self.config_cache[authority]
+            return entity_statement, await self.collect_tree(authority,
+                                                             _entity_configuration,
+                                                             stop_at=stop_at,
+                                                             seen=_seen,
+                                                             max_superiors=max_superiors)
+        else:
+            return None
+
+    async def collect_tree_concurrently(self,
+                                        entity_id: str,
+                                        entity_configuration: Union[dict, Message],
+                                        seen: Optional[list] = None,
+                                        stop_at: Optional[str] = "") -> dict:
+        # collect_tree() already collects all the branches on a level at the same time
+        return await self.collect_tree(entity_id, entity_configuration, seen=seen,
+                                       stop_at=stop_at)
+
+    async def collect_tree(self,
+                           entity_id: str,
+                           entity_configuration: Union[dict, Message],
+                           seen: Optional[list] = None,
+                           max_superiors: Optional[int] = 1,
+                           stop_at: Optional[str] = "") -> dict:
+        """
+        Collect superiors one level at the time. All branches on a level are collected
+        concurrently.
+
+        :param entity_id: The entity ID
+        :param entity_configuration: Entity Configuration as a dictionary
+        :param seen: A list of authorities that this process has seen.
+        :param max_superiors: The maximum number of superiors.
+        :param stop_at: The ID of the trust anchor at which the trust chain should stop.
+        :return: Dictionary of superiors
+        """
+        superior = {}
+        _semaphore = asyncio.Semaphore(max(self.max_concurrency or 1, 1))
+
+        async def _fetch(entity, authority):
+            async with _semaphore:
+                return await self._get_entity_statement(entity, authority)
+
+        branches = self._branches(entity_id, entity_configuration, seen or [], stop_at, superior)
+        while branches:
+            _keys = list(dict.fromkeys((branch[0], branch[1]) for branch in branches))
+            _statements = dict(zip(_keys, await asyncio.gather(*[_fetch(*k) for k in _keys])))
+
+            _next_level = []
+            for entity, authority, _seen, _superior in branches:
+                entity_statement = _statements[(entity, authority)]
+                if entity_statement:
+                    _tree = {}
+                    _superior[authority] = (entity_statement, _tree)
+                    _next_level.extend(self._branches(authority, self.config_cache[authority],
+                                                      _seen, stop_at, _tree))
+            branches = _next_level
+
+        return superior
+
+    async def revalidate_tree(self,
+                              entity_id: str,
+                              entity_configuration: Union[dict, Message],
+                              previous: dict,
+                              seen: Optional[list] = None,
+                              stop_at: Optional[str] = "") -> dict:
+        """
+        Update a previously collected tree. Only the subordinate statements that have
+        expired are fetched anew, the rest of the tree is reused as is.
+        See :py:meth:`TrustChainCollector.revalidate_tree`.
+        """
+        superior = {}
+        if seen is None:
+            seen = []
+
+        if 'authority_hints' not in entity_configuration:
+            return superior
+        elif entity_configuration['iss'] == stop_at:
+            return superior
+
+        for authority in entity_configuration['authority_hints']:
+            _previous = previous.get(authority)
+            if _previous is None:
+                # Collect a new branch
+                _tree = await self.collect_tree(entity_id,
+                                                {"iss": entity_id, "authority_hints": [authority]},
+                                                seen=seen, stop_at=stop_at)
+                superior[authority] = _tree[authority]
+                continue
+
+            _statement, _previous_tree = _previous
+            _cached = self._cached_entity_statement(entity_id, authority)
+            if _cached:
+                _statement = _cached
+            elif not self._is_fresh(_statement):
+                logger.debug(f"Statement by {authority} about {entity_id} has expired")
+                _statement = await self._get_entity_statement(entity_id, authority)
+                if not _statement:
+                    superior[authority] = None
+                    continue
+            else:
+                # Reused, get_chain() expects to find it in the cache
+                self._store_entity_statement(entity_id, authority, _statement)
+
+            _seen = seen[:]
+            _seen.append(authority)
+            superior[authority] = (_statement, await self.revalidate_tree(
+                authority, self._superior_hints(authority, _previous_tree), _previous_tree,
+                seen=_seen, stop_at=stop_at))
+
+        return superior
+
+    async def __call__(self,
+                       entity_id: str,
+                       max_superiors: Optional[int] = 10,
+                       seen: Optional[List[str]] = None,
+                       stop_at: Optional[str] = ''):
+        signed_entity_config = self._cached_signed_entity_configuration(entity_id)
+        if signed_entity_config:
+            entity_config = self.config_cache.get(entity_id)
+        else:
+            signed_entity_config = await self.get_entity_configuration(entity_id)
+            if not signed_entity_config:
+                logger.warning(f"Could not find any entity configuration for {entity_id}")
+                return None
+            entity_config = self._store_entity_configuration(entity_id, signed_entity_config)
+
+        _tree_key = cache_key(stop_at, entity_id)
+        _previous = self.tree_cache[_tree_key] if self.incremental else None
+        if _previous is not None:
+            _tree = await self.revalidate_tree(entity_id, entity_config, _previous, seen=seen,
+                                               stop_at=stop_at)
+        else:
+            _tree = await self.collect_tree(entity_id, entity_config, seen=seen, stop_at=stop_at)
+        if self.incremental and _tree is not None:
+            self.tree_cache[_tree_key] = _tree
+        return _tree, signed_entity_config
+
+
+    async def _signed_entity_configuration(self, entity_id: str) -> Optional[str]:
+        _entity_config = self.config_cache[entity_id]
+        if _entity_config:
+            return _entity_config['_jws']
+        _signed_entity_config = await self.get_entity_configuration(entity_id)
+        if _signed_entity_config:
+            self._store_entity_configuration(entity_id, _signed_entity_config)
+        return _signed_entity_config
+
+    async def get_chain(self, iss_path, trust_anchor, with_ta_ec: Optional[bool] = False):
+        res = [await self._signed_entity_configuration(iss_path[0])]
+        for i in range(len(iss_path) - 1):
+            _statement = self.entity_statement_cache[cache_key(iss_path[i + 1], iss_path[i])]
+            if _statement is None:
+                _statement = await self._get_entity_statement(iss_path[i], iss_path[i + 1])
+            res.append(_statement)
+        if with_ta_ec:
+            res.append(await self._signed_entity_configuration(trust_anchor))
+        return res
+
+async def collect_trust_chains(unit,
+                               entity_id: str,
+                               signed_entity_configuration: Optional[str] = "",
+                               stop_at: Optional[str] = "",
+                               authority_hints: Optional[list] = None):
+    _federation_entity = get_federation_entity(unit)
+
+    _collector = _federation_entity.function.trust_chain_collector
+
+    # Collect the trust chains
+    if signed_entity_configuration:
+        entity_configuration = verify_self_signed_signature(signed_entity_configuration)
+        if authority_hints:
+            entity_configuration["authority_hints"] = authority_hints
+        tree = await _collector.collect_tree(entity_id, entity_configuration, stop_at=stop_at)
+    else:
+        try:
+            _collector_response = await _collector(entity_id, stop_at=stop_at)
+        except Exception as err:
+            logger.error(f"Trust chain collection failed {err}")
+            raise (err)
+        if _collector_response:
+            tree, signed_entity_configuration = _collector_response
+        else:
+            tree = None
+
+    if tree:
+        chains = tree2chains(tree)
+        logger.debug("%d chains", len(chains))
+        return chains, signed_entity_configuration
+    elif tree == {}:
+        return [], signed_entity_configuration
+    else:
+        return [], None
+
+
+async def verify_trust_chains(unit, chains: List[List[str]], *entity_statements):
+    # Verification is done locally, no I/O involved.
+    return sync_verify_trust_chains(unit, chains, *entity_statements)
+
+
+async def get_verified_trust_chains(unit, entity_id):
+    # Already verified and not expired trust chains are cached
+    _cache = getattr(get_federation_entity(unit), "trust_chain", None)
+    if _cache is None:
+        return await _resolve_trust_chains(unit, entity_id, None)
+
+    _trust_chains = _cache.get(entity_id)
+    if _trust_chains:
+        return _trust_chains
+    # Concurrent callers asking for the same entity wait for one resolution. The trust
+    # chains are kept by the cache, each caller gets copies of its own.
+    _trust_chains = await _cache.single_flight.ado(entity_id, _resolve_trust_chains, unit,
+                                                   entity_id, _cache)
+    return [_tc.copy() for _tc in _trust_chains]
+
+
+async def _resolve_trust_chains(unit, entity_id, cache):
+    chains, leaf_ec = await collect_trust_chains(unit, entity_id)
+    if len(chains) == 0:
+        return []
+
+    trust_chains = await verify_trust_chains(unit, chains, leaf_ec)
+    trust_chains = apply_policies(unit, trust_chains)
+    if trust_chains and cache is not None:
+        cache[entity_id] = trust_chains
+    return trust_chains
+
+
+async def get_verified_trust_anchor_statement(federation_entity, entity_id: str):
+    _collector = federation_entity.function.trust_chain_collector
+    _ec = await _collector.get_entity_configuration(entity_id)
+    return verify_trust_anchor_statement(federation_entity, _ec)
+
+
+async def get_verified_endpoint(unit, entity_id: str, endpoint_name: str) -> Optional[str]:
+    _federation_entity = get_federation_entity(unit)
+
+    if entity_id in _federation_entity.trust_anchors:
+        res = await get_verified_trust_anchor_statement(_federation_entity, entity_id)
+        _metadata = res.get("metadata", {})
+    else:
+        _trust_chains = await get_verified_trust_chains(unit, entity_id)
+        if not _trust_chains:
+            return None
+        _metadata = _federation_entity.pick_trust_chain(_trust_chains).metadata
+
+    try:
+        return _metadata["federation_entity"].get(endpoint_name)
+    except KeyError:
+        return None
@@ -1,9 +1,15 @@
+import copy
+import functools
+import hashlib
+import json
 import logging
 from typing import Optional
 
 from fedservice.entity.function import Function
 from fedservice.entity.function import PolicyError
 from fedservice.entity.function.policy_operator import construct_evaluation_sequence
+from fedservice.entity_statement.cache import ESCache
+from fedservice.entity_statement.statement import LazyMetadata
 from fedservice.entity_statement.statement import TrustChain
 
 logger = logging.getLogger(__name__)
@@ -501,11 +507,70 @@ def apply_metadata_policy(metadata, metadata_policy, policy_operators):
     return metadata
 
 
+def compile_metadata_policy(metadata_policy: dict, policy_operators: list) -> list:
+    """
+    Turn a metadata policy into, per claim, the list of checks that should be applied
+    in the order given by policy_operators.
+
+    :return: List of (claim, checks) tuples
+    """
+    _compiled = []
+    for claim, _claim_policy in metadata_policy.items():
+        _checks = [operator.compile(claim, _claim_policy[operator.name])
+                   for operator in policy_operators if operator.name in _claim_policy]
+        if _checks:
+            _compiled.append((claim, _checks))
+    return _compiled
+
+
+class CompiledPolicy(object):
+    """
+    A combined policy, metadata and metadata_policy, prepared to be applied to
+    many metadata statements.
+    """
+
+    def __init__(self, policy: dict, policy_operators: list):
+        self.policy = policy
+        self.metadata = policy.get("metadata") or {}
+        self.checks = compile_metadata_policy(policy.get("metadata_policy") or {},
+                                              policy_operators)
+
+    def __call__(self, metadata: dict) -> dict:
+        """
+        :param metadata: Metadata statement, is not changed
+        :return: A metadata statement that adheres to the policy
+        """
+        if self.metadata:
+            # what's in metadata policy metadata overrides what's in leaf's metadata
+            _metadata = copy.deepcopy(self.metadata)
+        else:
+            _metadata = dict(metadata)
+        for _claim, _checks in self.checks:
+            for _check in _checks:
+                _check(_metadata)
+        return _metadata
+
+
+def statement_digest(statement: dict, entity_type: str) -> str:
+    """
+    A digest over the parts of a statement the combined policy for an entity type
+    depends on.
+    """
+    _info = [statement.get(_item, {}).get(entity_type) for _item in ['metadata_policy', 'metadata']]
+    return hashlib.sha256(json.dumps(_info, sort_keys=True, default=str).encode()).hexdigest()
+
+
 class TrustChainPolicy(Function):
 
-    def __init__(self, upstream_get):
+    def __init__(self, upstream_get, cache_size: Optional[int] = 1000):
+        """
+        :param cache_size: The maximum number of combined policies to keep
+        """
         Function.__init__(self, upstream_get)
         self.policy_operators = construct_evaluation_sequence()
+        # Combined and compiled policies, keyed by entity type and the digests of the
+        # statements they were combined from.
+        self.policy_cache = ESCache(allowed_delta=0, max_size=cache_size)
 
     def gather_policies(self, chain, entity_type):
         """
@@ -540,27 +605,35 @@ class TrustChainPolicy(Function):
 
         return _rule
 
+    def compiled_policy(self, chain: list, entity_type: str) -> CompiledPolicy:
+        """
+        The combined policy of the statements in a chain. Combined and compiled once
+        for each set of statements.
+
+        :param chain: A list of Entity Statements
+        :return: CompiledPolicy instance
+        """
+        _key = (entity_type, tuple(statement_digest(_es, entity_type) for _es in chain))
+        _compiled = self.policy_cache[_key]
+        if _compiled is None:
+            # The statements' policies must not be shared with the cached policy
+            _combined = copy.deepcopy(self.gather_policies(chain, entity_type))
+            _compiled = CompiledPolicy(_combined, self.policy_operators)
+            self.policy_cache[_key] = _compiled
+        return _compiled
+
     def apply_policy(self, metadata: dict, policy: dict, protocol: Optional[str] = "oidc") -> dict:
         """
         Apply a metadata policy on metadata
 
         :param metadata: Metadata statements
-        :param policy: A dictionary with metadata and metadata_policy as keys
+        :param policy: A dictionary with metadata and metadata_policy as keys or a
+            CompiledPolicy instance
         :return: A metadata statement that adheres to a metadata policy
         """
-
-        _metadata = policy.get("metadata", None)
-        if _metadata:
-            # what's in metadata policy metadata overrides what's in leaf's metadata
-            metadata.update(_metadata)
-            metadata = _metadata
-
-        _metadata_policy = policy.get('metadata_policy', None)
-        if _metadata_policy:
-            metadata = apply_metadata_policy(metadata, _metadata_policy, self.policy_operators)
-
-        # All that are in metadata but not in policy should just remain
-        # metadata.update(policy.get('metadata', {}))
+        if not isinstance(policy, CompiledPolicy):
+            policy = CompiledPolicy(policy, self.policy_operators)
+        metadata = policy(metadata)
 
         # This is a protocol specific adjustment
         if protocol in ["oidc", "oauth2"]:
@@ -568,35 +641,51 @@ class TrustChainPolicy(Function):
         else:
             return metadata
 
-    def _policy(self, trust_chain: TrustChain, entity_type: str):
-        combined_policy = self.gather_policies(trust_chain.verified_chain[:-1], entity_type)
-        logger.debug("Combined policy: %s", combined_policy)
+    def _policy(self, trust_chain: TrustChain, entity_type: str,
+                leaf_metadata: Optional[dict] = None):
+        _compiled = self.compiled_policy(trust_chain.verified_chain[:-1], entity_type)
+        logger.debug("Combined policy: %s", _compiled.policy)
+        if leaf_metadata is None:
+            leaf_metadata = trust_chain.verified_chain[-1]['metadata']
         try:
             # This should be the entity configuration
-            metadata = trust_chain.verified_chain[-1]['metadata'][entity_type]
+            metadata = leaf_metadata[entity_type]
         except KeyError:
             return None
         else:
             # apply the combined metadata policies on the metadata
-            trust_chain.combined_policy[entity_type] = combined_policy
-            _metadata = self.apply_policy(metadata, combined_policy)
+            trust_chain.combined_policy[entity_type] = _compiled.policy
+            _metadata = self.apply_policy(metadata, _compiled)
             logger.debug(f"After applied policy: {_metadata}")
             return _metadata
 
     def __call__(self, trust_chain: TrustChain, entity_type: Optional[str] = ''):
         """
         :param trust_chain: TrustChain instance
-        :param entity_type: Which Entity Type the entity are
+        :param entity_type: Which Entity Type the entity are. If not given the policies
+            are applied to an entity type when its metadata is first used.
         """
         if len(trust_chain.verified_chain) > 1:
             if entity_type:
                 trust_chain.metadata[entity_type] = self._policy(trust_chain, entity_type)
             else:
-                for _type in trust_chain.verified_chain[-1]['metadata'].keys():
-                    trust_chain.metadata[_type] = self._policy(trust_chain, _type)
-        else:
+                # The leaf's metadata as it is now, even if evaluated later
+                _leaf_metadata = dict(trust_chain.verified_chain[-1]['metadata'])
+                _metadata = LazyMetadata(
+                    _leaf_metadata.keys(),
+                    functools.partial(self._policy, trust_chain, leaf_metadata=_leaf_metadata))
+                # Metadata for entity types the leaf no longer has metadata for is kept
+                for _type in list(trust_chain.metadata.keys()):
+                    if _type not in _metadata:
+                        _metadata[_type] = trust_chain.metadata[_type]
+                trust_chain.metadata = _metadata
+        elif entity_type:
             trust_chain.metadata = trust_chain.verified_chain[0]["metadata"][entity_type]
             trust_chain.combined_policy[entity_type] = {}
+        else:
+            trust_chain.metadata = dict(trust_chain.verified_chain[0]["metadata"])
+            for _type in trust_chain.metadata.keys():
+                trust_chain.combined_policy[_type] = {}
 
 
 def diff2policy(new, old):
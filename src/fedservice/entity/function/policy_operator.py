@@ -16,6 +16,19 @@ def union(val1, val2):
     return base.union(ext)
 
 
+def as_list(val):
+    if isinstance(val, list):
+        return val
+    return [val]
+
+
+def _copy(val):
+    # Lists in the policy must not be shared with the metadata
+    if isinstance(val, list):
+        return list(val)
+    return val
+
+
 class PolicyOperator(object):
     name = ""
     default_next = ""
@@ -26,6 +39,16 @@ class PolicyOperator(object):
     def __call__(self, claim, metadata, metadata_policy):
         return self.next
 
+    def compile(self, claim, operand):
+        """
+        Build a check that applies this operator, with the given operand, to a claim.
+
+        :param claim: The metadata claim
+        :param operand: The operator's value in the metadata policy
+        :return: A function that takes metadata as the only argument
+        """
+        raise NotImplementedError()
+
 
 class Value(PolicyOperator):
     name = "value"
@@ -40,6 +63,15 @@ class Value(PolicyOperator):
             metadata[claim] = metadata_policy[claim][self.name]
         return self.next
 
+    def compile(self, claim, operand):
+        if operand is None:
+            def check(metadata):
+                metadata.pop(claim, None)
+        else:
+            def check(metadata):
+                metadata[claim] = _copy(operand)
+        return check
+
 
 class OneOf(PolicyOperator):
     name = "one_of"
@@ -57,6 +89,17 @@ class OneOf(PolicyOperator):
                         f"{metadata[claim]} not among {metadata_policy[claim][self.name]}")
                 return self.next
 
+    def compile(self, claim, operand):
+        _allowed = set(as_list(operand))
+
+        def check(metadata):
+            _val = metadata.get(claim)
+            if _val is None or isinstance(_val, list):
+                return
+            if _val not in _allowed:
+                raise PolicyError(f"{_val} not among {operand}")
+        return check
+
 
 class Add(PolicyOperator):
     name = "add"
@@ -66,15 +109,25 @@ class Add(PolicyOperator):
         if claim in metadata:
             for val in metadata_policy[claim][self.name]:
                 # the metadata claim value must be a list otherwise append doesn't work
-                if isinstance(metadata, list):
-                    pass
-                else:
+                if not isinstance(metadata[claim], list):
                     metadata[claim] = [metadata[claim]]
                 if val not in metadata[claim]:
                     metadata[claim].append(val)
         else:
             metadata[claim] = metadata_policy[claim][self.name]
 
+    def compile(self, claim, operand):
+        _add = as_list(operand)
+
+        def check(metadata):
+            if claim in metadata:
+                _val = as_list(metadata[claim])
+                _present = set(_val)
+                metadata[claim] = _val + [v for v in _add if v not in _present]
+            else:
+                metadata[claim] = _copy(operand)
+        return check
+
 class Default(PolicyOperator):
     name = "default"
     default_next = "one_of"
@@ -83,6 +136,12 @@ class Default(PolicyOperator):
         if claim not in metadata:
             metadata[claim] = metadata_policy[claim][self.name]
 
+    def compile(self, claim, operand):
+        def check(metadata):
+            if claim not in metadata:
+                metadata[claim] = _copy(operand)
+        return check
+
 
 class SubsetOf(PolicyOperator):
     name = "subset_of"
@@ -92,13 +151,22 @@ class SubsetOf(PolicyOperator):
         if claim in metadata:
             if isinstance(metadata[claim], list):
                 _val = set(metadata_policy[claim][self.name]).intersection(set(metadata[claim]))
-            else:
-                if metadata[claim] in metadata_policy[claim]:
-                    _val = metadata[claim]
-                else:
-                    raise PolicyError(f"{metadata[claim]} not in allowed subset: {metadata_policy[claim]}")
+                metadata[claim] = list(_val)
+            elif metadata[claim] not in metadata_policy[claim][self.name]:
+                raise PolicyError(
+                    f"{metadata[claim]} not in allowed subset: {metadata_policy[claim][self.name]}")
 
-            metadata[claim] = list(_val)
+    def compile(self, claim, operand):
+        _allowed = set(as_list(operand))
+
+        def check(metadata):
+            if claim in metadata:
+                _val = metadata[claim]
+                if isinstance(_val, list):
+                    metadata[claim] = [v for v in dict.fromkeys(_val) if v in _allowed]
+                elif _val not in _allowed:
+                    raise PolicyError(f"{_val} not in allowed subset: {operand}")
+        return check
 
 
 class SupersetOf(PolicyOperator):
@@ -110,6 +178,14 @@ class SupersetOf(PolicyOperator):
             if set(metadata_policy[claim][self.name]).difference(set(metadata[claim])):
                 raise PolicyError(f"{metadata[claim]} not superset of {metadata_policy[claim][self.name]}")
 
+    def compile(self, claim, operand):
+        _required = set(as_list(operand))
+
+        def check(metadata):
+            if claim in metadata and _required.difference(as_list(metadata[claim])):
+                raise PolicyError(f"{metadata[claim]} not superset of {operand}")
+        return check
+
 
 class Essential(PolicyOperator):
     name = "essential"
@@ -120,6 +196,12 @@ class Essential(PolicyOperator):
             if metadata_policy[claim][self.name] == True:
                 raise PolicyError(f"Essential value missing for {claim}")
 
+    def compile(self, claim, operand):
+        def check(metadata):
+            if operand == True and metadata.get(claim, None) is None:
+                raise PolicyError(f"Essential value missing for {claim}")
+        return check
+
 
 POLICY_OPERATORS = {
     'value': Value,
@@ -0,0 +1,133 @@
+import logging
+import random
+from typing import Callable
+from typing import List
+from typing import Optional
+
+from cryptojwt.jwt import utc_time_sans_frac
+
+from fedservice.entity.function import apply_policies
+from fedservice.entity.function import collect_trust_chains
+from fedservice.entity.function import Function
+from fedservice.entity.function import verify_trust_chains
+from fedservice.entity.utils import get_federation_entity
+from fedservice.scheduler import RefreshScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class TrustChainRefresher(Function):
+    """
+    Refreshes cached trust chains in the background before they expire.
+    The entity configurations and subordinate statements a trust chain is built from
+    are fetched anew lead_time seconds, minus a random jitter, before the trust chain
+    expires. If that fails the cached trust chain is used until it expires and the
+    refresh is retried every retry_interval seconds. Trust chains that have not been
+    used since they were last refreshed are left to expire.
+
+    Not used unless added to the federation entity's functions as
+    'trust_chain_refresher'. Only usable with the blocking trust chain collector.
+    """
+
+    def __init__(self,
+                 upstream_get: Callable,
+                 lead_time: Optional[int] = 900,
+                 jitter: Optional[int] = 60,
+                 retry_interval: Optional[int] = 60,
+                 background: Optional[bool] = True,
+                 **kwargs):
+        Function.__init__(self, upstream_get)
+        self.lead_time = lead_time
+        self.jitter = jitter
+        self.retry_interval = retry_interval
+        # If False, the owner is expected to call run_pending() regularly
+        self.background = background
+        self.scheduler = RefreshScheduler(name="trust_chain_refresher")
+
+    def refresh_at(self, trust_chains: list) -> int:
+        _now = utc_time_sans_frac()
+        _exp = min([_tc.exp for _tc in trust_chains])
+        _when = _exp - self.lead_time - random.randint(0, self.jitter)
+        # Don't loop if the trust chain lifetime is shorter than the lead time
+        return max(_when, _now + self.retry_interval)
+
+    def schedule(self, entity_id: str, trust_chains: list):
+        """
+        Schedule a refresh of the trust chains for an entity.
+
+        :param entity_id: The entity ID
+        :param trust_chains: The entity's verified trust chains
+        """
+        if not trust_chains:
+            return
+        self.scheduler.schedule(entity_id, self.refresh_at(trust_chains), self.refresh,
+                                entity_id)
+        if self.background:
+            self.scheduler.start()
+
+    def _expiring(self, trust_chains: list, horizon: int) -> List[tuple]:
+        """
+        Find the entity configurations and subordinate statements that will expire
+        before horizon.
+
+        :return: List of (subject, issuer) tuples. Subject and issuer are the same for
+            entity configurations.
+        """
+        _collector = get_federation_entity(self).function.trust_chain_collector
+        res = []
+        for _trust_chain in trust_chains:
+            for _statement in _trust_chain.verified_chain:
+                if _statement["exp"] <= horizon:
+                    res.append((_statement["sub"], _statement["iss"]))
+            # The intermediates' entity configurations are needed for their fetch endpoints
+            for _authority in _trust_chain.iss_path[1:]:
+                _entity_config = _collector.config_cache.get(_authority)
+                if _entity_config and _entity_config["exp"] <= horizon:
+                    res.append((_authority, _authority))
+        return list(dict.fromkeys(res))
+
+    def refresh(self, entity_id: str):
+        _federation_entity = get_federation_entity(self)
+        # Looking doesn't count as a use
+        _trust_chains = _federation_entity.trust_chain.peek(entity_id)
+        if not _trust_chains:
+            # Expired or evicted, not worth keeping warm
+            logger.debug(f"No cached trust chains for {entity_id} to refresh")
+            self.scheduler.cancel(entity_id)
+            return
+        if not _federation_entity.trust_chain.used(entity_id):
+            logger.debug(f"The trust chains for {entity_id} have not been used, not refreshed")
+            self.scheduler.cancel(entity_id)
+            return
+
+        _collector = _federation_entity.function.trust_chain_collector
+        _horizon = utc_time_sans_frac() + self.lead_time + self.jitter
+        try:
+            # Configurations first since they are used to find the fetch endpoints
+            for sub, iss in sorted(self._expiring(_trust_chains, _horizon),
+                                   key=lambda x: x[0] != x[1]):
+                if sub == iss:
+                    _collector.refresh_entity_configuration(sub)
+                else:
+                    _collector.refresh_entity_statement(sub, iss)
+
+            chains, leaf_ec = collect_trust_chains(self, entity_id)
+            _new_trust_chains = apply_policies(self, verify_trust_chains(self, chains, leaf_ec))
+        except Exception as err:
+            logger.warning(f"Refreshing the trust chains for {entity_id} failed: {err}")
+            _new_trust_chains = []
+
+        if _new_trust_chains:
+            logger.debug(f"Refreshed the trust chains for {entity_id}")
+            _federation_entity.trust_chain[entity_id] = _new_trust_chains
+            self.schedule(entity_id, _new_trust_chains)
+        else:
+            # Keep using the cached trust chains while they are valid
+            self.scheduler.schedule(entity_id, utc_time_sans_frac() + self.retry_interval,
+                                    self.refresh, entity_id)
+
+    def run_pending(self) -> int:
+        return self.scheduler.run_pending()
+
+    def close(self):
+        self.scheduler.stop()
@@ -1,20 +1,24 @@
 from typing import Optional
 
-from cryptojwt.jws.jws import factory
-
+from fedservice.entity.function import get_trust_chain_collector
 from fedservice.entity.function import get_verified_trust_chains
 from fedservice.entity.utils import get_federation_entity
+from fedservice.entity_statement.statement import parse_statement
 
 
-def get_verified_trust_anchor_statement(federation_entity, entity_id: str):
-    _collector = federation_entity.function.trust_chain_collector
-    _ec = _collector.get_entity_configuration(entity_id)
-    _jwt = factory(_ec)
+def verify_trust_anchor_statement(federation_entity, signed_statement: str):
+    _jwt = parse_statement(signed_statement).jws
     keys = federation_entity.keyjar.get_jwt_verify_keys(_jwt.jwt)
     res = _jwt.verify_compact(keys=keys)
     return res
 
 
+def get_verified_trust_anchor_statement(federation_entity, entity_id: str):
+    _collector = get_trust_chain_collector(federation_entity)
+    _ec = _collector.get_entity_configuration(entity_id)
+    return verify_trust_anchor_statement(federation_entity, _ec)
+
+
 def get_verified_endpoint(unit, entity_id: str, endpoint_name: str) -> Optional[str]:
     _federation_entity = get_federation_entity(unit)
 
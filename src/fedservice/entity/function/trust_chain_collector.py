@@ -1,36 +1,40 @@
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 from ssl import SSLError
 from typing import Callable
 from typing import List
 from typing import Optional
 from typing import Union
 
-from cryptojwt import JWT
 from cryptojwt import KeyJar
-from cryptojwt.jws.jws import factory
 from cryptojwt.jwt import utc_time_sans_frac
 from idpyoidc.exception import MissingPage
 from idpyoidc.key_import import import_jwks
 from idpyoidc.message import Message
+from idpyoidc.util import instantiate
 from requests.exceptions import ConnectionError
 
 from fedservice.entity.function import collect_trust_chains
 from fedservice.entity.function import Function
+from fedservice.entity.function import verify_self_signed
 from fedservice.entity.function import verify_trust_chains
 from fedservice.entity.utils import get_federation_entity
 from fedservice.entity_statement.cache import ESCache
+from fedservice.entity_statement.statement import parse_statement
 from fedservice.exception import FailedConfigurationRetrieval
+from fedservice.http_cache import HTTPCache
+from fedservice.single_flight import SingleFlight
 from fedservice.utils import statement_is_expired
 
 logger = logging.getLogger(__name__)
 
 
 def unverified_entity_statement(signed_jwt):
-    _jws = factory(signed_jwt)
-    if not _jws:
+    _statement = parse_statement(signed_jwt)
+    if not _statement.jws:
         raise ValueError(f"Not a proper signed JWT: {signed_jwt}")
-    return _jws.jwt.payload()
+    return _statement.payload()
 
 
 def verify_self_signed_signature(statement):
@@ -41,15 +45,7 @@ def verify_self_signed_signature(statement):
     :param statement: Signed JWT
     :return: Payload of the signed JWT
     """
-
-    payload = unverified_entity_statement(statement)
-    keyjar = KeyJar()
-    if payload['iss'] not in keyjar:
-        keyjar = import_jwks(keyjar, payload['jwks'], payload['iss'])
-
-    _jwt = JWT(key_jar=keyjar)
-    _val = _jwt.unpack(statement)
-    return _val
+    return verify_self_signed(statement)
 
 
 def get_endpoint(endpoint_type, config):
@@ -72,13 +68,29 @@ class TrustChainCollector(Function):
                  trust_anchors: dict,
                  allowed_delta: int = 300,
                  keyjar: Optional[KeyJar] = None,
+                 max_concurrency: Optional[int] = 1,
+                 cache_size: Optional[int] = 1000,
+                 cache_backend: Optional[dict] = None,
+                 incremental: Optional[bool] = False,
+                 http_cache_size: Optional[int] = 1000,
                  **kwargs
                  ):
         Function.__init__(self, upstream_get)
         self.trust_anchors = trust_anchors
         self.allowed_delta = allowed_delta
-        self.config_cache = ESCache(allowed_delta=allowed_delta)
-        self.entity_statement_cache = ESCache(allowed_delta=allowed_delta)
+        # The maximum number of outstanding HTTP requests while collecting one tree.
+        # 1 means that superiors are collected one at the time.
+        self.max_concurrency = max_concurrency
+        self.config_cache = self._init_cache(cache_size, cache_backend, "entity_configuration")
+        self.entity_statement_cache = self._init_cache(cache_size, cache_backend,
+                                                       "entity_statement")
+        # If True, the tree collected last time for an entity is reused and only
+        # the expired parts of it are collected anew.
+        self.incremental = incremental
+        self.tree_cache = ESCache(allowed_delta=0, max_size=cache_size)
+        # Validators and freshness of fetched documents, keeps the response bodies
+        self.http_cache = HTTPCache(max_size=http_cache_size)
+        self.single_flight = SingleFlight()
         # should not have a Key Jar of its own
         if keyjar:
             self.keyjar = keyjar
@@ -88,17 +100,32 @@ class TrustChainCollector(Function):
         for id, keys in trust_anchors.items():
             keyjar = import_jwks(keyjar, keys, id)
 
+    def _init_cache(self, cache_size: int, cache_backend: Optional[dict], table: str) -> ESCache:
+        """
+        :param cache_size: Max number of items in the in-memory tier. 0 means no limit.
+        :param cache_backend: Specification of a persistent backend, if any.
+            A dictionary with 'class' and 'kwargs' as keys.
+        :param table: What is stored in this cache
+        """
+        if cache_backend:
+            _kwargs = cache_backend.get("kwargs", {}).copy()
+            _kwargs["table"] = table
+            _backend = instantiate(cache_backend["class"], **_kwargs)
+        else:
+            _backend = None
+        return ESCache(allowed_delta=self.allowed_delta, max_size=cache_size, backend=_backend)
+
+    def cache_stats(self) -> dict:
+        return {
+            "entity_configuration": self.config_cache.stats(),
+            "entity_statement": self.entity_statement_cache.stats()
+        }
+
     def _get_service(self, service):
         federation_entity = get_federation_entity(self)
         return federation_entity.client.get_service(service)
 
-    def get_document(self, url: str):
-        """
-
-        :param url: Target URL
-        :param httpc_args: Arguments for the HTTP call.
-        :return: Signed EntityStatement
-        """
+    def _get_httpc_params(self) -> dict:
         _keyjar = self.upstream_get('attribute', 'keyjar')
 
         _httpc_params = _keyjar.httpc_params
@@ -109,21 +136,50 @@ class TrustChainCollector(Function):
             logger.debug(f"federation_entity.httpc_params: {_httpc_params}")
 
         logger.debug(f"Using HTTPC Params: {_httpc_params}")
-        try:
-            response = self.upstream_get('attribute', 'httpc')("GET", url, **_httpc_params)
-        except ConnectionError as err:
-            logger.error(f'Could not connect to {url}:{err}')
-            raise
-
+        return _httpc_params
+
+    def _conditional_httpc_params(self, url: str) -> dict:
+        _httpc_params = self._get_httpc_params()
+        _headers = self.http_cache.conditional_headers(url)
+        if _headers:
+            _httpc_params = _httpc_params.copy()
+            _headers.update(_httpc_params.get("headers", {}))
+            _httpc_params["headers"] = _headers
+        return _httpc_params
+
+    def _parse_document_response(self, url: str, response) -> str:
         if response.status_code == 200:
             if 'application/entity-statement+jwt' not in response.headers['Content-Type']:
                 logger.warning(f"Wrong Content-Type: {response.headers['Content-Type']}")
-            return response.text
+            # Parsed once, used by the collector, the verifier and the caches
+            return parse_statement(response.text)
         elif response.status_code == 404:
             raise MissingPage(f"No such page: '{url}'")
         else:
             raise FailedConfigurationRetrieval()
 
+    def get_document(self, url: str):
+        """
+
+        :param url: Target URL
+        :return: Signed EntityStatement
+        """
+        _cached = self.http_cache.fresh(url)
+        if _cached:
+            return self._parse_document_response(url, _cached)
+        # Concurrent requests for the same document share one HTTP request
+        return self.single_flight.do(url, self._fetch_document, url)
+
+    def _fetch_document(self, url: str):
+        _httpc_params = self._conditional_httpc_params(url)
+        try:
+            response = self.upstream_get('attribute', 'httpc')("GET", url, **_httpc_params)
+        except ConnectionError as err:
+            logger.error(f'Could not connect to {url}:{err}')
+            raise
+
+        return self._parse_document_response(url, self.http_cache.update(url, response))
+
     def get_entity_configuration(self, entity_id):
         """
         Get configuration information about an entity from itself.
@@ -188,28 +244,34 @@ class TrustChainCollector(Function):
 
         return verify_self_signed_signature(signed_entity_config)
 
-    def get_federation_fetch_endpoint(self, intermediate: str) -> str:
-        logger.debug(f'--get_federation_fetch_endpoint({intermediate})')
+    def _cached_fetch_endpoint(self, intermediate: str) -> Optional[str]:
         # In cache ??
         _entity_config = self.config_cache[intermediate]
         if _entity_config:
             logger.debug(f'Cached info: {_entity_config}')
             # will return None if cached information is outdated
-            fed_fetch_endpoint = get_endpoint("fetch", _entity_config)
-        else:
-            fed_fetch_endpoint = None
+            return get_endpoint("fetch", _entity_config)
+        return None
+
+    def _store_entity_configuration(self, entity_id: str, signed_entity_config: str) -> dict:
+        entity_config = verify_self_signed_signature(signed_entity_config)
+        logger.debug(f'Verified self signed statement: {entity_config}')
+        entity_config["_jws"] = signed_entity_config
+        # update cache
+        self.config_cache[entity_id] = entity_config
+        return entity_config
+
+    def get_federation_fetch_endpoint(self, intermediate: str) -> str:
+        logger.debug(f'--get_federation_fetch_endpoint({intermediate})')
+        fed_fetch_endpoint = self._cached_fetch_endpoint(intermediate)
 
         if not fed_fetch_endpoint:
             signed_entity_config = self.get_entity_configuration(intermediate)
             if signed_entity_config is None:
                 return ''
 
-            entity_config = verify_self_signed_signature(signed_entity_config)
-            logger.debug(f'Verified self signed statement: {entity_config}')
+            entity_config = self._store_entity_configuration(intermediate, signed_entity_config)
             fed_fetch_endpoint = get_endpoint("fetch", entity_config)
-            # update cache
-            entity_config["_jws"] = signed_entity_config
-            self.config_cache[intermediate] = entity_config
 
         return fed_fetch_endpoint
 
@@ -248,6 +310,10 @@ class TrustChainCollector(Function):
         :param stop_at: The ID of the trust anchor at which the trust chain should stop.
         :return: Dictionary of superiors
         """
+        if self.max_concurrency and self.max_concurrency > 1:
+            return self.collect_tree_concurrently(entity_id, entity_configuration, seen=seen,
+                                                  stop_at=stop_at)
+
         superior = {}
         if seen is None:
             seen = []
@@ -269,7 +335,81 @@ class TrustChainCollector(Function):
 
         return superior
 
-    def _get_entity_statement(self, entity: str, authority: str) -> Optional[str]:
+    def _branches(self,
+                  entity_id: str,
+                  entity_configuration: Union[dict, Message],
+                  seen: list,
+                  stop_at: str,
+                  superior: dict) -> list:
+        """
+        Find the branches one level up from an entity that has to be collected.
+        Adds a placeholder per authority to the superior dictionary such that the
+        order of the authority hints is kept.
+
+        :param entity_id: The entity ID
+        :param entity_configuration: Entity Configuration as a dictionary
+        :param seen: A list of authorities that this process has seen.
+        :param stop_at: The ID of the trust anchor at which the trust chain should stop.
+        :param superior: The dictionary the superiors should be added to.
+        :return: List of (entity_id, authority, seen, superior) tuples
+        """
+        if 'authority_hints' not in entity_configuration:
+            logger.debug("No authority for this entity")
+            return []
+        elif entity_configuration['iss'] == stop_at:
+            logger.debug("Reached trust anchor")
+            return []
+
+        branches = []
+        for authority in entity_configuration['authority_hints']:
+            if authority in seen:  # loop ?!
+                logger.warning(f"Loop detected at {authority}")
+            superior[authority] = None
+            if entity_id == authority and entity_id in self.trust_anchors:
+                continue
+            _seen = seen[:]
+            _seen.append(authority)
+            branches.append((entity_id, authority, _seen, superior))
+        return branches
+
+    def collect_tree_concurrently(self,
+                                  entity_id: str,
+                                  entity_configuration: Union[dict, Message],
+                                  seen: Optional[list] = None,
+                                  stop_at: Optional[str] = "") -> dict:
+        """
+        Collect superiors one level at the time. All the branches on one level are
+        collected in parallel. The result is the same as from :py:meth:`collect_tree`.
+
+        :param entity_id: The entity ID
+        :param entity_configuration: Entity Configuration as a dictionary
+        :param seen: A list of authorities that this process has seen.
+        :param stop_at: The ID of the trust anchor at which the trust chain should stop.
+        :return: Dictionary of superiors
+        """
+        superior = {}
+        logger.debug(f'Concurrently collect superiors to: {entity_id}')
+        branches = self._branches(entity_id, entity_configuration, seen or [], stop_at, superior)
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            while branches:
+                # The same statement may be needed by more than one branch
+                _keys = list(dict.fromkeys((branch[0], branch[1]) for branch in branches))
+                _statements = dict(zip(_keys, executor.map(
+                    lambda key: self._get_entity_statement(*key), _keys)))
+
+                _next_level = []
+                for entity, authority, _seen, _superior in branches:
+                    entity_statement = _statements[(entity, authority)]
+                    if entity_statement:
+                        _tree = {}
+                        _superior[authority] = (entity_statement, _tree)
+                        _next_level.extend(self._branches(authority, self.config_cache[authority],
+                                                          _seen, stop_at, _tree))
+                branches = _next_level
+
+        return superior
+
+    def _cached_entity_statement(self, entity: str, authority: str) -> Optional[str]:
         # Try to get the entity statement from the cache
         _cache_key = cache_key(authority, entity)
         entity_statement = self.entity_statement_cache[_cache_key]
@@ -280,12 +420,26 @@ class TrustChainCollector(Function):
             _now = utc_time_sans_frac()
             _time_key = time_key(authority, entity)
             _exp = self.entity_statement_cache[_time_key]
-            if _now > (_exp - self.allowed_delta):
+            if _exp is None or _now > (_exp - self.allowed_delta):
                 logger.debug("Cached entity statement timed out")
-                del self.entity_statement_cache[_cache_key]
-                del self.entity_statement_cache[_time_key]
+                for _key in [_cache_key, _time_key]:
+                    if _key in self.entity_statement_cache:
+                        del self.entity_statement_cache[_key]
                 entity_statement = None
 
+        return entity_statement
+
+    def _store_entity_statement(self, entity: str, authority: str, entity_statement: str):
+        # entity_statement is a signed JWT
+        statement = unverified_entity_statement(entity_statement)
+        logger.debug(f"Unverified entity statement from {authority} about {entity}: {statement}")
+        self.entity_statement_cache[cache_key(authority, entity)] = entity_statement
+        self.entity_statement_cache.set(time_key(authority, entity), statement["exp"],
+                                        expires_at=statement["exp"] - self.allowed_delta)
+
+    def _get_entity_statement(self, entity: str, authority: str) -> Optional[str]:
+        entity_statement = self._cached_entity_statement(entity, authority)
+
         if entity_statement is None:
             logger.debug(f"Have not seen '{authority}' before")
             # The entity configuration for authority is collected at this point
@@ -295,14 +449,33 @@ class TrustChainCollector(Function):
                 return None
             logger.debug(f"Federation fetch endpoint: '{fed_fetch_endpoint}' for '{authority}'")
             entity_statement = self.get_entity_statement(fed_fetch_endpoint, authority, entity)
-            # entity_statement is a signed JWT
-            statement = unverified_entity_statement(entity_statement)
-            logger.debug(
-                f"Unverified entity statement from {fed_fetch_endpoint} about {entity}: "
-                f"{statement}")
-            self.entity_statement_cache[_cache_key] = entity_statement
-            self.entity_statement_cache[time_key(authority, entity)] = statement["exp"]
+            self._store_entity_statement(entity, authority, entity_statement)
+
+        return entity_statement
+
+    def refresh_entity_configuration(self, entity_id: str) -> dict:
+        """
+        Fetch a new copy of an entity configuration. The cached copy is only replaced
+        if the fetch and the signature verification succeeds.
 
+        :param entity_id: The entity ID
+        :return: The verified entity configuration
+        """
+        signed_entity_config = self.get_entity_configuration(entity_id)
+        return self._store_entity_configuration(entity_id, signed_entity_config)
+
+    def refresh_entity_statement(self, entity: str, authority: str) -> str:
+        """
+        Fetch a new copy of the subordinate statement issued by an authority about an
+        entity. The cached copy is only replaced if the fetch succeeds.
+
+        :param entity: The subject of the statement
+        :param authority: The issuer of the statement
+        :return: The signed entity statement
+        """
+        fed_fetch_endpoint = self.get_federation_fetch_endpoint(authority)
+        entity_statement = self.get_entity_statement(fed_fetch_endpoint, authority, entity)
+        self._store_entity_statement(entity, authority, entity_statement)
         return entity_statement
 
     def collect_branch(self, entity, authority, seen=None, max_superiors=10, stop_at=""):
@@ -347,6 +520,75 @@ class TrustChainCollector(Function):
         else:
             return None
 
+    def _is_fresh(self, entity_statement: str) -> bool:
+        _exp = parse_statement(entity_statement).payload().get("exp")
+        return _exp is not None and utc_time_sans_frac() < _exp - self.allowed_delta
+
+    def _superior_hints(self, authority: str, previous: dict) -> dict:
+        # Use the authority's entity configuration if it's cached. If not, assume
+        # the authority hints are the same as when the tree was collected.
+        _entity_config = self.config_cache[authority]
+        if _entity_config is None:
+            _entity_config = {"iss": authority, "authority_hints": list(previous.keys())}
+        return _entity_config
+
+    def revalidate_tree(self,
+                        entity_id: str,
+                        entity_configuration: Union[dict, Message],
+                        previous: dict,
+                        seen: Optional[list] = None,
+                        stop_at: Optional[str] = "") -> dict:
+        """
+        Update a previously collected tree. Only the subordinate statements that have
+        expired are fetched anew, the rest of the tree is reused as is. Branches
+        for authorities not present in the previous tree are collected.
+
+        :param entity_id: The entity ID
+        :param entity_configuration: Entity Configuration as a dictionary
+        :param previous: The tree collected last time
+        :param seen: A list of authorities that this process has seen.
+        :param stop_at: The ID of the trust anchor at which the trust chain should stop.
+        :return: Dictionary of superiors
+        """
+        superior = {}
+        if seen is None:
+            seen = []
+
+        if 'authority_hints' not in entity_configuration:
+            return superior
+        elif entity_configuration['iss'] == stop_at:
+            return superior
+
+        for authority in entity_configuration['authority_hints']:
+            _previous = previous.get(authority)
+            if _previous is None:
+                superior[authority] = self.collect_branch(entity_id, authority, seen,
+                                                          stop_at=stop_at)
+                continue
+
+            _statement, _previous_tree = _previous
+            # A newer statement may have been fetched since the tree was collected
+            _cached = self._cached_entity_statement(entity_id, authority)
+            if _cached:
+                _statement = _cached
+            elif not self._is_fresh(_statement):
+                logger.debug(f"Statement by {authority} about {entity_id} has expired")
+                _statement = self._get_entity_statement(entity_id, authority)
+                if not _statement:
+                    superior[authority] = None
+                    continue
+            else:
+                # Reused, get_chain() expects to find it in the cache
+                self._store_entity_statement(entity_id, authority, _statement)
+
+            _seen = seen[:]
+            _seen.append(authority)
+            superior[authority] = (_statement, self.revalidate_tree(
+                authority, self._superior_hints(authority, _previous_tree), _previous_tree,
+                seen=_seen, stop_at=stop_at))
+
+        return superior
+
     def too_old(self, statement):
         now = time.time()
         if now >= statement["exp"] + self.allowed_delta:
@@ -354,33 +596,42 @@ class TrustChainCollector(Function):
         else:
             return False
 
-    def __call__(self,
-                 entity_id: str,
-                 max_superiors: Optional[int] = 10,
-                 seen: Optional[List[str]] = None,
-                 stop_at: Optional[str] = ''):
+    def _cached_signed_entity_configuration(self, entity_id: str) -> Optional[str]:
         entity_config = self.config_cache.get(entity_id, None)
         if entity_config and not self.too_old(entity_config):
             signed_entity_config = entity_config.get("_jws")
             if not signed_entity_config:
                 signed_entity_config = getattr(entity_config, "_jws")
-        else:
-            signed_entity_config = None
+            return signed_entity_config
+        return None
 
-        if not signed_entity_config:
+    def __call__(self,
+                 entity_id: str,
+                 max_superiors: Optional[int] = 10,
+                 seen: Optional[List[str]] = None,
+                 stop_at: Optional[str] = ''):
+        signed_entity_config = self._cached_signed_entity_configuration(entity_id)
+        if signed_entity_config:
+            entity_config = self.config_cache.get(entity_id)
+        else:
             # get leaf Entity Configuration
             signed_entity_config = self.get_entity_configuration(entity_id)
             if not signed_entity_config:
                 logger.warning(f"Could not find any entity configuration for {entity_id}")
                 return None
-            entity_config = verify_self_signed_signature(signed_entity_config)
-            logger.debug(f'Verified self signed statement: {entity_config}')
-            entity_config['_jws'] = signed_entity_config
-            # update cache
-            self.config_cache[entity_id] = entity_config
+            entity_config = self._store_entity_configuration(entity_id, signed_entity_config)
 
-        return self.collect_tree(entity_id, entity_config, seen=seen, max_superiors=max_superiors,
-                                 stop_at=stop_at), signed_entity_config
+        _tree_key = cache_key(stop_at, entity_id)
+        _previous = self.tree_cache[_tree_key] if self.incremental else None
+        if _previous is not None:
+            _tree = self.revalidate_tree(entity_id, entity_config, _previous, seen=seen,
+                                         stop_at=stop_at)
+        else:
+            _tree = self.collect_tree(entity_id, entity_config, seen=seen,
+                                      max_superiors=max_superiors, stop_at=stop_at)
+        if self.incremental and _tree is not None:
+            self.tree_cache[_tree_key] = _tree
+        return _tree, signed_entity_config
 
     def add_trust_anchor(self, entity_id, jwks):
         if self.keyjar:
@@ -393,13 +644,26 @@ class TrustChainCollector(Function):
         _keyjar = import_jwks(_keyjar, jwks, entity_id)
         self.trust_anchors[entity_id] = jwks
 
+    def _signed_entity_configuration(self, entity_id: str) -> Optional[str]:
+        # The cached one or, if it has been evicted, a newly fetched one
+        _entity_config = self.config_cache[entity_id]
+        if _entity_config:
+            return _entity_config['_jws']
+        _signed_entity_config = self.get_entity_configuration(entity_id)
+        if _signed_entity_config:
+            self._store_entity_configuration(entity_id, _signed_entity_config)
+        return _signed_entity_config
+
     def get_chain(self, iss_path, trust_anchor, with_ta_ec: Optional[bool] = False):
         # Entity configuration for the leaf
-        res = [self.config_cache[iss_path[0]]['_jws']]
+        res = [self._signed_entity_configuration(iss_path[0])]
         # Entity statements up the chain
         for i in range(len(iss_path) - 1):
-            res.append(self.entity_statement_cache[cache_key(iss_path[i + 1], iss_path[i])])
+            _statement = self.entity_statement_cache[cache_key(iss_path[i + 1], iss_path[i])]
+            if _statement is None:
+                _statement = self._get_entity_statement(iss_path[i], iss_path[i + 1])
+            res.append(_statement)
         # Possibly add Trust Anchor entity configuration
         if with_ta_ec:
-            res.append(self.config_cache[trust_anchor]['_jws'])
+            res.append(self._signed_entity_configuration(trust_anchor))
         return res
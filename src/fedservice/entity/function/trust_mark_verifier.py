@@ -12,6 +12,7 @@ from fedservice import message
 from fedservice.entity import apply_policies
 from fedservice.entity.function import Function
 from fedservice.entity.function import get_payload
+from fedservice.entity.function import get_trust_chain_collector
 from fedservice.entity.function import get_verified_trust_chains
 from fedservice.entity.function import verify_signature
 from fedservice.entity.function.trust_anchor import get_verified_trust_anchor_statement
@@ -65,12 +66,18 @@ class TrustMarkVerifier(Function):
                  trust_anchor: str,
                  check_status: Optional[bool] = False,
                  entity_id: Optional[str] = '',
+                 trust_anchor_statement: Optional[dict] = None,
+                 trust_chains: Optional[list] = None
                  ) -> Optional[Message]:
         """
         Verifies that a trust mark is issued by someone in the federation and that
         the signing key is a federation key.
 
         :param trust_mark: A signed JWT representing a trust mark
+        :param trust_anchor_statement: The verified entity configuration of the trust anchor.
+            Fetched if not provided.
+        :param trust_chains: Verified trust chains for the trust mark issuer.
+            Collected if not provided.
         :returns: TrustClaim message instance if OK otherwise None
         """
 
@@ -86,7 +93,9 @@ class TrustMarkVerifier(Function):
 
         # Get trust anchor information in order to verify the issuer and if needed the delegator.
         _federation_entity = get_federation_entity(self)
-        trust_anchor_statement = get_verified_trust_anchor_statement(_federation_entity, trust_anchor)
+        if trust_anchor_statement is None:
+            trust_anchor_statement = get_verified_trust_anchor_statement(_federation_entity,
+                                                                         trust_anchor)
 
         # Check delegation
         if self.check_delegation(trust_anchor_statement, _trust_mark) == False:
@@ -108,7 +117,10 @@ class TrustMarkVerifier(Function):
             return None
 
         # Now time to verify the signature of the trust mark
-        _trust_chains = get_verified_trust_chains(self, _trust_mark['iss'])
+        if trust_chains is None:
+            _trust_chains = get_verified_trust_chains(self, _trust_mark['iss'])
+        else:
+            _trust_chains = trust_chains
         if not _trust_chains:
             logger.warning(f"Could not find any verifiable trust chains for {_trust_mark['iss']}")
             return None
@@ -139,7 +151,7 @@ class TrustMarkVerifier(Function):
 
     def verify_delegation(self, trust_mark, trust_anchor_id):
         _federation_entity = get_federation_entity(self)
-        _collector = _federation_entity.function.trust_chain_collector
+        _collector = get_trust_chain_collector(_federation_entity)
         # Deal with the delegation
         _entity_configuration = _collector.get_verified_self_signed_entity_configuration(trust_anchor_id)
 
@@ -1,14 +1,19 @@
+import hashlib
 import logging
 from typing import Callable
 from typing import List
+from typing import Optional
 
+from cryptojwt import as_unicode
 from cryptojwt import KeyBundle
 from cryptojwt.exception import MissingKey
-from cryptojwt.jws.jws import factory
+from cryptojwt.utils import as_bytes
 
 from fedservice.entity.function import Function
 from fedservice.entity.utils import get_federation_entity
+from fedservice.entity_statement.cache import ESCache
 from fedservice.entity_statement.constraints import meets_restrictions
+from fedservice.entity_statement.statement import parse_statement
 from fedservice.entity_statement.statement import TrustChain
 from fedservice.exception import UnknownTrustAnchor
 
@@ -17,12 +22,49 @@ logger = logging.getLogger(__name__)
 
 class TrustChainVerifier(Function):
 
-    def __init__(self, upstream_get: Callable):
+    def __init__(self, upstream_get: Callable, memo_size: Optional[int] = 1000):
+        """
+        :param memo_size: How many verified entity statements to remember. Each is
+            remembered together with the key that verified it until it expires.
+            0 means that nothing is remembered.
+        """
         Function.__init__(self, upstream_get)
+        if memo_size:
+            self.memo = ESCache(allowed_delta=0, max_size=memo_size)
+        else:
+            self.memo = None
+
+    def _verify(self, entity_statement: str, _jwt, keys: list) -> dict:
+        """
+        Verify the signature of an entity statement. If the same statement has been
+        verified before with one of the keys and has not expired the remembered result
+        is used.
+
+        :param entity_statement: A signed JWT
+        :param _jwt: The parsed signed JWT
+        :param keys: Possible verification keys
+        :return: The verified payload
+        """
+        if self.memo is None:
+            return _jwt.verify_compact(keys=keys)
+
+        _digest = hashlib.sha256(as_bytes(entity_statement)).hexdigest()
+        for key in keys:
+            res = self.memo[f"{_digest}:{as_unicode(key.thumbprint('SHA-256'))}"]
+            if res:
+                logger.debug("Signature already verified")
+                return res.copy()
+
+        _info = _jwt.verify_compact_verbose(keys=keys)
+        res = _info["msg"]
+        _key = _info.get("key")
+        if _key and "exp" in res:
+            self.memo.set(f"{_digest}:{as_unicode(_key.thumbprint('SHA-256'))}", res.copy(),
+                          expires_at=res["exp"])
+        return res
 
     def trusted_anchor(self, entity_statement):
-        _jwt = factory(entity_statement)
-        payload = _jwt.jwt.payload()
+        payload = parse_statement(entity_statement).payload()
         _federation_entity = get_federation_entity(self)
         if _federation_entity:
             if payload['iss'] not in _federation_entity.keyjar:
@@ -58,10 +100,12 @@ class TrustChainVerifier(Function):
         n = len(entity_statement_list) - 1
         _keyjar = self.upstream_get("attribute", "keyjar")
         for entity_statement in entity_statement_list:
-            _jwt = factory(entity_statement)
+            _statement = parse_statement(entity_statement)
+            _jwt = _statement.jws
             if _jwt:
-                logger.debug(f"JWS header: {_jwt.jwt.headers}", )
-                logger.debug(f"JWS payload: {_jwt.jwt.payload()}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"JWS header: {_statement.header}", )
+                    logger.debug(f"JWS payload: {_statement.payload()}")
                 keys = _keyjar.get_jwt_verify_keys(_jwt.jwt)
                 if keys == []:
                     logger.error(f'No keys matching: {_jwt.jwt.headers}')
@@ -70,7 +114,7 @@ class TrustChainVerifier(Function):
 
                 _key_spec = [f'{k.kty}:{k.use}:{k.kid}' for k in keys]
                 logger.debug("Possible verification keys: %s", _key_spec)
-                res = _jwt.verify_compact(keys=keys)
+                res = self._verify(entity_statement, _jwt, keys)
                 logger.debug("Verified entity statement: %s", res)
                 try:
                     _jwks = res['jwks']
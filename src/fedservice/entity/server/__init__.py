@@ -15,6 +15,7 @@ from idpyoidc.server.endpoint_context import EndpointContext
 from idpyoidc.server.util import build_endpoints
 from idpyoidc.util import instantiate
 
+from fedservice.entity.server.subordinate import SubordinateStore
 from fedservice.server import ServerUnit
 
 logger = logging.getLogger(__name__)
@@ -80,6 +81,17 @@ class FederationServerEntity(ServerUnit):
                 else:
                     setattr(self, attr, spec)
 
+    @property
+    def subordinate(self):
+        return self._subordinate
+
+    @subordinate.setter
+    def subordinate(self, db):
+        # Keep an index over the subordinates whatever the database
+        if not isinstance(db, SubordinateStore):
+            db = SubordinateStore(db)
+        self._subordinate = db
+
     def get_endpoints(self, *arg):
         return self.endpoint
 
@@ -0,0 +1,102 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from typing import Union
+
+from cryptojwt.jwt import utc_time_sans_frac
+from idpyoidc.message import Message
+from idpyoidc.server.endpoint import Endpoint
+
+from fedservice.entity.server.resolve import Resolve
+from fedservice.entity.utils import get_federation_entity
+from fedservice.entity_statement.create import create_entity_statement
+from fedservice.exception import NoTrustedChains
+from fedservice.message import BulkResolveRequest
+
+logger = logging.getLogger(__name__)
+
+
+class BulkResolve(Endpoint):
+    """
+    Resolves many subjects against one trust anchor in one request. The subjects are
+    resolved concurrently using the same caches as the Resolve endpoint and the results,
+    or errors, are returned in one signed response.
+    """
+    request_cls = BulkResolveRequest
+    response_format = "jose"
+    content_type = 'application/resolve-response+jwt'
+    name = "bulk_resolve"
+    endpoint_name = 'federation_bulk_resolve_endpoint'
+
+    def __init__(self,
+                 upstream_get,
+                 max_subjects: Optional[int] = 100,
+                 max_workers: Optional[int] = 8,
+                 lifetime: Optional[int] = 86400,
+                 **kwargs):
+        """
+        :param max_subjects: The maximum number of subjects in one request
+        :param max_workers: How many subjects are resolved in parallel
+        :param lifetime: The maximum lifetime of a response
+        """
+        Endpoint.__init__(self, upstream_get, **kwargs)
+        self.max_subjects = max_subjects
+        self.max_workers = max_workers
+        self.lifetime = lifetime
+        self._resolver = None
+
+    @property
+    def resolver(self) -> Resolve:
+        if self._resolver is None:
+            _resolver = self.upstream_get("unit").get_endpoint("resolve")
+            if _resolver is None:
+                # No resolve endpoint to share caches with
+                _resolver = Resolve(self.upstream_get)
+            self._resolver = _resolver
+        return self._resolver
+
+    def _resolve(self, sub: str, anchor: str, entity_type: str) -> dict:
+        try:
+            return self.resolver.resolve_subject(sub, anchor, entity_type)
+        except NoTrustedChains as err:
+            return {"error": "invalid_trust_chain", "error_description": str(err)}
+        except Exception as err:
+            logger.warning(f"Could not resolve {sub}: {err}")
+            return {"error": "server_error", "error_description": f"Could not resolve {sub}"}
+
+    def process_request(self, request=None, **kwargs):
+        _subjects = list(dict.fromkeys(request["sub"]))
+        if len(_subjects) > self.max_subjects:
+            return self.error_cls(error="invalid_request",
+                                  error_description=f"More than {self.max_subjects} subjects")
+
+        _anchor = request["anchor"]
+        _type = request.get("type", "")
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(_subjects))) as _executor:
+            _results = dict(zip(_subjects,
+                                _executor.map(lambda sub: self._resolve(sub, _anchor, _type),
+                                              _subjects)))
+
+        _now = utc_time_sans_frac()
+        _exp = min([_r["exp"] for _r in _results.values() if "exp" in _r],
+                   default=_now + self.lifetime)
+        _lifetime = min(self.lifetime, max(_exp - _now, 0))
+
+        _federation_entity = get_federation_entity(self)
+        _jws = create_entity_statement(_federation_entity.entity_id,
+                                       sub=_federation_entity.entity_id,
+                                       key_jar=_federation_entity.get_attribute('keyjar'),
+                                       lifetime=_lifetime,
+                                       include_jwks=False,
+                                       anchor=_anchor,
+                                       results={k: {_k: _v for _k, _v in v.items() if _k != "exp"}
+                                                for k, v in _results.items()})
+        return {'response_args': _jws}
+
+    def response_info(
+            self,
+            response_args: Optional[dict] = None,
+            request: Optional[Union[Message, dict]] = None,
+            **kwargs
+    ) -> dict:
+        return response_args
@@ -0,0 +1,73 @@
+import hashlib
+import json
+from typing import Optional
+from typing import Union
+
+from idpyoidc.message import Message
+from idpyoidc.server.endpoint import Endpoint
+from idpyoidc.server.endpoint import OAUTH2_NOCACHE_HEADERS
+
+from fedservice.http_cache import cache_control
+from fedservice.http_cache import etag
+from fedservice.http_cache import not_modified
+
+
+def fingerprint(**info) -> str:
+    """
+    A digest over the information a signed statement is built from. Used to find out
+    whether a statement has to be signed anew.
+    """
+    _info = json.dumps(info, sort_keys=True, default=str)
+    return hashlib.sha256(_info.encode()).hexdigest()
+
+
+class CacheableEndpoint(Endpoint):
+    """
+    An endpoint whose responses carry an ETag and a Cache-Control header such that
+    clients can cache them and make conditional requests. If the request information
+    (http_info) contains an If-None-Match header that matches, a 304 is returned.
+    """
+
+    def __init__(self, upstream_get, max_age: Optional[int] = 0, **kwargs):
+        """
+        :param max_age: For how many seconds a client may use a response without
+            revalidating it. 0 means that the client must always revalidate.
+        """
+        Endpoint.__init__(self, upstream_get=upstream_get, **kwargs)
+        self.max_age = max_age
+
+    def cacheable_response(self,
+                           body: str,
+                           key: Optional[str] = "response_msg",
+                           max_age: Optional[int] = None,
+                           http_info: Optional[dict] = None,
+                           **kwargs) -> dict:
+        """
+        :param body: The response body
+        :param key: Where in the response dictionary the body should be placed
+        :param max_age: Overrides the endpoint default
+        :param http_info: Information about the HTTP request
+        :return: Response dictionary
+        """
+        if max_age is None:
+            max_age = self.max_age
+        _etag = etag(body)
+        _headers = [("ETag", _etag), ("Cache-Control", cache_control(max_age))]
+        if not_modified(_etag, http_info):
+            return {key: "", "response_code": 304, "http_headers": _headers}
+        return {key: body, "http_headers": _headers}
+
+    def do_response(
+            self,
+            response_args: Optional[dict] = None,
+            request: Optional[Union[Message, dict]] = None,
+            error: Optional[str] = "",
+            **kwargs
+    ) -> dict:
+        _resp = Endpoint.do_response(self, response_args=response_args, request=request,
+                                     error=error, **kwargs)
+        if not error and [h for h in kwargs.get("http_headers", []) if h[0] == "Cache-Control"]:
+            # The default no caching headers do not apply
+            _resp["http_headers"] = [h for h in _resp["http_headers"] if
+                                     h not in OAUTH2_NOCACHE_HEADERS]
+        return _resp
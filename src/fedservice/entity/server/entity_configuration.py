@@ -2,17 +2,20 @@ from typing import Callable
 from typing import Optional
 from typing import Union
 
+from cryptojwt.jwt import utc_time_sans_frac
 from idpyoidc.message import Message
 
 from fedservice.entity.utils import get_federation_entity
 from fedservice.entity_statement.create import create_entity_statement
 from idpyoidc.message import oauth2
-from idpyoidc.server import Endpoint
+
+from fedservice.entity.server.cacheable import CacheableEndpoint
+from fedservice.entity.server.cacheable import fingerprint
 
 from fedservice.message import EntityStatement
 
 
-class EntityConfiguration(Endpoint):
+class EntityConfiguration(CacheableEndpoint):
     request_cls = oauth2.Message
     response_cls = EntityStatement
     request_format = ""
@@ -25,13 +28,32 @@ class EntityConfiguration(Endpoint):
     provider_info_attributes = None
     auth_method_attribute = ""
 
-    def __init__(self, upstream_get, **kwargs):
-        Endpoint.__init__(self, upstream_get=upstream_get, **kwargs)
+    def __init__(self,
+                 upstream_get,
+                 lifetime: Optional[int] = 86400,
+                 resign_fraction: Optional[float] = 0.5,
+                 check_interval: Optional[int] = 60,
+                 **kwargs):
+        """
+        The signed entity configuration is kept and served until the information in it
+        changes or resign_fraction of its lifetime has passed.
 
-    def process_request(self, request=None, **kwargs):
+        :param lifetime: The lifetime of the entity configuration in seconds
+        :param resign_fraction: After this fraction of the lifetime a new entity
+            configuration is signed. 0 means that it is signed anew for each request.
+        :param check_interval: For how many seconds the signed entity configuration is
+            served without checking whether metadata, keys, trust marks or authority
+            hints have changed. Call invalidate() to have a change show at once.
+        """
+        CacheableEndpoint.__init__(self, upstream_get=upstream_get, **kwargs)
+        self.lifetime = lifetime
+        self.resign_fraction = resign_fraction
+        self.check_interval = check_interval
+        self._signed = {}
+
+    def _statement_args(self) -> dict:
         _server = self.upstream_get("unit")
         _fed_entity = get_federation_entity(self)
-        _entity_id = _fed_entity.get_attribute('entity_id')
 
         if _fed_entity.upstream_get:
             _metadata = _fed_entity.upstream_get("metadata")
@@ -54,15 +76,53 @@ class EntityConfiguration(Endpoint):
         if _trust_mark_owners:
             args["trust_mark_owners"] = _trust_mark_owners
 
+        args["metadata"] = _metadata
+        args["authority_hints"] = _server.upstream_get('authority_hints')
+        return args
+
+    def invalidate(self):
+        """Makes the next request result in a newly signed entity configuration."""
+        self._signed = {}
+
+    def signed_entity_configuration(self) -> str:
+        _now = utc_time_sans_frac()
+        _signed = self._signed
+        if _signed and _now < _signed["resign_at"]:
+            if _now < _signed["checked_at"] + self.check_interval:
+                return _signed["jws"]
+        else:
+            _signed = {}
+
+        _fed_entity = get_federation_entity(self)
+        _entity_id = _fed_entity.get_attribute('entity_id')
+        _keyjar = _fed_entity.get_attribute('keyjar')
+        args = self._statement_args()
+        _fingerprint = fingerprint(args=args, jwks=_keyjar.export_jwks())
+        if _signed and _signed["fingerprint"] == _fingerprint:
+            _signed["checked_at"] = _now
+            return _signed["jws"]
 
         _ec = create_entity_statement(iss=_entity_id,
                                       sub=_entity_id,
-                                      key_jar=_fed_entity.get_attribute('keyjar'),
-                                      metadata=_metadata,
-                                      authority_hints=_server.upstream_get('authority_hints'),
+                                      key_jar=_keyjar,
+                                      lifetime=self.lifetime,
                                       **args
                                       )
-        return {"response": _ec}
+        self._signed = {
+            "jws": _ec,
+            "fingerprint": _fingerprint,
+            "checked_at": _now,
+            "resign_at": _now + int(self.lifetime * self.resign_fraction)
+        }
+        return _ec
+
+    def process_request(self, request=None, **kwargs):
+        _ec = self.signed_entity_configuration()
+        if self.max_age and self._signed:
+            # Must not be used by others after it has been replaced
+            _max_age = min(self.max_age, max(self._signed["resign_at"] - utc_time_sans_frac(), 0))
+            kwargs["max_age"] = _max_age
+        return self.cacheable_response(_ec, key="response", **kwargs)
 
     def response_info(
         self,
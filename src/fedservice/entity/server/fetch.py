@@ -1,16 +1,25 @@
 import logging
+from typing import Optional
 
+from cryptojwt.jwt import utc_time_sans_frac
 from idpyoidc.message import oidc
-from idpyoidc.server.endpoint import Endpoint
 
+from fedservice.entity.server.cacheable import CacheableEndpoint
+from fedservice.entity.server.cacheable import fingerprint
+from fedservice.entity_statement.cache import ESCache
 from fedservice.entity_statement.create import create_entity_statement
 from fedservice.exception import UnknownEntity
 from fedservice.message import EntityStatement
+from fedservice.scheduler import RefreshScheduler
 
 logger = logging.getLogger(__name__)
 
 
-class Fetch(Endpoint):
+def store_key(issuer, sub):
+    return f"{issuer}!!{sub}"
+
+
+class Fetch(CacheableEndpoint):
     request_cls = oidc.Message
     response_cls = EntityStatement
     response_format = "jose"
@@ -18,21 +27,175 @@ class Fetch(Endpoint):
     name = "fetch"
     endpoint_name = "federation_fetch_endpoint"
 
-    def __init__(self, upstream_get, **kwargs):
-        Endpoint.__init__(self, upstream_get=upstream_get, **kwargs)
+    def __init__(self,
+                 upstream_get,
+                 lifetime: Optional[int] = 86400,
+                 resign_fraction: Optional[float] = 0.5,
+                 store_size: Optional[int] = 10000,
+                 background: Optional[bool] = True,
+                 check_interval: Optional[int] = 60,
+                 **kwargs):
+        """
+        Signed subordinate statements are kept per subordinate. A new statement is
+        signed when the subordinate's record, the policy that applies to it or the
+        issuer's keys change. Statements that have been asked for since they were signed
+        are signed anew in the background when resign_fraction of their lifetime has
+        passed. The others are signed anew when they are next asked for.
+
+        :param lifetime: The lifetime of the subordinate statements in seconds
+        :param resign_fraction: After this fraction of the lifetime a new statement is
+            signed. 0 means that a statement is signed for each request.
+        :param store_size: The maximum number of signed statements kept
+        :param background: Whether statements should be refreshed in a background
+            thread. If False, the owner is expected to call run_pending() regularly.
+        :param check_interval: For how many seconds a stored statement is served without
+            checking whether the subordinate's record, the policy or the keys have
+            changed. Call invalidate() to have a change show at once.
+        """
+        CacheableEndpoint.__init__(self, upstream_get=upstream_get, **kwargs)
+        self.lifetime = lifetime
+        self.resign_fraction = resign_fraction
+        self.background = background
+        self.check_interval = check_interval
+        self.statement_store = ESCache(allowed_delta=0, max_size=store_size)
+        self.scheduler = RefreshScheduler(name="subordinate_statement_refresher")
 
     def get_policy(self, entity_id):
         pass
 
+    def _statement_args(self, issuer: str, sub: str) -> dict:
+        _server = self.upstream_get("unit")
+        # Contains jwks and possibly entity type and authority_hints
+        _response = _server.subordinate.get(sub)
+        if not _response:
+            logger.debug(f"Unknown subordinate: {sub}")
+            logger.debug(f"Known subordinates: {list(_server.subordinate.keys())}")
+            raise UnknownEntity(sub)
+
+        # The subordinate record must not be modified
+        _response = dict(_response)
+        if not 'authority_hints' in _response:
+            # If nothing specified add myself
+            _response["authority_hints"] = [issuer]
+
+        _policy = _server.policy.get(sub)
+        if not _policy:  # No entity specific policy
+            if 'entity_types' in _response:
+                _entity_types = _response['entity_types']
+                _response = {k: v for k, v in _response.items() if k != 'entity_types'}
+                _policy = {'metadata': {}, 'metadata_policy': {}}
+                for entity_type in _entity_types:
+                    _et_policy = _server.policy.get(entity_type)
+                    if not _et_policy:
+                        continue
+                    for _typ in ['metadata', 'metadata_policy']:
+                        if _typ in _et_policy:
+                            try:
+                                _policy[_typ].update({entity_type: _et_policy[_typ]})
+                            except KeyError:
+                                _policy[_typ] = {entity_type: _et_policy[_typ]}
+
+                if _policy == {'metadata': {}, 'metadata_policy': {}}:  # Nothing has changed
+                    _policy = None
+
+        if _policy:
+            _response.update(_policy)
+        return _response
+
+    def subordinate_statement(self, issuer: str, sub: str,
+                              requested: Optional[bool] = True) -> str:
+        """
+        :param requested: Whether the statement is asked for, rather than signed ahead
+            of time or refreshed
+        :return: A signed subordinate statement, a stored one if it is still up to date.
+        """
+        _now = utc_time_sans_frac()
+        _key = store_key(issuer, sub)
+        _stored = self.statement_store[_key]
+        if _stored and requested:
+            _stored["requested"] = True
+        if _stored and _now < _stored["checked_at"] + self.check_interval:
+            return _stored["jws"]
+
+        _keyjar = self.upstream_get('attribute', 'keyjar')
+        _args = self._statement_args(issuer, sub)
+        _fingerprint = fingerprint(args=_args, jwks=_keyjar.export_jwks())
+        if _stored and _stored["fingerprint"] == _fingerprint:
+            _stored["checked_at"] = _now
+            return _stored["jws"]
+
+        logger.debug(f"Signing subordinate statement about {sub}")
+        _es = create_entity_statement(iss=issuer,
+                                      sub=sub,
+                                      key_jar=_keyjar,
+                                      lifetime=self.lifetime,
+                                      **_args
+                                      )
+        _resign_at = _now + int(self.lifetime * self.resign_fraction)
+        self.statement_store.set(_key, {"jws": _es, "fingerprint": _fingerprint,
+                                        "checked_at": _now, "requested": requested},
+                                 expires_at=_resign_at)
+        if self.resign_fraction:
+            self.scheduler.schedule(_key, _resign_at, self.refresh, issuer, sub)
+            if self.background:
+                self.scheduler.start()
+        return _es
+
+    def refresh(self, issuer: str, sub: str):
+        """Sign a new statement about a subordinate before the stored one is replaced."""
+        _key = store_key(issuer, sub)
+        # Expired but still there
+        _stored = self.statement_store.get(_key)
+        if _stored is None:
+            # Evicted or invalidated
+            return
+        if not _stored.get("requested"):
+            logger.debug(f"The statement about {sub} has not been asked for, not refreshed")
+            return
+        # Remove it so a new statement is signed
+        del self.statement_store[_key]
+        try:
+            self.subordinate_statement(issuer, sub, requested=False)
+        except UnknownEntity:
+            logger.debug(f"{sub} is no longer a subordinate")
+
+    def presign(self, subordinates: Optional[list] = None):
+        """
+        Sign statements about subordinates ahead of time.
+
+        :param subordinates: The subordinates, if not given all of them
+        """
+        _issuer = self.upstream_get('attribute', 'entity_id')
+        if subordinates is None:
+            subordinates = list(self.upstream_get("unit").subordinate.keys())
+        for _sub in subordinates:
+            self.subordinate_statement(_issuer, _sub, requested=False)
+
+    def invalidate(self, sub: Optional[str] = None):
+        """
+        Remove stored statements such that new ones are signed.
+
+        :param sub: The subordinate, if not given statements about all are removed
+        """
+        for _key in list(self.statement_store.keys()):
+            if sub is None or _key.endswith(f"!!{sub}"):
+                del self.statement_store[_key]
+                self.scheduler.cancel(_key)
+
+    def run_pending(self) -> int:
+        return self.scheduler.run_pending()
+
+    def close(self):
+        self.scheduler.stop()
+
     def process_request(self, request=None, **kwargs):
-        _context = self.upstream_get("context")
         _issuer = request.get("iss")
         if not _issuer:
             _issuer = self.upstream_get('attribute','entity_id')
 
         _sub = request.get("sub")
-        _keyjar = self.upstream_get('attribute', 'keyjar')
         if not _sub or _sub == _issuer:
+            _keyjar = self.upstream_get('attribute', 'keyjar')
             _server = self.upstream_get("server")
             _entity = _server.upstream_get('unit')
             _metadata = _entity.get_metadata()
@@ -42,45 +205,5 @@ class Fetch(Endpoint):
                                           metadata=_metadata,
                                           authority_hints=self.upstream_get('authority_hints'))
         else:
-            _server = self.upstream_get("unit")
-            # Contains jwks and possibly entity type and authority_hints
-            _response = _server.subordinate.get(_sub)
-            if not _response:
-                logger.debug(f"Unknown subordinate: {_sub}")
-                logger.debug(f"Known subordinates: {list(_server.subordinate.keys())}")
-                raise UnknownEntity(_sub)
-
-            if not 'authority_hints' in _response:
-                # If nothing specified add myself
-                _response["authority_hints"] = [_issuer]
-
-            _policy = _server.policy.get(_sub)
-            if not _policy:  # No entity specific policy
-                if 'entity_types' in _response:
-                    _entity_types = _response['entity_types']
-                    _response = {k: v for k, v in _response.items() if k != 'entity_types'}
-                    _policy = {'metadata': {}, 'metadata_policy': {}}
-                    for entity_type in _entity_types:
-                        _et_policy = _server.policy.get(entity_type)
-                        if not _et_policy:
-                            continue
-                        for _typ in ['metadata', 'metadata_policy']:
-                            if _typ in _et_policy:
-                                try:
-                                    _policy[_typ].update({entity_type: _et_policy[_typ]})
-                                except KeyError:
-                                    _policy[_typ] = {entity_type: _et_policy[_typ]}
-
-                    if _policy == {'metadata': {}, 'metadata_policy': {}}:  # Nothing has changed
-                        _policy = None
-
-            if _policy:
-                _response.update(_policy)
-
-            _es = create_entity_statement(iss=_issuer,
-                                          sub=_sub,
-                                          key_jar=_keyjar,
-                                          **_response
-                                          )
-        return {"response_msg": _es}
-
+            _es = self.subordinate_statement(_issuer, _sub)
+        return self.cacheable_response(_es, **kwargs)
@@ -1,94 +1,213 @@
 import json
 import logging
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from urllib.parse import urlencode
 
 from cryptojwt import JWT
 from cryptojwt import KeyJar
+from cryptojwt.jwt import utc_time_sans_frac
 from idpyoidc.key_import import import_jwks
 from idpyoidc.message import oidc
-from idpyoidc.server.endpoint import Endpoint
+
+from fedservice.entity.function import get_trust_chain_collector
+from fedservice.entity.server.cacheable import CacheableEndpoint
+from fedservice.entity_statement.statement import parse_statement
+from fedservice.http_cache import cache_control
+from fedservice.scheduler import RefreshScheduler
 
 logger = logging.getLogger(__name__)
 
 
-class List(Endpoint):
+def as_bool(value) -> Optional[bool]:
+    # Query parameters arrive as strings
+    if isinstance(value, str):
+        return value.lower() == "true"
+    return value
+
+
+def held_trust_mark_ids(entity_configuration: dict) -> list:
+    """
+    :return: The IDs of the trust marks in an entity configuration that have not expired
+    """
+    _now = utc_time_sans_frac()
+    res = []
+    for _trust_mark in entity_configuration.get("trust_marks", []):
+        try:
+            _exp = parse_statement(_trust_mark["trust_mark"]).payload().get("exp")
+        except Exception:
+            _exp = None
+        if _exp and _exp <= _now:
+            continue
+        res.append(_trust_mark["trust_mark_id"])
+    return res
+
+
+def json_array(items: Iterable[str]) -> Iterator[str]:
+    """Produce a JSON array piece by piece."""
+    yield "["
+    for _index, _item in enumerate(items):
+        if _index:
+            yield ", "
+        yield json.dumps(_item)
+    yield "]"
+
+
+class List(CacheableEndpoint):
     request_cls = oidc.Message
     # response_cls = EntityIDList
     response_format = 'json'
     name = "list"
     endpoint_name = 'federation_list_endpoint'
 
-    def __init__(self, upstream_get, extended=False, **kwargs):
-        Endpoint.__init__(self, upstream_get, **kwargs)
-        self.extended = extended
+    def __init__(self,
+                 upstream_get,
+                 extended=False,
+                 trust_mark_refresh_interval: Optional[int] = 3600,
+                 background: Optional[bool] = True,
+                 default_limit: Optional[int] = 0,
+                 max_limit: Optional[int] = 0,
+                 stream: Optional[bool] = False,
+                 **kwargs):
+        """
+        Queries are answered from the index kept by the subordinate store. Which trust
+        marks the subordinates hold is collected from their entity configurations the
+        first time it is needed and then every trust_mark_refresh_interval seconds.
 
-    def filter(self,
-               subordinates: dict,
-               entity_type: str = '',
-               trust_mark_id: str = '',
-               trust_marked=None,
-               **kwargs):
-        match = []
-        for entity_id, conf in subordinates.items():
-            matched = False
-            if entity_type:
-                if entity_type in conf['metadata']:
-                    matched = True
-            if trust_marked:
-                if 'trust_marks' in conf:
-                    matched = True
-                else:
-                    matched = False
-            if trust_mark_id:
-                trust_marks = conf.get('trust_marks')
-                matched = False
-                for trust_mark in trust_marks:
-                    if trust_mark['trust_mark_id'] == trust_mark_id:
-                        matched = True
-
-            if matched:
-                match.append(entity_id)
-        return match
+        :param extended: Return the subordinates' entity configurations and not only
+            their entity IDs for trust mark queries
+        :param trust_mark_refresh_interval: Seconds between collecting trust marks
+        :param background: Whether trust marks should be collected in a background
+            thread. If False, the owner is expected to call run_pending() regularly.
+        :param default_limit: The page size if the request does not specify one.
+            0 means everything in one response.
+        :param max_limit: The largest page size allowed. 0 means no upper limit.
+        :param stream: Return the entity IDs as an iterator of JSON fragments that the
+            web framework can send as they are produced.
+        """
+        CacheableEndpoint.__init__(self, upstream_get, **kwargs)
+        self.extended = extended
+        self.trust_mark_refresh_interval = trust_mark_refresh_interval
+        self.background = background
+        self.default_limit = default_limit
+        self.max_limit = max_limit
+        self.stream = stream
+        self.entity_configurations = {}
+        self.scheduler = RefreshScheduler(name="subordinate_trust_mark_refresher")
 
     def process_request(self, request=None, **kwargs):
         _db = self.upstream_get("unit").subordinate
-        if not request or set(request.keys()).issubset({"client_id", "authenticated"}):
-            return {'response_msg': json.dumps(list(_db.keys()))}
-        else:
-            matched_entity_ids = set()
-            subordinate_conf = None
-            # I know about entity_types and intermediate or not from the registration
-            for entity_id, item in _db.items():
-                if "intermediate" in request and request["intermediate"]:
-                    if "intermediate" in item and item["intermediate"]:
-                        matched_entity_ids.add(entity_id)
-                        continue
-                if "entity_type" in request:
-                    if request["entity_type"] in item["entity_type"]:
-                        matched_entity_ids.add(entity_id)
+        if request is None:
+            request = {}
+
+        try:
+            _limit = int(request.get("limit", self.default_limit))
+        except ValueError:
+            return self.error_cls(error="invalid_request", error_description="Bad limit")
+        if _limit < 0:
+            return self.error_cls(error="invalid_request", error_description="Bad limit")
+        if self.max_limit and (not _limit or _limit > self.max_limit):
+            _limit = self.max_limit
+        _from = request.get("from_entity_id", "")
 
+        _trust_mark_query = "trust_marked" in request or "trust_mark_id" in request
+        if _trust_mark_query:
             # I don't expect to know about trust marks from the registration
-            if "trust_marked" in request or "trust_mark_id" in request:
-                subordinate_conf = self.collect_subordinates()
-                matched_entity_ids.update(self.filter(subordinates=subordinate_conf, **request))
+            self.keep_trust_marks_fresh()
+
+        _criteria = {
+            "entity_type": request.get("entity_type", ""),
+            "intermediate": as_bool(request.get("intermediate")),
+            "trust_marked": as_bool(request.get("trust_marked")),
+            "trust_mark_id": request.get("trust_mark_id", "")
+        }
+        # One more than asked for to know if there is a next page
+        matched_entity_ids = _db.page(from_entity_id=_from, limit=_limit + 1 if _limit else 0,
+                                      **_criteria)
+        _http_headers = []
+        if _limit and len(matched_entity_ids) > _limit:
+            _next = matched_entity_ids[_limit]
+            matched_entity_ids = matched_entity_ids[:_limit]
+            _http_headers.append(("Link", self.next_link(request, _next, _limit)))
+
+        if self.extended and _trust_mark_query:
+            _resp = self.cacheable_response(
+                json.dumps({id: self.entity_configurations[id] for id in matched_entity_ids if
+                            id in self.entity_configurations}), **kwargs)
+        elif self.stream:
+            # No ETag since the body is not known beforehand
+            _resp = {"response_msg": json_array(matched_entity_ids),
+                     "http_headers": [("Cache-Control", cache_control(self.max_age))]}
+        else:
+            _resp = self.cacheable_response("".join(json_array(matched_entity_ids)), **kwargs)
+
+        if _http_headers:
+            _resp["http_headers"] = _resp.get("http_headers", []) + _http_headers
+        return _resp
+
+    def next_link(self, request: dict, from_entity_id: str, limit: int) -> str:
+        _args = {k: v for k, v in request.items() if k not in ["client_id", "authenticated"]}
+        _args.update({"from_entity_id": from_entity_id, "limit": limit})
+        return f'<{getattr(self, "full_path", "")}?{urlencode(_args)}>; rel="next"'
+
+    def keep_trust_marks_fresh(self):
+        _db = self.upstream_get("unit").subordinate
+        if not _db.trust_marks_updated:
+            self.update_trust_marks()
+        if "trust_marks" not in self.scheduler:
+            self.scheduler.schedule("trust_marks",
+                                    utc_time_sans_frac() + self.trust_mark_refresh_interval,
+                                    self.refresh_trust_marks)
+            if self.background:
+                self.scheduler.start()
+
+    def update_trust_marks(self):
+        """
+        Collect the subordinates' entity configurations and record which trust marks
+        they hold.
+        """
+        _db = self.upstream_get("unit").subordinate
+        _entity_configurations = self.collect_subordinates()
+        for entity_id, _ec in _entity_configurations.items():
+            _db.set_trust_marks(entity_id, held_trust_mark_ids(_ec))
+        self.entity_configurations.update(_entity_configurations)
+        for entity_id in list(self.entity_configurations.keys()):
+            if entity_id not in _db:
+                del self.entity_configurations[entity_id]
+        _db.trust_marks_updated = utc_time_sans_frac()
+
+    def refresh_trust_marks(self):
+        try:
+            self.update_trust_marks()
+        finally:
+            self.scheduler.schedule("trust_marks",
+                                    utc_time_sans_frac() + self.trust_mark_refresh_interval,
+                                    self.refresh_trust_marks)
+
+    def run_pending(self) -> int:
+        return self.scheduler.run_pending()
 
-            if self.extended and subordinate_conf:
-                return {"response_msg": json.dumps({id: subordinate_conf[id] for id in
-                                                    matched_entity_ids})}
-            else:
-                return {"response_msg": json.dumps(list(matched_entity_ids))}
+    def close(self):
+        self.scheduler.stop()
 
     def collect_subordinates(self) -> dict:
         _server_entity = self.upstream_get("unit")
         _federation_entity = _server_entity.upstream_get("unit")
         keyjar = KeyJar()
-        _collector = _federation_entity.function.trust_chain_collector
+        _collector = get_trust_chain_collector(_federation_entity)
         sub = {}
         for entity_id, conf in _federation_entity.server.subordinate.items():
-            #  get entity configuration for subordinate
-            _entity_configuration = _collector.get_entity_configuration(entity_id)
-            # Verify signature with the keys I have
-            keyjar = import_jwks(keyjar, conf['jwks'], entity_id)
-            _jwt = JWT(key_jar=keyjar)
-            _ec = _jwt.unpack(_entity_configuration)
+            try:
+                #  get entity configuration for subordinate
+                _entity_configuration = _collector.get_entity_configuration(entity_id)
+                # Verify signature with the keys I have
+                keyjar = import_jwks(keyjar, conf['jwks'], entity_id)
+                _jwt = JWT(key_jar=keyjar)
+                _ec = _jwt.unpack(_entity_configuration)
+            except Exception as err:
+                # What was known before is kept
+                logger.warning(f"Could not get the entity configuration of {entity_id}: {err}")
+                continue
             sub[entity_id] = _ec
         return sub
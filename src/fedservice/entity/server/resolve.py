@@ -2,15 +2,19 @@ import logging
 from typing import Optional
 from typing import Union
 
+from cryptojwt.jwt import utc_time_sans_frac
 from idpyoidc.message import Message
 from idpyoidc.message import oidc
 from idpyoidc.server.endpoint import Endpoint
 
 from fedservice.entity.function import apply_policies
 from fedservice.entity.function import collect_trust_chains
+from fedservice.entity.function import get_trust_chain_collector
 from fedservice.entity.function import verify_trust_chains
 from fedservice.entity.utils import get_federation_entity
+from fedservice.entity_statement.cache import ESCache
 from fedservice.entity_statement.create import create_entity_statement
+from fedservice.exception import NoTrustedChains
 
 logger = logging.getLogger(__name__)
 
@@ -22,58 +26,141 @@ class Resolve(Endpoint):
     name = "resolve"
     endpoint_name = 'federation_resolve_endpoint'
 
-    def __init__(self, upstream_get, **kwargs):
+    def __init__(self,
+                 upstream_get,
+                 lifetime: Optional[int] = 86400,
+                 cache_size: Optional[int] = 1000,
+                 **kwargs):
+        """
+        Resolved information and signed responses are kept per subject, trust anchor and
+        entity type until the first of the trust chain or the trust marks in it expires.
+
+        :param lifetime: The maximum lifetime of a resolve response
+        :param cache_size: How many responses to keep. 0 means no caching.
+        """
         Endpoint.__init__(self, upstream_get, **kwargs)
+        self.lifetime = lifetime
+        if cache_size:
+            self.result_cache = ESCache(allowed_delta=0, max_size=cache_size)
+            self.response_cache = ESCache(allowed_delta=0, max_size=cache_size)
+        else:
+            self.result_cache = None
+            self.response_cache = None
+
+    @staticmethod
+    def cache_key(sub: str, anchor: str, entity_type: Optional[str] = "",
+                  with_ta_ec: Optional[bool] = False) -> str:
+        return f"{sub}!!{anchor}!!{entity_type or ''}!!{bool(with_ta_ec)}"
+
+    def invalidate(self, sub: Optional[str] = None):
+        """
+        Remove cached responses.
+
+        :param sub: The subject, if not given all responses are removed
+        """
+        for _cache in [self.result_cache, self.response_cache]:
+            if _cache is None:
+                continue
+            for _key in list(_cache.keys()):
+                if sub is None or _key.startswith(f"{sub}!!"):
+                    del _cache[_key]
 
     def process_request(self, request=None, **kwargs):
+        _key = self.cache_key(request["sub"], request["anchor"], request.get("type"),
+                              kwargs.get("with_ta_ec"))
+        if self.response_cache is not None:
+            _jws = self.response_cache[_key]
+            if _jws:
+                return {'response_args': _jws}
+
+        _jws, _exp = self.resolve(request, **kwargs)
+        if self.response_cache is not None:
+            self.response_cache.set(_key, _jws, expires_at=_exp)
+        return {'response_args': _jws}
+
+    def resolve(self, request, **kwargs) -> tuple:
+        """
+        :return: Tuple with the signed resolve response and when it expires
+        """
+        _federation_entity = get_federation_entity(self)
+        _result = self.resolve_subject(request["sub"], request["anchor"], request.get("type"),
+                                       kwargs.get("with_ta_ec"))
+        args = {k: v for k, v in _result.items() if k != "exp"}
+
+        # The response must not outlive what it is based on
+        _lifetime = min(self.lifetime, max(_result["exp"] - utc_time_sans_frac(), 0))
+        _jws = create_entity_statement(_federation_entity.entity_id,
+                                       sub=request["sub"],
+                                       key_jar=_federation_entity.get_attribute('keyjar'),
+                                       lifetime=_lifetime,
+                                       **args)
+        return _jws, utc_time_sans_frac() + _lifetime
+
+    def resolve_subject(self,
+                        sub: str,
+                        anchor: str,
+                        entity_type: Optional[str] = "",
+                        with_ta_ec: Optional[bool] = False) -> dict:
+        """
+        Collect and verify the trust chain from the subject to the trust anchor.
+
+        :return: Dictionary with metadata, trust_chain, trust_marks if there are any and
+            exp, when the information expires.
+        """
+        _key = self.cache_key(sub, anchor, entity_type, with_ta_ec)
+        if self.result_cache is not None:
+            _result = self.result_cache[_key]
+            if _result:
+                return _result
+
         _federation_entity = get_federation_entity(self)
-        _trust_anchor = request['anchor']
 
         # verified trust chains with policy adjusted metadata
         _chains, signed_entity_configuration = collect_trust_chains(_federation_entity,
-                                                                    entity_id=request['sub'],
-                                                                    stop_at=_trust_anchor)
+                                                                    entity_id=sub,
+                                                                    stop_at=anchor)
         _trust_chains = verify_trust_chains(_federation_entity, _chains,
                                             signed_entity_configuration)
         _trust_chains = apply_policies(_federation_entity, _trust_chains)
 
         _chosen_chain = None
         for trust_chain in _trust_chains:
-            if _trust_anchor == trust_chain.anchor:
+            if anchor == trust_chain.anchor:
                 _chosen_chain = trust_chain
                 break
 
-        if "type" in request:
-            metadata = {request['type']: _chosen_chain.metadata[request['type']]}
+        if _chosen_chain is None:
+            raise NoTrustedChains(f"No trust chain from {sub} to {anchor}")
+
+        if entity_type:
+            metadata = {entity_type: _chosen_chain.metadata[entity_type]}
         else:
-            metadata = _chosen_chain.metadata
+            metadata = _chosen_chain.metadata.copy()
 
+        _exp = _chosen_chain.exp
         # Now for the trust marks
         verified_trust_marks = []
         for _trust_mark in _chosen_chain.verified_chain[-1].get("trust_marks", []):
             _verified_mark = _federation_entity.function.trust_mark_verifier(trust_mark=_trust_mark,
-                                                                             trust_anchor=_trust_anchor)
+                                                                             trust_anchor=anchor)
             if _verified_mark:
+                if _verified_mark.get("exp"):
+                    _exp = min(_exp, _verified_mark["exp"])
                 verified_trust_marks.append({
                     "trust_mark_id":_verified_mark["trust_mark_id"],
                     "trust_mark": _trust_mark
                 })
 
-        trust_chain = _federation_entity.function.trust_chain_collector.get_chain(
-            _chosen_chain.iss_path, _trust_anchor, kwargs.get("with_ta_ec"))
+        trust_chain = get_trust_chain_collector(_federation_entity).get_chain(
+            _chosen_chain.iss_path, anchor, with_ta_ec)
 
+        _result = {"metadata": metadata, "trust_chain": trust_chain, "exp": _exp}
         if verified_trust_marks:
-            args = {"trust_marks": verified_trust_marks}
-        else:
-            args = {}
+            _result["trust_marks"] = verified_trust_marks
 
-        _jws = create_entity_statement(_federation_entity.entity_id,
-                                       sub=request["sub"],
-                                       key_jar=_federation_entity.get_attribute('keyjar'),
-                                       metadata=metadata,
-                                       trust_chain=trust_chain,
-                                       **args)
-        return {'response_args': _jws}
+        if self.result_cache is not None:
+            self.result_cache.set(_key, _result, expires_at=_exp)
+        return _result
 
     def response_info(
             self,
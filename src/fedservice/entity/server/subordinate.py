@@ -0,0 +1,243 @@
+import json
+import logging
+from bisect import bisect_left
+from bisect import insort
+from typing import Iterable
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def as_dict(record) -> dict:
+    # A file based database without value conversion gives back the stored JSON
+    if isinstance(record, str):
+        try:
+            return json.loads(record)
+        except ValueError:
+            return {}
+    return record
+
+
+def entity_types(record: dict) -> list:
+    # Registrations have used both names
+    _types = record.get("entity_types", record.get("entity_type", []))
+    if isinstance(_types, str):
+        return [_types]
+    return list(_types)
+
+
+class SubordinateStore(object):
+    """
+    Holds the information about subordinates together with an index over entity types,
+    whether the subordinate is an intermediate and the trust marks it holds.
+    The index is updated when subordinates are added, changed or removed through
+    the store. Subordinates added to or removed from the underlying database by other
+    means are picked up when the store is queried, as are records changed on disc in a
+    file based database. If a record is changed by other means reindex() must be
+    called.
+    """
+
+    def __init__(self, db: Optional[object] = None):
+        """
+        :param db: The subordinate database. Anything that behaves like a dictionary.
+        """
+        if db is None:
+            db = {}
+        self._db = db
+        self._types = {}
+        # Modification times of the records in a file based database when indexed
+        self._mtime = {}
+        self._by_type = {}
+        self._intermediate = set()
+        # All entity IDs in order, for pagination
+        self._sorted = []
+        self._by_trust_mark = {}
+        self._trust_marks = {}
+        # When the trust mark information was last updated
+        self.trust_marks_updated = 0
+        self.reindex()
+
+    def _index(self, entity_id: str, record: dict):
+        record = as_dict(record)
+        # Remember what was indexed, the record may be changed in place
+        _types = entity_types(record)
+        self._types[entity_id] = _types
+        for _type in _types:
+            self._by_type.setdefault(_type, set()).add(entity_id)
+        if record.get("intermediate"):
+            self._intermediate.add(entity_id)
+
+    def _unindex(self, entity_id: str):
+        for _type in self._types.pop(entity_id, []):
+            _ids = self._by_type.get(_type)
+            if _ids:
+                _ids.discard(entity_id)
+        self._intermediate.discard(entity_id)
+
+    def _modification_times(self) -> dict:
+        # Kept by file based databases, one file per record
+        _fmtime = getattr(self._db, "fmtime", None)
+        if not isinstance(_fmtime, dict):
+            return {}
+        _key_conv = getattr(self._db, "key_conv", None)
+        if _key_conv is None:
+            return dict(_fmtime)
+        return {_key_conv.deserialize(k): v for k, v in _fmtime.items()}
+
+    def reindex(self):
+        self._types = {}
+        self._by_type = {}
+        self._intermediate = set()
+        self._sorted = sorted(self._db.keys())
+        for entity_id, record in self._db.items():
+            self._index(entity_id, record)
+        self._mtime = self._modification_times()
+        for entity_id in list(self._trust_marks.keys()):
+            if entity_id not in self._db:
+                self.set_trust_marks(entity_id, [])
+
+    def refresh(self):
+        """
+        Bring the index up to date with subordinates that have been added to or removed
+        from the database by other means than through the store, and with records
+        changed on disc in a file based database. Only those records are read.
+        """
+        # A file based database looks for changes on disc here
+        _keys = set(self._db.keys())
+        _added = _keys.difference(self._types.keys())
+        _removed = set(self._types.keys()).difference(_keys)
+
+        _mtime = self._modification_times()
+        _changed = {_id for _id, _time in _mtime.items()
+                    if _id in self._types and self._mtime.get(_id) != _time}
+        self._mtime = _mtime
+
+        for entity_id in _removed:
+            self._unindex(entity_id)
+            self.set_trust_marks(entity_id, [])
+        for entity_id in _added.union(_changed):
+            self._unindex(entity_id)
+            self._index(entity_id, self._db[entity_id])
+
+        if _added or _removed:
+            self._sorted = sorted(_keys)
+
+    def set_trust_marks(self, entity_id: str, trust_mark_ids: Iterable[str]):
+        """
+        Record which trust marks a subordinate presently holds.
+
+        :param entity_id: The subordinate's entity ID
+        :param trust_mark_ids: The IDs of the trust marks
+        """
+        for _id in self._trust_marks.pop(entity_id, set()):
+            _ids = self._by_trust_mark.get(_id)
+            if _ids:
+                _ids.discard(entity_id)
+        _trust_mark_ids = set(trust_mark_ids)
+        if _trust_mark_ids:
+            self._trust_marks[entity_id] = _trust_mark_ids
+            for _id in _trust_mark_ids:
+                self._by_trust_mark.setdefault(_id, set()).add(entity_id)
+
+    def get_trust_marks(self, entity_id: str) -> set:
+        return self._trust_marks.get(entity_id, set())
+
+    def find(self,
+             entity_type: Optional[str] = "",
+             intermediate: Optional[bool] = None,
+             trust_marked: Optional[bool] = None,
+             trust_mark_id: Optional[str] = "") -> set:
+        """
+        Find the subordinates that match all the given criteria.
+
+        :return: Set of entity IDs
+        """
+        self.refresh()
+        _sets = []
+        if entity_type:
+            _sets.append(self._by_type.get(entity_type, set()))
+        if intermediate:
+            _sets.append(self._intermediate)
+        if trust_marked:
+            _sets.append(self._trust_marks.keys())
+        if trust_mark_id:
+            _sets.append(self._by_trust_mark.get(trust_mark_id, set()))
+
+        if _sets:
+            _sets.sort(key=len)
+            res = set(_sets[0])
+            for _set in _sets[1:]:
+                res.intersection_update(_set)
+        else:
+            res = set(self._types.keys())
+
+        if intermediate is False:
+            res.difference_update(self._intermediate)
+        return res
+
+    def page(self, from_entity_id: Optional[str] = "", limit: Optional[int] = 0,
+             **criteria) -> list:
+        """
+        Subordinates in entity ID order, starting with from_entity_id or the first one
+        after it.
+
+        :param from_entity_id: Where to start
+        :param limit: The maximum number of entity IDs to return, 0 means no limit
+        :param criteria: Criteria as for find()
+        :return: List of entity IDs
+        """
+        if any(criteria.values()) or criteria.get("intermediate") is False:
+            _ordered = sorted(self.find(**criteria))
+        else:
+            self.refresh()
+            _ordered = self._sorted
+
+        _start = bisect_left(_ordered, from_entity_id) if from_entity_id else 0
+        if limit:
+            return _ordered[_start:_start + limit]
+        return _ordered[_start:]
+
+    def __setitem__(self, entity_id: str, record: dict):
+        self._unindex(entity_id)
+        if entity_id not in self._db:
+            insort(self._sorted, entity_id)
+        self._db[entity_id] = record
+        self._index(entity_id, record)
+
+    def __getitem__(self, entity_id: str):
+        return self._db[entity_id]
+
+    def __delitem__(self, entity_id: str):
+        del self._db[entity_id]
+        self._unindex(entity_id)
+        _index = bisect_left(self._sorted, entity_id)
+        if _index < len(self._sorted) and self._sorted[_index] == entity_id:
+            del self._sorted[_index]
+        self.set_trust_marks(entity_id, [])
+
+    def __contains__(self, entity_id: str):
+        return entity_id in self._db
+
+    def __iter__(self):
+        return iter(self._db.keys())
+
+    def __len__(self):
+        return len(self._db)
+
+    def get(self, entity_id: str, default: Optional[dict] = None):
+        return self._db.get(entity_id, default)
+
+    def keys(self):
+        return self._db.keys()
+
+    def items(self):
+        return self._db.items()
+
+    def values(self):
+        return self._db.values()
+
+    def __getattr__(self, item):
+        # Anything else is handled by the database
+        if item == "_db":
+            raise AttributeError(item)
+        return getattr(self._db, item)
@@ -1,55 +1,449 @@
+import json
 import logging
+import sqlite3
+import threading
 from typing import Any
+from typing import Callable
 from typing import Optional
 
 from cryptojwt.jwt import utc_time_sans_frac
 from idpyoidc.impexp import ImpExp
+from idpyoidc.message import Message
+
+from fedservice.entity_statement.statement import parse_statement
+from fedservice.single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
 
+class SQLiteBackend(object):
+    """
+    File backed cache storage that can be shared by several processes on the same host.
+    Every item is stored together with the time at which it expires.
+    """
+
+    def __init__(self, path: str, table: Optional[str] = "es_cache"):
+        self.path = path
+        self.table = table
+        self._local = threading.local()
+        _conn = self._connection()
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} "
+                      f"(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at INTEGER)")
+        _conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_expires_at "
+                      f"ON {self.table} (expires_at)")
+        _conn.commit()
+
+    def _connection(self):
+        # sqlite3 connections can not be shared between threads
+        _conn = getattr(self._local, "connection", None)
+        if _conn is None:
+            _conn = sqlite3.connect(self.path, timeout=30)
+            self._local.connection = _conn
+        return _conn
+
+    @staticmethod
+    def _serialize(value):
+        if isinstance(value, Message):
+            _val = value.to_dict()
+            _jws = getattr(value, "_jws", None)
+            if _jws:
+                _val["_jws"] = _jws
+            return json.dumps(_val)
+        return json.dumps(value)
+
+    def get(self, key: str) -> Optional[tuple]:
+        _row = self._connection().execute(
+            f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if _row is None:
+            return None
+        return json.loads(_row[0]), _row[1]
+
+    def set(self, key: str, value: Any, expires_at: Optional[int] = None):
+        _conn = self._connection()
+        _conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) "
+                      f"VALUES (?, ?, ?)", (key, self._serialize(value), expires_at))
+        _conn.commit()
+
+    def delete(self, key: str):
+        _conn = self._connection()
+        _conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        _conn.commit()
+
+    def purge(self, now: int) -> int:
+        _conn = self._connection()
+        _cursor = _conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (now,))
+        _conn.commit()
+        return _cursor.rowcount
+
+    def keys(self) -> list:
+        return [_row[0] for _row in
+                self._connection().execute(f"SELECT key FROM {self.table}").fetchall()]
+
+    def __contains__(self, key: str) -> bool:
+        return self._connection().execute(
+            f"SELECT 1 FROM {self.table} WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self._connection().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
 class ESCache(ImpExp):
+    """
+    Cache for Entity Statements. An in-memory LRU tier, bounded by max_size, optionally
+    in front of a persistent backend. Items are evicted when they are within allowed_delta
+    seconds of their expiration time.
+    """
     parameter = {
         "_db": {},
-        "allowed_delta": 0
+        "_expires": {},
+        "allowed_delta": 0,
+        "max_size": 0
     }
 
-    def __init__(self, allowed_delta=300):
+    def __init__(self,
+                 allowed_delta: Optional[int] = 300,
+                 max_size: Optional[int] = 0,
+                 backend: Optional[object] = None):
         ImpExp.__init__(self)
         self._db = {}
+        self._expires = {}
         self.allowed_delta = allowed_delta
+        self.max_size = max_size
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
 
-    def __setitem__(self, key, value):
-        self._db[key] = value
+    def expires_at(self, value) -> Optional[int]:
+        """
+        When an item should be removed from the cache. Signed JWTs and dictionaries
+        are expected to carry an 'exp' claim. Other items never expires.
+        """
+        if isinstance(value, dict):
+            _exp = value.get("exp")
+        elif isinstance(value, str):
+            try:
+                _exp = parse_statement(value).payload().get("exp")
+            except Exception:
+                _exp = None
+        else:
+            _exp = None
 
-    def __getitem__(self, item):
-        try:
-            statement = self._db[item]
-        except KeyError:
+        if _exp is None:
             return None
+        return _exp - self.allowed_delta
+
+    def _memory_set(self, key, value, expires_at):
+        self._db.pop(key, None)
+        self._db[key] = value
+        if expires_at is None:
+            self._expires.pop(key, None)
         else:
-            if isinstance(statement, dict):
-                # verify that the statement is recent enough
-                _now = utc_time_sans_frac()
-                if _now < (statement["exp"] - self.allowed_delta):
-                    return statement
-                else:
-                    del self._db[item]
-                    return None
-            else:
-                return statement
+            self._expires[key] = expires_at
+
+        if self.max_size:
+            while len(self._db) > self.max_size:
+                _oldest = next(iter(self._db))
+                del self._db[_oldest]
+                self._expires.pop(_oldest, None)
+                self.evictions += 1
+
+    def set(self, key: str, value: Any, expires_at: Optional[int] = None):
+        """
+        Add an item to the cache.
+
+        :param key: The key
+        :param value: The value
+        :param expires_at: When the item should be evicted. If not given it is computed
+            from the value.
+        """
+        if expires_at is None:
+            expires_at = self.expires_at(value)
+
+        with self._lock:
+            self._memory_set(key, value, expires_at)
+        if self.backend is not None:
+            self.backend.set(key, value, expires_at)
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __getitem__(self, item):
+        _now = utc_time_sans_frac()
+        with self._lock:
+            if item in self._db:
+                _exp = self._expires.get(item)
+                if _exp is None or _now < _exp:
+                    self.hits += 1
+                    # Most recently used goes last
+                    _value = self._db.pop(item)
+                    self._db[item] = _value
+                    return _value
+                del self._db[item]
+                del self._expires[item]
+                if self.backend is not None:
+                    self.backend.delete(item)
+                self.misses += 1
+                return None
+
+        if self.backend is not None:
+            _res = self.backend.get(item)
+            if _res is not None:
+                _value, _exp = _res
+                if _exp is None or _now < _exp:
+                    self.hits += 1
+                    with self._lock:
+                        self._memory_set(item, _value, _exp)
+                    return _value
+                self.backend.delete(item)
+
+        self.misses += 1
+        return None
 
     def __delitem__(self, key):
-        del self._db[key]
+        with self._lock:
+            _known = key in self._db
+            self._db.pop(key, None)
+            self._expires.pop(key, None)
+        if self.backend is not None:
+            if not _known and key not in self.backend:
+                raise KeyError(key)
+            self.backend.delete(key)
+        elif not _known:
+            raise KeyError(key)
+
+    def purge(self) -> int:
+        """
+        Remove all expired items.
+
+        :return: The number of items removed from the memory tier
+        """
+        _now = utc_time_sans_frac()
+        with self._lock:
+            _expired = [k for k, _exp in self._expires.items() if _exp <= _now]
+            for key in _expired:
+                del self._db[key]
+                del self._expires[key]
+        if self.backend is not None:
+            self.backend.purge(_now)
+        return len(_expired)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._db)
+        }
 
     def keys(self):
+        if self.backend is not None:
+            return list(dict.fromkeys(list(self._db.keys()) + self.backend.keys()))
         return self._db.keys()
 
     def __len__(self):
-        return len(self._db)
+        return len(self.keys())
 
     def __contains__(self, item):
-        return item in self._db
+        if item in self._db:
+            return True
+        if self.backend is not None:
+            return item in self.backend
+        return False
 
     def get(self, key, default: Optional[Any] = None):
-        return self._db.get(key, default)
+        if key in self._db:
+            return self._db.get(key, default)
+        if self.backend is not None:
+            _res = self.backend.get(key)
+            if _res is not None:
+                return _res[0]
+        return default
+
+
+class TrustChainCache(object):
+    """
+    Cache for verified trust chains with the metadata policies applied.
+    Trust chains are stored per entity ID and trust anchor and are removed when the
+    trust chain expires. At most max_size entities are kept, the least recently used
+    are evicted first. Those getting trust chains from the cache get copies they are
+    free to change.
+    """
+
+    def __init__(self, max_size: Optional[int] = 1000):
+        # entity_id -> {trust_anchor: TrustChain}
+        self._db = {}
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # Entities whose trust chains have been gotten since they were stored
+        self._used = set()
+        self._lock = threading.RLock()
+        # Concurrent resolutions of the same entity's trust chains are done once
+        self.single_flight = SingleFlight()
+
+    def __setitem__(self, entity_id: str, trust_chains: list):
+        _chains = {}
+        for _trust_chain in trust_chains:
+            _chains[_trust_chain.anchor] = _trust_chain
+        with self._lock:
+            self._db.pop(entity_id, None)
+            self._db[entity_id] = _chains
+            self._used.discard(entity_id)
+            if self.max_size:
+                while len(self._db) > self.max_size:
+                    self._used.discard(next(iter(self._db)))
+                    del self._db[next(iter(self._db))]
+
+    def get(self, entity_id: str, default: Optional[Any] = None):
+        """
+        Get the verified trust chains for an entity. If one of the trust chains has
+        expired the entity is removed from the cache.
+
+        :param entity_id: The entity ID
+        :return: A list of copies of the cached TrustChain instances or the default if
+            none is cached.
+        """
+        with self._lock:
+            _chains = self._db.pop(entity_id, None)
+            if _chains is None:
+                self.misses += 1
+                return default
+
+            _now = utc_time_sans_frac()
+            if [_tc for _tc in _chains.values() if _tc.exp <= _now]:
+                logger.debug(f"Cached trust chain for {entity_id} has expired")
+                self._used.discard(entity_id)
+                self.misses += 1
+                return default
+
+            self._db[entity_id] = _chains
+            self._used.add(entity_id)
+            self.hits += 1
+            return [_tc.copy() for _tc in _chains.values()]
+
+    def peek(self, entity_id: str, default: Optional[Any] = None):
+        """
+        As get() but does not count as a use of the trust chains. Neither the order
+        of eviction nor the statistics are changed.
+        """
+        with self._lock:
+            _chains = self._db.get(entity_id)
+            if _chains is None:
+                return default
+            _now = utc_time_sans_frac()
+            if [_tc for _tc in _chains.values() if _tc.exp <= _now]:
+                return default
+            return [_tc.copy() for _tc in _chains.values()]
+
+    def used(self, entity_id: str) -> bool:
+        """
+        :return: Whether the trust chains for the entity have been gotten from the cache
+            since they were stored.
+        """
+        return entity_id in self._used
+
+    def get_trust_chain(self, entity_id: str, trust_anchor: str):
+        _trust_chains = self.get(entity_id)
+        if _trust_chains:
+            for _trust_chain in _trust_chains:
+                if _trust_chain.anchor == trust_anchor:
+                    return _trust_chain
+        return None
+
+    def __getitem__(self, entity_id: str):
+        _trust_chains = self.get(entity_id)
+        if _trust_chains is None:
+            raise KeyError(entity_id)
+        return _trust_chains
+
+    def __contains__(self, entity_id: str):
+        return self.get(entity_id) is not None
+
+    def __delitem__(self, entity_id: str):
+        with self._lock:
+            del self._db[entity_id]
+            self._used.discard(entity_id)
+
+    def keys(self):
+        return list(self._db.keys())
+
+    def __len__(self):
+        return len(self._db)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._db)}
+
+
+class TrustMarkStatusCache(object):
+    """
+    Cache for the answers from trust mark issuers' status endpoints. Answers are kept
+    per issuer, trust mark ID, subject and time of issue. Positive answers are kept for
+    positive_ttl seconds and negative for negative_ttl seconds but never beyond the
+    expiration time of the trust mark. Concurrent checks of the same trust mark result in
+    one request.
+    """
+
+    def __init__(self,
+                 positive_ttl: Optional[int] = 300,
+                 negative_ttl: Optional[int] = 60,
+                 max_size: Optional[int] = 10000):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self._db = ESCache(allowed_delta=0, max_size=max_size)
+        self._single_flight = SingleFlight()
+
+    @staticmethod
+    def key(issuer: str, trust_mark_id: str, sub: str, iat: Optional[int] = 0) -> str:
+        return f"{issuer}!!{trust_mark_id}!!{sub}!!{iat or ''}"
+
+    def get(self, key: str) -> Optional[bool]:
+        return self._db[key]
+
+    def set(self, key: str, active: bool, exp: Optional[int] = 0):
+        _ttl = self.positive_ttl if active else self.negative_ttl
+        if not _ttl:
+            return
+        _expires_at = utc_time_sans_frac() + _ttl
+        if exp:
+            _expires_at = min(_expires_at, exp)
+        self._db.set(key, active, expires_at=_expires_at)
+
+    def check(self, key: str, func: Callable, exp: Optional[int] = 0) -> bool:
+        """
+        :param key: Cache key
+        :param func: Asks the trust mark issuer, returns True if the trust mark is active
+        :param exp: When the trust mark expires
+        :return: True if the trust mark is active
+        """
+        _active = self.get(key)
+        if _active is not None:
+            return _active
+        return self._single_flight.do(key, self._check, key, func, exp)
+
+    def _check(self, key: str, func: Callable, exp: Optional[int] = 0) -> bool:
+        _active = bool(func())
+        self.set(key, _active, exp)
+        return _active
+
+    async def acheck(self, key: str, func: Callable, exp: Optional[int] = 0) -> bool:
+        """
+        As check() but func is a coroutine function.
+        """
+        _active = self.get(key)
+        if _active is not None:
+            return _active
+
+        return await self._single_flight.ado(key, self._acheck, key, func, exp)
+
+    async def _acheck(self, key: str, func: Callable, exp: Optional[int] = 0) -> bool:
+        _active = bool(await func())
+        self.set(key, _active, exp)
+        return _active
+
+    def stats(self) -> dict:
+        _stats = self._db.stats()
+        _stats["shared"] = self._single_flight.shared
+        return _stats
@@ -1,3 +1,5 @@
+import functools
+from typing import Iterable
 from typing import List
 from typing import Union
 
@@ -51,6 +53,106 @@ def more_specific(a, b):
     return False
 
 
+def reversed_labels(url):
+    _labels = remove_scheme(url).split('.')
+    _labels.reverse()
+    return _labels
+
+
+# Node keys that can not be labels
+_END = None
+_MIN_LENGTH = 0
+
+
+class NamingConstraintTrie(object):
+    """
+    Entity identifiers used as naming constraints stored label by label, top level domain
+    first. Finding out whether an entity identifier is covered by any of them only
+    takes as many steps as there are labels in the identifier.
+    Uses the same rules as more_specific().
+    """
+
+    def __init__(self, names: Iterable[str] = ()):
+        self._root = {}
+        self.names = []
+        for name in names:
+            self.add(name)
+
+    def add(self, name: str):
+        _labels = reversed_labels(name)
+        _length = len(_labels)
+        node = self._root
+        for label in _labels:
+            node = node.setdefault(label, {})
+            if label == "":
+                # An empty label matches any label in a name that is at least this long
+                node[_MIN_LENGTH] = min(node.get(_MIN_LENGTH, _length), _length)
+        node.setdefault(_END, []).append((len(self.names), _length))
+        self.names.append(name)
+
+    def matches(self, entity_id: str) -> bool:
+        """
+        :return: True if entity_id is more specific than, or the same as, one of the names
+        """
+        _labels = reversed_labels(entity_id)
+        _length = len(_labels)
+        node = self._root
+        for label in _labels:
+            if _END in node:
+                return True
+            if label != "":
+                _any = node.get("")
+                if _any is not None and _any[_MIN_LENGTH] <= _length:
+                    return True
+            node = node.get(label)
+            if node is None:
+                return False
+        return _END in node
+
+    def more_specific_than(self, name: str) -> List[int]:
+        """
+        :return: The indexes of the names that are more specific than, or the same as, name
+        """
+        _labels = reversed_labels(name)
+        res = []
+        self._collect(self._root, _labels, 0, res)
+        res.sort()
+        return res
+
+    def _collect(self, node: dict, labels: list, pos: int, res: list):
+        if pos == len(labels):
+            self._subtree(node, pos, res)
+        elif labels[pos] == "":
+            for key, child in node.items():
+                if key == "":
+                    self._collect(child, labels, pos + 1, res)
+                elif isinstance(key, str):
+                    self._subtree(child, len(labels), res)
+        else:
+            child = node.get(labels[pos])
+            if child is not None:
+                self._collect(child, labels, pos + 1, res)
+
+    def _subtree(self, node: dict, min_length: int, res: list):
+        for key, child in node.items():
+            if key is _END:
+                res.extend(_index for _index, _length in child if _length >= min_length)
+            elif isinstance(key, str):
+                self._subtree(child, min_length, res)
+
+
+@functools.lru_cache(maxsize=1024)
+def _naming_constraint_trie(names: tuple) -> NamingConstraintTrie:
+    return NamingConstraintTrie(names)
+
+
+def naming_constraint_trie(names: List[str]) -> NamingConstraintTrie:
+    """
+    A trie over a list of names. Built once for each distinct list.
+    """
+    return _naming_constraint_trie(tuple(names))
+
+
 # def add_permitted(new_permitted, permitted):
 #     _updated = []
 #     for _new in new_permitted:
@@ -63,16 +165,13 @@ def more_specific(a, b):
 
 
 def update_specs(new_constraints: list, old_constraints: list):
+    _trie = naming_constraint_trie(new_constraints)
     _updated = []
-    _replaced = False
     for _old in old_constraints:
-        _replaced = False
-        for _new in new_constraints:
-            if more_specific(_new, _old):
-                _updated.append(_new)
-                _replaced = True
-
-        if not _replaced:
+        _replacements = _trie.more_specific_than(_old)
+        if _replacements:
+            _updated.extend(new_constraints[_index] for _index in _replacements)
+        else:
             _updated.append(_old)
     return _updated
 
@@ -106,17 +205,11 @@ def update_naming_constraints(constraints: Union[dict, Message],
 
 
 def excluded(subject_id: str, excluded_ids: List[str]):
-    for excl in excluded_ids:
-        if more_specific(subject_id, excl):
-            return True
-    return False
+    return naming_constraint_trie(excluded_ids).matches(subject_id)
 
 
 def permitted(subject_id: str, permitted_id: List[str]):
-    for perm in permitted_id:
-        if more_specific(subject_id, perm):
-            return True
-    return False
+    return naming_constraint_trie(permitted_id).matches(subject_id)
 
 
 def meets_restrictions(trust_chain: List[EntityStatement]) -> bool:
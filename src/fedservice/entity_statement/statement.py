@@ -1,6 +1,14 @@
+import copy
+import functools
 import logging
+from collections.abc import KeysView
+from typing import Callable
+from typing import Iterable
 from typing import Optional
+from typing import Union
 
+from cryptojwt import as_unicode
+from cryptojwt.jws.jws import factory
 from cryptojwt.jwt import utc_time_sans_frac
 from idpyoidc.impexp import ImpExp
 
@@ -9,6 +17,153 @@ __author__ = 'roland'
 logger = logging.getLogger(__name__)
 
 
+class SignedStatement(str):
+    """
+    A signed JWT in compact serialization that is only parsed once. Can be used
+    wherever the compact serialization is expected.
+    """
+
+    def __new__(cls, token: Union[str, bytes]):
+        _statement = str.__new__(cls, as_unicode(token))
+        _statement._jws = None
+        _statement._payload = None
+        return _statement
+
+    @property
+    def jws(self):
+        """The parsed JWS, None if this is not a signed JWT."""
+        if self._jws is None:
+            self._jws = factory(str(self))
+        return self._jws
+
+    @property
+    def header(self) -> dict:
+        return self.jws.jwt.headers
+
+    def payload(self) -> dict:
+        """
+        The unverified payload. A new dictionary is returned on each call but the
+        claim values are shared.
+        """
+        if self._payload is None:
+            self._payload = self.jws.jwt.payload()
+        return self._payload.copy()
+
+    @property
+    def signing_input(self) -> bytes:
+        return self.jws.jwt.sign_input()
+
+    @property
+    def signature(self) -> bytes:
+        return self.jws.jwt.signature()
+
+
+def parse_statement(token: Union[str, bytes, SignedStatement]) -> SignedStatement:
+    if isinstance(token, SignedStatement):
+        return token
+    return SignedStatement(token)
+
+
+class LazyMetadata(dict):
+    """
+    Metadata per entity type where the metadata for an entity type is only evaluated,
+    by applying the metadata policies of the trust chain, the first time it is used.
+    The result is kept.
+    """
+    _pending = frozenset()
+
+    def __init__(self, entity_types: Optional[Iterable[str]] = None,
+                 evaluate: Optional[Callable] = None):
+        """
+        :param entity_types: The entity types that metadata can be evaluated for
+        :param evaluate: Function that given an entity type returns the metadata
+        """
+        dict.__init__(self)
+        self._pending = dict.fromkeys(entity_types or [])
+        self._evaluate = evaluate
+
+    def _resolve(self, entity_type: str):
+        if entity_type in self._pending:
+            # If evaluation fails it is tried again next time
+            dict.__setitem__(self, entity_type, self._evaluate(entity_type))
+            self._pending.pop(entity_type, None)
+
+    def resolve_all(self):
+        for _type in list(self._pending):
+            self._resolve(_type)
+
+    def __getitem__(self, entity_type: str):
+        self._resolve(entity_type)
+        return dict.__getitem__(self, entity_type)
+
+    def get(self, entity_type: str, default: Optional[dict] = None):
+        self._resolve(entity_type)
+        return dict.get(self, entity_type, default)
+
+    def __setitem__(self, entity_type: str, metadata: dict):
+        if entity_type in self._pending:
+            self._pending.pop(entity_type)
+        dict.__setitem__(self, entity_type, metadata)
+
+    def __delitem__(self, entity_type: str):
+        if entity_type in self._pending:
+            self._pending.pop(entity_type)
+        else:
+            dict.__delitem__(self, entity_type)
+
+    def pop(self, entity_type: str, *default):
+        self._resolve(entity_type)
+        return dict.pop(self, entity_type, *default)
+
+    def __contains__(self, entity_type: str):
+        return entity_type in self._pending or dict.__contains__(self, entity_type)
+
+    def __iter__(self):
+        # Listing the entity types does not require any evaluation
+        yield from dict.__iter__(self)
+        yield from list(self._pending)
+
+    def __len__(self):
+        return dict.__len__(self) + len(self._pending)
+
+    def keys(self):
+        return KeysView(self)
+
+    def items(self):
+        self.resolve_all()
+        return dict.items(self)
+
+    def values(self):
+        self.resolve_all()
+        return dict.values(self)
+
+    def copy(self):
+        self.resolve_all()
+        return dict(dict.items(self))
+
+    def __copy__(self):
+        # What has not been evaluated is not evaluated by copying
+        _copy = LazyMetadata(list(self._pending), self._evaluate)
+        dict.update(_copy, dict.items(self))
+        return _copy
+
+    def __eq__(self, other):
+        self.resolve_all()
+        if isinstance(other, LazyMetadata):
+            other.resolve_all()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        self.resolve_all()
+        return dict.__repr__(self)
+
+    def __reduce__(self):
+        return dict, (self.copy(),)
+
+
 class TrustChain(ImpExp):
     """
     Class in which to store the parsed result from applying metadata policies on a
@@ -73,6 +228,32 @@ class TrustChain(ImpExp):
         """
         return self.metadata
 
+    def copy(self):
+        """
+        A copy that can be changed without changing this trust chain. The lists and
+        dictionaries are copied but not what is in them.
+        """
+        _copy = copy.copy(self)
+        _copy.iss_path = list(self.iss_path)
+        _copy.err = dict(self.err)
+        _copy.combined_policy = dict(self.combined_policy)
+        if isinstance(self.metadata, LazyMetadata):
+            # Evaluated once, by this trust chain, for all copies
+            _copy.metadata = LazyMetadata(list(self.metadata._pending),
+                                          functools.partial(self._evaluate_for, _copy))
+            dict.update(_copy.metadata, dict.items(self.metadata))
+        else:
+            _copy.metadata = copy.copy(self.metadata)
+        if self.verified_chain is not None:
+            _copy.verified_chain = [_statement.copy() for _statement in self.verified_chain]
+        return _copy
+
+    def _evaluate_for(self, trust_chain: "TrustChain", entity_type: str):
+        _metadata = self.metadata.get(entity_type)
+        if entity_type in self.combined_policy:
+            trust_chain.combined_policy[entity_type] = self.combined_policy[entity_type]
+        return _metadata
+
     def is_expired(self):
         now = utc_time_sans_frac()
         if self.exp < now:
@@ -0,0 +1,166 @@
+"""
+HTTP caching support. Validators (ETag/Last-Modified) and Cache-Control directives on
+federation responses, on the sending as well as on the receiving side.
+"""
+import hashlib
+import logging
+from typing import Optional
+from typing import Union
+
+from cryptojwt.jwt import utc_time_sans_frac
+from cryptojwt.utils import as_bytes
+from requests.structures import CaseInsensitiveDict
+
+from fedservice.entity_statement.cache import ESCache
+
+logger = logging.getLogger(__name__)
+
+
+def etag(body: Union[str, bytes]) -> str:
+    return f'"{hashlib.sha256(as_bytes(body)).hexdigest()[:32]}"'
+
+
+def cache_control(max_age: Optional[int] = 0) -> str:
+    if max_age:
+        return f"max-age={max_age}"
+    # Can be stored but must be revalidated each time
+    return "no-cache"
+
+
+def parse_cache_control(value: Optional[str]) -> dict:
+    """
+    :param value: The value of a Cache-Control header
+    :return: Dictionary with directives as keys
+    """
+    res = {}
+    if not value:
+        return res
+    for directive in value.split(","):
+        directive = directive.strip().lower()
+        if not directive:
+            continue
+        if "=" in directive:
+            _key, _val = directive.split("=", 1)
+            res[_key.strip()] = _val.strip().strip('"')
+        else:
+            res[directive] = True
+    return res
+
+
+def not_modified(_etag: str, http_info: Optional[dict] = None) -> bool:
+    """
+    Check if the client already has the representation with this ETag.
+
+    :param _etag: The ETag of the present representation
+    :param http_info: HTTP request information, the headers are expected to be found
+        under 'headers' with lower case names.
+    """
+    if not http_info:
+        return False
+    _if_none_match = http_info.get("headers", {}).get("if-none-match")
+    if not _if_none_match:
+        return False
+    if _if_none_match.strip() == "*":
+        return True
+    for _tag in _if_none_match.split(","):
+        _tag = _tag.strip()
+        if _tag.startswith("W/"):
+            _tag = _tag[2:]
+        if _tag == _etag:
+            return True
+    return False
+
+
+class CachedResponse(object):
+    """The parts of a HTTP response that are kept in the cache."""
+
+    def __init__(self, url: str, status_code: int, headers: dict, text: str):
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.text = text
+        self.fresh_until = 0
+
+    @property
+    def content(self) -> bytes:
+        return as_bytes(self.text)
+
+
+class HTTPCache(object):
+    """
+    Keeps responses to GET requests together with their validators such that
+    requests can be made conditional. Responses are used without asking the server
+    for as long as Cache-Control max-age allows.
+    """
+
+    def __init__(self, max_size: Optional[int] = 1000):
+        self._db = ESCache(allowed_delta=0, max_size=max_size)
+
+    def fresh(self, url: str) -> Optional[CachedResponse]:
+        """
+        :return: The cached response if it can be used without revalidation.
+        """
+        _cached = self._db[url]
+        if _cached and utc_time_sans_frac() < _cached.fresh_until:
+            logger.debug(f"Fresh cached response for {url}")
+            return _cached
+        return None
+
+    def conditional_headers(self, url: str) -> dict:
+        _cached = self._db[url]
+        if _cached is None:
+            return {}
+
+        _headers = {}
+        if "etag" in _cached.headers:
+            _headers["If-None-Match"] = _cached.headers["etag"]
+        if "last-modified" in _cached.headers:
+            _headers["If-Modified-Since"] = _cached.headers["last-modified"]
+        return _headers
+
+    def update(self, url: str, response):
+        """
+        Update the cache with a response.
+
+        :param url: The URL the request was sent to
+        :param response: HTTP response
+        :return: The response to use. The cached one if the server said 304.
+        """
+        _headers = CaseInsensitiveDict(response.headers)
+        _directives = parse_cache_control(_headers.get("cache-control"))
+        if response.status_code == 304:
+            _cached = self._db[url]
+            if _cached is None:
+                # Should not happen, conditional requests are only sent if cached
+                return response
+            logger.debug(f"Not modified: {url}")
+            _cached.fresh_until = self._fresh_until(_directives)
+            return _cached
+        elif response.status_code != 200:
+            return response
+
+        if "no-store" in _directives:
+            if url in self._db:
+                del self._db[url]
+            return response
+
+        if "etag" in _headers or "last-modified" in _headers or "max-age" in _directives:
+            _cached = CachedResponse(url, response.status_code, _headers, response.text)
+            _cached.fresh_until = self._fresh_until(_directives)
+            self._db[url] = _cached
+        return response
+
+    @staticmethod
+    def _fresh_until(directives: dict) -> int:
+        if "no-cache" in directives:
+            return 0
+        try:
+            return utc_time_sans_frac() + int(directives["max-age"])
+        except (KeyError, ValueError):
+            return 0
+
+    def __contains__(self, url: str):
+        return url in self._db
+
+    def stats(self) -> dict:
+        return self._db.stats()
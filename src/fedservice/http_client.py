@@ -0,0 +1,120 @@
+import importlib.util
+import logging
+from typing import Optional
+from typing import Union
+
+import requests
+from idpyoidc.util import instantiate
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPClient(object):
+    """
+    Pooled HTTP client. Called the same way as requests.request.
+    Connections are kept alive and reused between requests to the same host.
+    Idempotent requests are retried with exponential backoff on connection errors
+    and on the status codes in status_forcelist.
+    If http2 is True and the httpx and h2 packages are installed, HTTP/2 is used.
+    """
+
+    def __init__(self,
+                 pool_connections: Optional[int] = 10,
+                 pool_maxsize: Optional[int] = 10,
+                 timeout: Optional[Union[float, tuple]] = 10.0,
+                 retries: Optional[int] = 2,
+                 backoff_factor: Optional[float] = 0.3,
+                 status_forcelist: Optional[list] = None,
+                 http2: Optional[bool] = False):
+        """
+        :param pool_connections: The number of hosts to keep connection pools for
+        :param pool_maxsize: The maximum number of connections per host
+        :param timeout: Default timeout, connect and read, in seconds
+        :param retries: How many times a failed request should be retried
+        :param backoff_factor: Retry number n waits backoff_factor * 2 ** (n - 1) seconds
+        :param status_forcelist: Response status codes that should cause a retry
+        :param http2: Use HTTP/2 if possible
+        """
+        self.timeout = timeout
+        if status_forcelist is None:
+            status_forcelist = [502, 503, 504]
+
+        self.http2 = http2 and httpx is not None and importlib.util.find_spec("h2") is not None
+        if http2 and not self.http2:
+            logger.warning("HTTP/2 needs the httpx and h2 packages, using HTTP/1.1")
+
+        if self.http2:
+            self._limits = httpx.Limits(max_connections=pool_connections * pool_maxsize,
+                                        max_keepalive_connections=pool_maxsize)
+            self._transport_retries = retries
+            # One connection pool per TLS verification setting
+            self._client = {}
+            self.session = None
+        else:
+            self.session = requests.Session()
+            _retry = Retry(total=retries, backoff_factor=backoff_factor,
+                           status_forcelist=status_forcelist,
+                           allowed_methods=frozenset(["GET", "HEAD", "OPTIONS"]),
+                           raise_on_status=False)
+            _adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                   max_retries=_retry)
+            self.session.mount("https://", _adapter)
+            self.session.mount("http://", _adapter)
+
+    def _get_client(self, verify):
+        _client = self._client.get(verify)
+        if _client is None:
+            # httpx only retries failed connection attempts
+            _transport = httpx.HTTPTransport(http2=True, verify=verify, limits=self._limits,
+                                             retries=self._transport_retries)
+            _client = httpx.Client(transport=_transport, timeout=self.timeout)
+            self._client[verify] = _client
+        return _client
+
+    def __call__(self, method: str, url: str, **kwargs):
+        if "timeout" not in kwargs:
+            kwargs["timeout"] = self.timeout
+
+        if self.session is not None:
+            return self.session.request(method, url, **kwargs)
+
+        _verify = kwargs.pop("verify", True)
+        _data = kwargs.pop("data", None)
+        if isinstance(_data, dict):
+            kwargs["data"] = _data
+        elif _data:
+            kwargs["content"] = _data
+        kwargs["follow_redirects"] = kwargs.pop("allow_redirects", True)
+        return self._get_client(_verify).request(method, url, **kwargs)
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+        else:
+            for _client in self._client.values():
+                _client.close()
+            self._client = {}
+
+
+def init_httpc(spec: Optional[Union[dict, object]] = None):
+    """
+    Create the default HTTP client if none is specified.
+
+    :param spec: A HTTP client, a dictionary with 'class' and 'kwargs' keys or
+        a dictionary with HTTPClient arguments.
+    :return: A HTTP client
+    """
+    if spec is None:
+        return HTTPClient()
+    elif isinstance(spec, dict):
+        if "class" in spec:
+            return instantiate(spec["class"], **spec.get("kwargs", {}))
+        return HTTPClient(**spec)
+    return spec
@@ -20,6 +20,7 @@ from idpyoidc.message import SINGLE_OPTIONAL_INT
 from idpyoidc.message import SINGLE_OPTIONAL_JSON
 from idpyoidc.message import SINGLE_OPTIONAL_STRING
 from idpyoidc.message import SINGLE_REQUIRED_INT
+from idpyoidc.message import SINGLE_REQUIRED_JSON
 from idpyoidc.message import SINGLE_REQUIRED_STRING
 from idpyoidc.message.oauth2 import ASConfigurationResponse
 from idpyoidc.message.oauth2 import ResponseMessage
@@ -143,6 +144,7 @@ class FederationEntity(InformationalMetadataExtensions):
         "federation_fetch_endpoint": SINGLE_OPTIONAL_STRING,
         "federation_list_endpoint": SINGLE_OPTIONAL_STRING,
         "federation_resolve_endpoint": SINGLE_OPTIONAL_STRING,
+        "federation_bulk_resolve_endpoint": SINGLE_OPTIONAL_STRING,
         "federation_trust_mark_status_endpoint": SINGLE_OPTIONAL_STRING,
         "federation_trust_mark_list_endpoint": SINGLE_OPTIONAL_STRING,
         "federation_trust_mark_endpoint": SINGLE_OPTIONAL_STRING,
@@ -664,12 +666,34 @@ class ResolveResponse(JsonWebToken):
     })
 
 
+class BulkResolveRequest(Message):
+    c_param = {
+        "sub": REQUIRED_LIST_OF_STRINGS,
+        "anchor": SINGLE_REQUIRED_STRING,
+        "type": SINGLE_OPTIONAL_STRING
+    }
+
+
+class BulkResolveResponse(JsonWebToken):
+    """
+    The results are keyed by subject. Each is either what a resolve response would
+    contain or an error response.
+    """
+    c_param = JsonWebToken.c_param.copy()
+    c_param.update({
+        'anchor': SINGLE_REQUIRED_STRING,
+        'results': SINGLE_REQUIRED_JSON
+    })
+
+
 class ListRequest(Message):
     c_param = {
         "entity_type": SINGLE_OPTIONAL_STRING,
         "trust_marked": SINGLE_OPTIONAL_BOOLEAN,
         "trust_mark_id": SINGLE_OPTIONAL_STRING,
-        "intermediate": SINGLE_OPTIONAL_BOOLEAN
+        "intermediate": SINGLE_OPTIONAL_BOOLEAN,
+        "limit": SINGLE_OPTIONAL_INT,
+        "from_entity_id": SINGLE_OPTIONAL_STRING
     }
 
 
@@ -0,0 +1,121 @@
+import heapq
+import itertools
+import logging
+import threading
+from typing import Callable
+from typing import Optional
+
+from cryptojwt.jwt import utc_time_sans_frac
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshScheduler(object):
+    """
+    Runs jobs at given points in time in a background thread. A job is identified by a
+    key, scheduling a job using a key that is already in use replaces the earlier job.
+    """
+
+    def __init__(self, name: Optional[str] = "refresh_scheduler"):
+        self.name = name
+        self._heap = []
+        # key -> (when, sequence number, function, arguments)
+        self._jobs = {}
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def schedule(self, key: str, when: int, func: Callable, *args):
+        """
+        Schedule a job.
+
+        :param key: Job identifier
+        :param when: When the job should be run, seconds since the epoch
+        :param func: The function to call
+        :param args: Arguments to the function
+        """
+        with self._condition:
+            _seq = next(self._counter)
+            self._jobs[key] = (when, _seq, func, args)
+            heapq.heappush(self._heap, (when, _seq, key))
+            self._condition.notify()
+
+    def cancel(self, key: str):
+        with self._condition:
+            self._jobs.pop(key, None)
+
+    def next_run(self, key: str) -> Optional[int]:
+        _job = self._jobs.get(key)
+        if _job:
+            return _job[0]
+        return None
+
+    def __contains__(self, key: str):
+        return key in self._jobs
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def _pop_due(self, now: int) -> list:
+        _due = []
+        while self._heap and self._heap[0][0] <= now:
+            _when, _seq, key = heapq.heappop(self._heap)
+            _job = self._jobs.get(key)
+            # Skip jobs that have been cancelled or rescheduled
+            if _job and _job[1] == _seq:
+                del self._jobs[key]
+                _due.append((key, _job[2], _job[3]))
+        return _due
+
+    def run_pending(self, now: Optional[int] = 0) -> int:
+        """
+        Run all the jobs that are due in the calling thread.
+
+        :param now: The present time, if not given the system clock is used
+        :return: The number of jobs run
+        """
+        with self._condition:
+            _due = self._pop_due(now or utc_time_sans_frac())
+
+        for key, func, args in _due:
+            try:
+                func(*args)
+            except Exception as err:
+                logger.exception(f"Scheduled job {key} failed: {err}")
+        return len(_due)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    # Drop jobs that have been cancelled or rescheduled
+                    while self._heap and (self._jobs.get(self._heap[0][2], (0, -1))[1]
+                                          != self._heap[0][1]):
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    _wait = self._heap[0][0] - utc_time_sans_frac()
+                    if _wait <= 0:
+                        break
+                    self._condition.wait(_wait)
+                if self._stopped:
+                    return
+            self.run_pending()
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,84 @@
+import asyncio
+import threading
+from typing import Any
+from typing import Callable
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.thread = threading.get_ident()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls with the same key. While a call is in progress others
+    with the same key wait for it to finish and get the same result, or exception,
+    instead of doing the same work again. do() is for threads and ado() for coroutines.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+        # How many calls did not have to be made
+        self.shared = 0
+
+    def do(self, key: Any, func: Callable, *args, **kwargs):
+        """
+        :param key: Identifies the call
+        :param func: The function to call
+        :return: What the function returned
+        """
+        with self._lock:
+            _call = self._calls.get(key)
+            if _call is not None and _call.thread == threading.get_ident():
+                # Called again from within the call, waiting would never end
+                _leader = None
+            elif _call is not None:
+                self.shared += 1
+                _leader = False
+            else:
+                _call = self._calls[key] = _Call()
+                _leader = True
+
+        if _leader is None:
+            return func(*args, **kwargs)
+        elif not _leader:
+            _call.done.wait()
+            if _call.error is not None:
+                raise _call.error
+            return _call.result
+
+        try:
+            _call.result = func(*args, **kwargs)
+        except Exception as err:
+            _call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            _call.done.set()
+        return _call.result
+
+    async def ado(self, key: Any, func: Callable, *args, **kwargs):
+        """
+        :param key: Identifies the call
+        :param func: A coroutine function
+        :return: What the coroutine returned
+        """
+        _task = self._tasks.get(key)
+        if _task is None:
+            _task = asyncio.ensure_future(func(*args, **kwargs))
+            self._tasks[key] = _task
+            _task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self.shared += 1
+        # One waiter being cancelled should not cancel the call for the others
+        return await asyncio.shield(_task)
+
+    def __contains__(self, key: Any):
+        return key in self._calls or key in self._tasks
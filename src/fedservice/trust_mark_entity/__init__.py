@@ -1,49 +1,146 @@
 import json
 import os
+import sqlite3
+import threading
 from typing import Optional
 
 from cryptojwt.jwt import utc_time_sans_frac
 
 
 class FileDB(object):
+    """
+    Keeps issued trust marks in one file per trust mark ID, one JSON document per line.
+    Files are only appended to. An in-memory index from trust mark ID and subject to
+    the latest issued trust mark is built when the files are opened and kept up to date
+    with lines appended by others.
+    """
 
     def __init__(self, **kwargs):
         self.config = kwargs
+        # trust_mark_id -> {sub: latest record}, the last issued last
+        self._index = {}
+        # trust_mark_id -> {sub: {iat: exp}}
+        self._issued_at = {}
+        # trust_mark_id -> how far into the file has been read
+        self._offset = {}
         for trust_mark_id, file_name in self.config.items():
             if not os.path.exists(file_name):
                 # Only need to touch it
                 fp = open(file_name, "w")
                 fp.close()
+            self._reindex(trust_mark_id)
+
+    def _index_record(self, trust_mark_id: str, tm_info: dict):
+        _subs = self._index[trust_mark_id]
+        # Latest issued goes last
+        _subs.pop(tm_info["sub"], None)
+        _subs[tm_info["sub"]] = tm_info
+        self._issued_at[trust_mark_id].setdefault(tm_info["sub"], {})[
+            tm_info.get("iat")] = tm_info.get("exp")
+
+    def _reindex(self, trust_mark_id: str):
+        self._index[trust_mark_id] = {}
+        self._issued_at[trust_mark_id] = {}
+        self._offset[trust_mark_id] = 0
+        self._read_new(trust_mark_id)
+
+    def _read_new(self, trust_mark_id: str):
+        """Index lines added to the file since it was last read."""
+        _file_name = self.config[trust_mark_id]
+        _size = os.path.getsize(_file_name)
+        _offset = self._offset[trust_mark_id]
+        if _size == _offset:
+            return
+        if _size < _offset:
+            # Compacted by someone else
+            self._reindex(trust_mark_id)
+            return
+
+        with open(_file_name, "rb") as fp:
+            fp.seek(_offset)
+            for line in fp:
+                if not line.endswith(b"\n"):
+                    # Incomplete, the write has not finished or was interrupted
+                    break
+                _offset += len(line)
+                try:
+                    _tmi = json.loads(line)
+                except ValueError:
+                    continue
+                self._index_record(trust_mark_id, _tmi)
+        self._offset[trust_mark_id] = _offset
 
     def add(self, tm_info: dict):
         trust_mark_id = tm_info['trust_mark_id']
+        self._read_new(trust_mark_id)
         # adds a line with info about a trust mark info to the end of a file
-        with open(self.config[trust_mark_id], "a") as fp:
-            fp.write(json.dumps(tm_info) + '\n')
+        with open(self.config[trust_mark_id], "ab") as fp:
+            if fp.tell() > self._offset[trust_mark_id]:
+                # Make sure a line that was cut short doesn't swallow this one
+                fp.write(b"\n")
+            fp.write(json.dumps(tm_info).encode() + b"\n")
+            fp.flush()
+            os.fsync(fp.fileno())
+        self._read_new(trust_mark_id)
 
-    def _match(self, sub, iat, tmi):
-        if sub == tmi["sub"]:
-            if iat:
-                if iat == tmi['iat']:
-                    return True
-            else:
-                return True
-        return False
+    def latest(self, trust_mark_id: str, sub: str) -> Optional[dict]:
+        """
+        :return: The latest trust mark issued to the subject
+        """
+        if trust_mark_id not in self.config:
+            return None
+        self._read_new(trust_mark_id)
+        return self._index[trust_mark_id].get(sub)
 
     def find(self, trust_mark_id: str, sub: str, iat: Optional[int] = 0):
-        with open(self.config[trust_mark_id], "r") as fp:
-            # Get the last issued
-            for line in reversed(list(fp)):
-                _tmi = json.loads(line.rstrip())
+        """
+        :param iat: When the trust mark was issued. If not given the latest trust mark
+            issued to the subject is used.
+        :return: True if the trust mark was issued and has not expired
+        """
+        _tmi = self.latest(trust_mark_id, sub)
+        if not _tmi:
+            return False
+
+        if iat:
+            _issued = self._issued_at[trust_mark_id].get(sub, {})
+            if iat not in _issued:
+                return False
+            _exp = _issued[iat]
+        else:
+            _exp = _tmi.get("exp")
 
-                if 'exp' in _tmi:
-                    now = utc_time_sans_frac()
-                    if now > _tmi["exp"]:
-                        return False
+        if _exp and utc_time_sans_frac() > _exp:
+            return False
+        return True
 
-                if self._match(sub, iat, _tmi):
-                    return True
-        return False
+    def compact(self, trust_mark_id: Optional[str] = "", drop_expired: Optional[bool] = True):
+        """
+        Rewrite the files keeping only the latest trust mark issued to each subject.
+        The new file replaces the old one in one atomic operation.
+
+        :param trust_mark_id: Which file, if not given all files are compacted
+        :param drop_expired: Whether trust marks that have expired should be removed
+        """
+        if trust_mark_id:
+            _ids = [trust_mark_id]
+        else:
+            _ids = list(self.config.keys())
+
+        now = utc_time_sans_frac()
+        for _id in _ids:
+            self._read_new(_id)
+            _file_name = self.config[_id]
+            _tmp_name = f"{_file_name}.tmp"
+            with open(_tmp_name, "wb") as fp:
+                for _tmi in self._index[_id].values():
+                    if drop_expired and "exp" in _tmi and now > _tmi["exp"]:
+                        continue
+                    fp.write(json.dumps(_tmi).encode() + b"\n")
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(_tmp_name, _file_name)
+            self._reindex(_id)
 
     def __contains__(self, item):
         return item in self.config
@@ -68,28 +165,155 @@ class FileDB(object):
             with open(self.config[entity_id], "a") as fp:
                 for tm_info in info[entity_id]:
                     fp.write(tm_info + '\n')
+            self._read_new(entity_id)
 
     def loads(self, str):
         self.load(json.loads(str))
 
     def list(self, trust_mark_id: str, sub: Optional[str] = ""):
-        res = []
-        try:
-            with open(self.config[trust_mark_id], "r") as fp:
-                # Get the last issued
-                for line in reversed(list(fp)):
-                    _tmi = json.loads(line.rstrip())
-                    if _tmi["sub"] not in res:
-                        if sub:
-                            if _tmi["sub"] == sub:
-                                res.append(_tmi["sub"])
-                        else:
-                            res.append(_tmi["sub"])
-        except KeyError as err:
-            pass
+        if trust_mark_id not in self.config:
+            return []
+        self._read_new(trust_mark_id)
+        _subs = self._index[trust_mark_id]
+        if sub:
+            if sub in _subs:
+                return [sub]
+            return []
+        # Last issued first
+        return list(reversed(_subs.keys()))
+
+
+class SQLiteDB(object):
+    """
+    Keeps issued trust marks in a SQLite database. The database can be shared by
+    several worker processes on the same host.
+    """
+
+    def __init__(self, path: str, table: Optional[str] = "trust_mark"):
+        """
+        :param path: Path to the database file
+        :param table: Name of the table
+        """
+        self.path = path
+        self.table = table
+        self._local = threading.local()
+        _conn = self._connection()
+        # Readers don't block the writer and vice versa
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} "
+                      f"(id INTEGER PRIMARY KEY AUTOINCREMENT, trust_mark_id TEXT NOT NULL, "
+                      f"sub TEXT NOT NULL, iat INTEGER, exp INTEGER, info TEXT NOT NULL)")
+        _conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_id_sub_iat "
+                      f"ON {self.table} (trust_mark_id, sub, iat)")
+        _conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_exp ON {self.table} (exp)")
+        _conn.commit()
+
+    def _connection(self):
+        # sqlite3 connections can not be shared between threads
+        _conn = getattr(self._local, "connection", None)
+        if _conn is None:
+            _conn = sqlite3.connect(self.path, timeout=30)
+            self._local.connection = _conn
+        return _conn
+
+    def _insert(self, _conn, tm_info: dict):
+        _conn.execute(f"INSERT INTO {self.table} (trust_mark_id, sub, iat, exp, info) "
+                      f"VALUES (?, ?, ?, ?, ?)",
+                      (tm_info["trust_mark_id"], tm_info["sub"], tm_info.get("iat"),
+                       tm_info.get("exp"), json.dumps(tm_info)))
+
+    def add(self, tm_info: dict):
+        _conn = self._connection()
+        self._insert(_conn, tm_info)
+        _conn.commit()
 
+    def latest(self, trust_mark_id: str, sub: str) -> Optional[dict]:
+        """
+        :return: The latest trust mark issued to the subject
+        """
+        _row = self._connection().execute(
+            f"SELECT info FROM {self.table} WHERE trust_mark_id = ? AND sub = ? "
+            f"ORDER BY id DESC LIMIT 1", (trust_mark_id, sub)).fetchone()
+        if _row is None:
+            return None
+        return json.loads(_row[0])
+
+    def find(self, trust_mark_id: str, sub: str, iat: Optional[int] = 0) -> bool:
+        """
+        :param iat: When the trust mark was issued. If not given the latest trust mark
+            issued to the subject is used.
+        :return: True if the trust mark was issued and has not expired
+        """
+        if iat:
+            _row = self._connection().execute(
+                f"SELECT exp FROM {self.table} WHERE trust_mark_id = ? AND sub = ? AND iat = ? "
+                f"ORDER BY id DESC LIMIT 1", (trust_mark_id, sub, iat)).fetchone()
+            if _row is None:
+                return False
+            _exp = _row[0]
+        else:
+            _tmi = self.latest(trust_mark_id, sub)
+            if not _tmi:
+                return False
+            _exp = _tmi.get("exp")
+
+        if _exp and utc_time_sans_frac() > _exp:
+            return False
+        return True
+
+    def purge(self, now: Optional[int] = 0) -> int:
+        """
+        Remove trust marks that have expired.
+
+        :return: The number of trust marks removed
+        """
+        _conn = self._connection()
+        _cursor = _conn.execute(f"DELETE FROM {self.table} WHERE exp < ?",
+                                (now or utc_time_sans_frac(),))
+        _conn.commit()
+        return _cursor.rowcount
+
+    def __contains__(self, item):
+        return self._connection().execute(
+            f"SELECT 1 FROM {self.table} WHERE trust_mark_id = ? LIMIT 1",
+            (item,)).fetchone() is not None
+
+    def id_keys(self):
+        return [_row[0] for _row in self._connection().execute(
+            f"SELECT DISTINCT trust_mark_id FROM {self.table}").fetchall()]
+
+    def dump(self):
+        res = {}
+        for trust_mark_id, info in self._connection().execute(
+                f"SELECT trust_mark_id, info FROM {self.table} ORDER BY id").fetchall():
+            res.setdefault(trust_mark_id, []).append(info)
         return res
 
+    def dumps(self):
+        return json.dumps(self.dump())
+
+    def load(self, info):
+        _conn = self._connection()
+        for trust_mark_id, lines in info.items():
+            for tm_info in lines:
+                self._insert(_conn, json.loads(tm_info))
+        _conn.commit()
+
+    def loads(self, str):
+        self.load(json.loads(str))
+
+    def list(self, trust_mark_id: str, sub: Optional[str] = ""):
+        if sub:
+            if self._connection().execute(
+                    f"SELECT 1 FROM {self.table} WHERE trust_mark_id = ? AND sub = ? LIMIT 1",
+                    (trust_mark_id, sub)).fetchone():
+                return [sub]
+            return []
+        # Last issued first
+        return [_row[0] for _row in self._connection().execute(
+            f"SELECT sub FROM {self.table} WHERE trust_mark_id = ? GROUP BY sub "
+            f"ORDER BY MAX(id) DESC", (trust_mark_id,)).fetchall()]
+
 
 class SimpleDB(object):
 
@@ -196,6 +196,10 @@ class SelfSignedTrustMarkEntity(Unit):
         _trust_mark = packer.pack(payload=content)
         entity = self.upstream_get("unit")
         entity.context.trust_marks.append(_trust_mark)
+        # Shows in the entity configuration at once
+        _endpoint = _federation_entity.get_endpoint("entity_configuration")
+        if _endpoint:
+            _endpoint.invalidate()
 
         return _trust_mark
 
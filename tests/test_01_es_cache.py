@@ -0,0 +1,141 @@
+from cryptojwt.jwt import utc_time_sans_frac
+
+from fedservice.entity_statement.cache import ESCache
+from fedservice.entity_statement.cache import SQLiteBackend
+from fedservice.entity_statement.cache import TrustChainCache
+from fedservice.entity_statement.cache import TrustMarkStatusCache
+from fedservice.entity_statement.statement import TrustChain
+
+
+def _statement(iss, lifetime=3600):
+    return {"iss": iss, "sub": iss, "exp": utc_time_sans_frac() + lifetime}
+
+
+def test_expired_statement():
+    _cache = ESCache(allowed_delta=300)
+    _cache["https://op.example.org"] = _statement("https://op.example.org", lifetime=200)
+    assert _cache["https://op.example.org"] is None
+    assert "https://op.example.org" not in _cache
+    assert _cache.stats()["misses"] == 1
+
+
+def test_lru():
+    _cache = ESCache(allowed_delta=0, max_size=2)
+    _cache["a"] = _statement("https://a.example.org")
+    _cache["b"] = _statement("https://b.example.org")
+    assert _cache["a"]
+    _cache["c"] = _statement("https://c.example.org")
+    # 'b' was the least recently used
+    assert set(_cache.keys()) == {"a", "c"}
+    assert _cache.stats() == {"hits": 1, "misses": 0, "evictions": 1, "size": 2}
+
+
+def test_purge():
+    _cache = ESCache(allowed_delta=0)
+    _cache["a"] = _statement("https://a.example.org")
+    _cache["b"] = _statement("https://b.example.org", lifetime=-10)
+    _cache["c"] = "not a statement"
+    assert _cache.purge() == 1
+    assert set(_cache.keys()) == {"a", "c"}
+
+
+def test_sqlite_backend(tmp_path):
+    file_name = str(tmp_path / 'es_cache.db')
+    _cache = ESCache(allowed_delta=0, backend=SQLiteBackend(file_name))
+    _cache["a"] = _statement("https://a.example.org")
+    _cache["b"] = _statement("https://b.example.org", lifetime=-10)
+
+    # Another process using the same file
+    _other = ESCache(allowed_delta=0, backend=SQLiteBackend(file_name))
+    assert _other["a"]["iss"] == "https://a.example.org"
+    assert _other["b"] is None
+    assert _other.stats()["hits"] == 1
+    assert "b" not in _cache.backend
+
+
+def test_trust_chain_cache():
+    _cache = TrustChainCache(max_size=2)
+    _cache["https://rp.example.org"] = [
+        TrustChain(anchor="https://ta.example.org", exp=utc_time_sans_frac() + 3600),
+        TrustChain(anchor="https://ta.example.com", exp=utc_time_sans_frac() + 3600)
+    ]
+    _cache["https://op.example.org"] = [
+        TrustChain(anchor="https://ta.example.org", exp=utc_time_sans_frac() - 10)]
+
+    assert len(_cache["https://rp.example.org"]) == 2
+    assert _cache.get_trust_chain("https://rp.example.org", "https://ta.example.com")
+    # expired
+    assert _cache.get("https://op.example.org", {}) == {}
+    assert "https://op.example.org" not in _cache.keys()
+
+    _cache["https://a.example.org"] = [
+        TrustChain(anchor="https://ta.example.org", exp=utc_time_sans_frac() + 3600)]
+    _cache["https://b.example.org"] = [
+        TrustChain(anchor="https://ta.example.org", exp=utc_time_sans_frac() + 3600)]
+    assert set(_cache.keys()) == {"https://a.example.org", "https://b.example.org"}
+
+
+def test_trust_chain_cache_copies():
+    _cache = TrustChainCache()
+    _cache["https://rp.example.org"] = [
+        TrustChain(anchor="https://ta.example.org", exp=utc_time_sans_frac() + 3600,
+                   metadata={"openid_relying_party": {"client_name": "RP"}},
+                   verified_chain=[{"iss": "https://ta.example.org"},
+                                   {"metadata": {"openid_relying_party": {}}}])]
+
+    # As is done with the metadata from a registration response
+    _trust_chain = _cache["https://rp.example.org"][0]
+    _trust_chain.verified_chain[-1]["metadata"] = {"oauth_client": {}}
+    _trust_chain.metadata["oauth_client"] = {}
+    _trust_chain.export_chain()
+
+    _cached = _cache["https://rp.example.org"][0]
+    assert _cached.verified_chain == [{"iss": "https://ta.example.org"},
+                                      {"metadata": {"openid_relying_party": {}}}]
+    assert set(_cached.metadata.keys()) == {"openid_relying_party"}
+
+def test_trust_chain_cache_peek():
+    _cache = TrustChainCache(max_size=2)
+    for _id in ["https://a.example.org", "https://b.example.org"]:
+        _cache[_id] = [TrustChain(anchor="https://ta.example.org",
+                                  exp=utc_time_sans_frac() + 3600)]
+
+    assert _cache.peek("https://a.example.org")
+    assert _cache.used("https://a.example.org") is False
+    assert _cache.stats()["hits"] == 0
+    # Still the least recently used
+    _cache["https://c.example.org"] = [TrustChain(anchor="https://ta.example.org",
+                                                  exp=utc_time_sans_frac() + 3600)]
+    assert set(_cache.keys()) == {"https://b.example.org", "https://c.example.org"}
+
+    assert _cache.get("https://b.example.org")
+    assert _cache.used("https://b.example.org")
+    # Stored anew
+    _cache["https://b.example.org"] = [TrustChain(anchor="https://ta.example.org",
+                                                  exp=utc_time_sans_frac() + 3600)]
+    assert _cache.used("https://b.example.org") is False
+
+def test_trust_mark_status_cache():
+    _cache = TrustMarkStatusCache(positive_ttl=300, negative_ttl=0)
+    _calls = []
+
+    def active():
+        _calls.append(1)
+        return True
+
+    _key = _cache.key("https://tmi.example.org", "https://example.org/tm",
+                      "https://rp.example.org", 1000)
+    assert _cache.check(_key, active)
+    assert _cache.check(_key, active)
+    assert len(_calls) == 1
+
+    # Never beyond the expiration time of the trust mark
+    _now = utc_time_sans_frac()
+    _other = _cache.key("https://tmi.example.org", "https://example.org/tm",
+                        "https://op.example.org")
+    _cache.check(_other, active, exp=_now - 1)
+    assert _cache.get(_other) is None
+
+    # Negative answers are not cached
+    assert _cache.check("no", lambda: False) is False
+    assert _cache.get("no") is None
@@ -0,0 +1,53 @@
+from cryptojwt.jwt import utc_time_sans_frac
+
+from fedservice.http_cache import etag
+from fedservice.http_cache import HTTPCache
+from fedservice.http_cache import not_modified
+from fedservice.http_cache import parse_cache_control
+
+URL = "https://ta.example.org/.well-known/openid-federation"
+
+
+class Response(object):
+
+    def __init__(self, status_code, headers, text=""):
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+
+
+def test_parse_cache_control():
+    assert parse_cache_control('max-age=600, no-transform, private="x"') == {
+        "max-age": "600", "no-transform": True, "private": "x"}
+    assert parse_cache_control(None) == {}
+
+
+def test_not_modified():
+    _etag = etag("body")
+    assert not_modified(_etag, {"headers": {"if-none-match": f'W/"xyz", {_etag}'}})
+    assert not_modified(_etag, {"headers": {"if-none-match": "*"}})
+    assert not not_modified(_etag, {"headers": {}})
+    assert not not_modified(_etag)
+
+
+def test_conditional_request():
+    _cache = HTTPCache()
+    _etag = etag("statement")
+    _resp = _cache.update(URL, Response(200, {"ETag": _etag, "Cache-Control": "no-cache"},
+                                        "statement"))
+    assert _resp.text == "statement"
+    assert _cache.fresh(URL) is None
+    assert _cache.conditional_headers(URL) == {"If-None-Match": _etag}
+
+    _resp = _cache.update(URL, Response(304, {"Cache-Control": "max-age=600"}))
+    assert _resp.status_code == 200
+    assert _resp.text == "statement"
+    assert _cache.fresh(URL).fresh_until > utc_time_sans_frac()
+
+
+def test_no_store():
+    _cache = HTTPCache()
+    _cache.update(URL, Response(200, {"ETag": etag("a")}, "a"))
+    assert URL in _cache
+    _cache.update(URL, Response(200, {"ETag": etag("b"), "Cache-Control": "no-store"}, "b"))
+    assert URL not in _cache
@@ -0,0 +1,24 @@
+import responses
+
+from fedservice.http_client import HTTPClient
+from fedservice.http_client import init_httpc
+
+
+def test_pooled_request():
+    _httpc = HTTPClient(timeout=5)
+    with responses.RequestsMock() as rsps:
+        rsps.add("GET", "https://ta.example.org/list", body='["https://rp.example.org"]',
+                 adding_headers={"Content-Type": "application/json"}, status=200)
+        _resp = _httpc("GET", "https://ta.example.org/list", verify=False)
+        assert _resp.status_code == 200
+        assert _resp.json() == ["https://rp.example.org"]
+    _httpc.close()
+
+
+def test_init_httpc():
+    assert isinstance(init_httpc(), HTTPClient)
+    _httpc = init_httpc({"timeout": 2, "retries": 0})
+    assert _httpc.timeout == 2
+    assert init_httpc(_httpc) is _httpc
+    assert isinstance(init_httpc({"class": "fedservice.http_client.HTTPClient", "kwargs": {}}),
+                      HTTPClient)
@@ -0,0 +1,34 @@
+import threading
+
+from cryptojwt.jwt import utc_time_sans_frac
+
+from fedservice.scheduler import RefreshScheduler
+
+
+def test_run_pending():
+    _done = []
+    _scheduler = RefreshScheduler()
+    _now = utc_time_sans_frac()
+    _scheduler.schedule("a", _now - 1, _done.append, "a")
+    _scheduler.schedule("b", _now + 100, _done.append, "b")
+    _scheduler.schedule("c", _now - 1, _done.append, "c")
+    # rescheduled
+    _scheduler.schedule("c", _now + 100, _done.append, "c")
+
+    assert _scheduler.run_pending() == 1
+    assert _done == ["a"]
+    assert len(_scheduler) == 2
+
+    _scheduler.cancel("b")
+    assert _scheduler.run_pending(now=_now + 200) == 1
+    assert _done == ["a", "c"]
+    assert len(_scheduler) == 0
+
+
+def test_background():
+    _event = threading.Event()
+    _scheduler = RefreshScheduler()
+    _scheduler.start()
+    _scheduler.schedule("a", utc_time_sans_frac(), _event.set)
+    assert _event.wait(5)
+    _scheduler.stop()
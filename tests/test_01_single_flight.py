@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from fedservice.single_flight import SingleFlight
+
+
+def test_coalesce():
+    _single_flight = SingleFlight()
+    _calls = []
+    _started = threading.Event()
+
+    def work():
+        _calls.append(1)
+        _started.set()
+        time.sleep(0.2)
+        return len(_calls)
+
+    _results = []
+    _threads = [threading.Thread(target=lambda: _results.append(_single_flight.do("key", work)))
+                for _ in range(5)]
+    _threads[0].start()
+    _started.wait()
+    for _thread in _threads[1:]:
+        _thread.start()
+    for _thread in _threads:
+        _thread.join()
+
+    assert _calls == [1]
+    assert _results == [1] * 5
+    assert _single_flight.shared == 4
+    assert "key" not in _single_flight
+
+
+def test_error_not_remembered():
+    _single_flight = SingleFlight()
+
+    def fail():
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        _single_flight.do("key", fail)
+    # Not remembered
+    assert _single_flight.do("key", lambda: 1) == 1
+
+
+def test_reentrant():
+    _single_flight = SingleFlight()
+
+    def outer():
+        return _single_flight.do("key", lambda: 2) + 1
+
+    assert _single_flight.do("key", outer) == 3
+
+
+def test_coroutines():
+    _single_flight = SingleFlight()
+    _calls = []
+
+    async def work():
+        _calls.append(1)
+        await asyncio.sleep(0.1)
+        return "done"
+
+    async def run():
+        return await asyncio.gather(*[_single_flight.ado("key", work) for _ in range(5)])
+
+    assert asyncio.run(run()) == ["done"] * 5
+    assert _calls == [1]
+    assert _single_flight.shared == 4
@@ -0,0 +1,112 @@
+import json
+import os
+from urllib.parse import quote_plus
+
+from idpyoidc.storage.abfile import AbstractFileSystem
+
+from fedservice.entity.server.subordinate import SubordinateStore
+
+RP_ID = "https://rp.example.org"
+OP_ID = "https://op.example.org"
+IM_ID = "https://im.example.org"
+
+
+def test_index():
+    _store = SubordinateStore({
+        RP_ID: {"entity_types": ["federation_entity", "openid_relying_party"]},
+        OP_ID: {"entity_types": ["federation_entity", "openid_provider"]}
+    })
+    assert _store.find(entity_type="openid_provider") == {OP_ID}
+    assert _store.find(entity_type="federation_entity") == {RP_ID, OP_ID}
+    assert _store.find() == {RP_ID, OP_ID}
+
+    _store[IM_ID] = {"entity_types": ["federation_entity"], "intermediate": True}
+    assert _store.find(intermediate=True) == {IM_ID}
+    assert _store.find(entity_type="federation_entity", intermediate=False) == {RP_ID, OP_ID}
+
+    # Changed in place and stored again
+    _record = _store[OP_ID]
+    _record["entity_types"] = ["federation_entity"]
+    _store[OP_ID] = _record
+    assert _store.find(entity_type="openid_provider") == set()
+
+    del _store[RP_ID]
+    assert _store.find(entity_type="openid_relying_party") == set()
+    assert len(_store) == 2
+
+
+def test_trust_marks():
+    _store = SubordinateStore()
+    _store[RP_ID] = {"entity_types": ["openid_relying_party"]}
+    _store[OP_ID] = {"entity_types": ["openid_provider"]}
+    _store.set_trust_marks(RP_ID, ["https://example.com/tm/1", "https://example.com/tm/2"])
+    _store.set_trust_marks(OP_ID, ["https://example.com/tm/2"])
+
+    assert _store.find(trust_marked=True) == {RP_ID, OP_ID}
+    assert _store.find(trust_mark_id="https://example.com/tm/1") == {RP_ID}
+    assert _store.find(trust_mark_id="https://example.com/tm/2",
+                       entity_type="openid_provider") == {OP_ID}
+
+    _store.set_trust_marks(RP_ID, [])
+    assert _store.find(trust_marked=True) == {OP_ID}
+    del _store[OP_ID]
+    assert _store.find(trust_mark_id="https://example.com/tm/2") == set()
+
+
+def test_page():
+    _store = SubordinateStore()
+    for i in range(10):
+        _store[f"https://{i}.example.org"] = {
+            "entity_types": ["openid_provider" if i % 2 else "openid_relying_party"]}
+
+    assert _store.page(limit=3) == [f"https://{i}.example.org" for i in range(3)]
+    assert _store.page(from_entity_id="https://3.example.org", limit=3) == [
+        f"https://{i}.example.org" for i in range(3, 6)]
+    assert _store.page(from_entity_id="https://8.example.org") == [
+        "https://8.example.org", "https://9.example.org"]
+    assert _store.page(entity_type="openid_provider", from_entity_id="https://4.example.org",
+                       limit=2) == ["https://5.example.org", "https://7.example.org"]
+
+    del _store["https://1.example.org"]
+    assert _store.page(limit=2) == ["https://0.example.org", "https://2.example.org"]
+
+
+def test_changed_in_database():
+    _db = {RP_ID: {"entity_types": ["openid_relying_party"]}}
+    _store = SubordinateStore(_db)
+
+    # Not through the store
+    _db[OP_ID] = {"entity_types": ["openid_provider"]}
+    _db[IM_ID] = {"entity_types": ["federation_entity"], "intermediate": True}
+    assert _store.page() == [IM_ID, OP_ID, RP_ID]
+    assert _store.find(entity_type="openid_provider") == {OP_ID}
+    assert _store.find(intermediate=False) == {OP_ID, RP_ID}
+
+    del _db[OP_ID]
+    assert _store.page() == [IM_ID, RP_ID]
+    assert _store.find(entity_type="openid_provider") == set()
+
+    # A replaced record is only noticed if told so
+    _db[RP_ID] = {"entity_types": ["openid_relying_party"], "intermediate": True}
+    assert _store.find(intermediate=True) == {IM_ID}
+    _store.reindex()
+    assert _store.find(intermediate=True) == {IM_ID, RP_ID}
+
+
+def test_changed_on_disc(tmp_path):
+    _db = AbstractFileSystem(fdir=str(tmp_path))
+    _db[RP_ID] = json.dumps({"entity_types": ["openid_relying_party"]})
+    _store = SubordinateStore(_db)
+    assert _store.find(entity_type="openid_relying_party") == {RP_ID}
+
+    # Written by another process
+    _other = AbstractFileSystem(fdir=str(tmp_path))
+    _other[OP_ID] = json.dumps({"entity_types": ["openid_provider"]})
+    assert _store.page() == [OP_ID, RP_ID]
+
+    _mtime = _db.fmtime[quote_plus(RP_ID)]
+    _other[RP_ID] = json.dumps({"entity_types": ["openid_relying_party"], "intermediate": True})
+    os.utime(os.path.join(str(tmp_path), quote_plus(RP_ID)), ns=(_mtime + 10 ** 9,
+                                                                   _mtime + 10 ** 9))
+    assert _store.find(intermediate=True) == {RP_ID}
+    assert _store.find(entity_type="openid_provider") == {OP_ID}
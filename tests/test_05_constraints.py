@@ -2,7 +2,9 @@ from cryptojwt.jwt import utc_time_sans_frac
 import pytest
 
 from fedservice.entity_statement.constraints import calculate_path_length
+from fedservice.entity_statement.constraints import NamingConstraintTrie
 from fedservice.entity_statement.constraints import excluded
+from fedservice.entity_statement.constraints import more_specific
 from fedservice.entity_statement.constraints import permitted
 from fedservice.entity_statement.constraints import update_naming_constraints
 from fedservice.exception import UnknownCriticalExtension
@@ -233,6 +235,22 @@ def test_meets_restriction():
     pass
 
 
+def test_naming_constraint_trie():
+    _names = ["https://.example.com", "https://foo.example.org", "https://.example.org",
+              "https://bar.example.net"]
+    _trie = NamingConstraintTrie(_names)
+
+    for entity_id in ["https://example.com", "https://a.example.com", "https://a.b.example.com",
+                      "https://foo.example.org", "https://x.foo.example.org",
+                      "https://bar.example.net", "https://foo.example.net", "https://example.net",
+                      "https://com"]:
+        assert _trie.matches(entity_id) == any(more_specific(entity_id, n) for n in _names)
+
+    assert _trie.more_specific_than("https://example.org") == [1, 2]
+    assert _trie.more_specific_than("https://.example.net") == [3]
+    assert _trie.more_specific_than("https://example.se") == []
+
+
 def test_crit_known_unknown():
     entity_id = "https://ent.example.org"
     _now = utc_time_sans_frac()
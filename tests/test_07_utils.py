@@ -9,6 +9,7 @@ from fedservice.entity.function import tree2chains
 from fedservice.entity.function import verify_self_signed_signature
 from fedservice.entity.function.policy import TrustChainPolicy
 from fedservice.entity.function.verifier import TrustChainVerifier
+from fedservice.entity_statement.statement import TrustChain
 from fedservice.fetch_entity_statement.fs2 import FSPublisher
 from tests.utils import DummyCollector
 
@@ -60,3 +61,124 @@ def test_eval_chains():
     assert set(trust_chain.metadata['openid_relying_party'].keys()) == {
         'response_types', 'claims', 'contacts', 'application_type', 'redirect_uris',
         'id_token_signing_alg_values_supported', 'jwks_uri'}
+
+
+def test_compiled_policy_cached():
+    _anchor = {
+        "metadata_policy": {
+            "openid_relying_party": {
+                "contacts": {"add": ["ops@ta.example.org"]},
+                "grant_types": {"subset_of": ["authorization_code", "refresh_token"]},
+                "token_endpoint_auth_method": {"one_of": ["private_key_jwt"], "essential": True},
+                "application_type": {"value": "web"}
+            }
+        }
+    }
+    _leaf = {
+        "metadata": {
+            "openid_relying_party": {
+                "contacts": ["rp@example.org"],
+                "grant_types": ["authorization_code", "implicit"],
+                "token_endpoint_auth_method": "private_key_jwt",
+                "application_type": "native"
+            }
+        }
+    }
+
+    _unit = Unit(keyjar=KeyJar())
+    _policy = TrustChainPolicy(upstream_get=_unit.unit_get)
+    for _ in range(2):
+        trust_chain = TrustChain(verified_chain=[_anchor, _leaf])
+        _policy(trust_chain, "openid_relying_party")
+        assert trust_chain.metadata["openid_relying_party"] == {
+            "contacts": ["rp@example.org", "ops@ta.example.org"],
+            "grant_types": ["authorization_code"],
+            "token_endpoint_auth_method": "private_key_jwt",
+            "application_type": "web"
+        }
+
+    # Combined once, the leaf's metadata is left as it was
+    assert _policy.policy_cache.stats()["misses"] == 1
+    assert _policy.policy_cache.stats()["hits"] == 1
+    assert _leaf["metadata"]["openid_relying_party"]["application_type"] == "native"
+
+
+def test_superior_metadata_replaces_leaf_metadata():
+    _policy = TrustChainPolicy(upstream_get=Unit(keyjar=KeyJar()).unit_get)
+    _leaf_metadata = {"contacts": ["rp@example.org"], "application_type": "native"}
+    _combined = {
+        "metadata": {"application_type": "web"},
+        "metadata_policy": {"contacts": {"add": ["ops@ta.example.org"]}}
+    }
+    assert _policy.apply_policy(_leaf_metadata, _combined) == {
+        "application_type": "web", "contacts": ["ops@ta.example.org"]}
+    assert _leaf_metadata == {"contacts": ["rp@example.org"], "application_type": "native"}
+
+    # Without metadata from the superiors the leaf's metadata is used
+    _combined = {"metadata_policy": _combined["metadata_policy"]}
+    assert _policy.apply_policy(_leaf_metadata, _combined) == {
+        "application_type": "native", "contacts": ["rp@example.org", "ops@ta.example.org"]}
+
+
+def test_lazy_metadata():
+    _anchor = {
+        "metadata_policy": {
+            "openid_relying_party": {"application_type": {"value": "web"}},
+            "oauth_client": {"grant_types": {"subset_of": ["authorization_code"]}}
+        }
+    }
+    _leaf = {
+        "metadata": {
+            "openid_relying_party": {"application_type": "native"},
+            "oauth_client": {"grant_types": ["authorization_code", "implicit"]},
+            "federation_entity": {"organization_name": "Example"}
+        }
+    }
+
+    _unit = Unit(keyjar=KeyJar())
+    _policy = TrustChainPolicy(upstream_get=_unit.unit_get)
+    trust_chain = TrustChain(verified_chain=[_anchor, _leaf])
+    _policy(trust_chain)
+
+    assert set(trust_chain.metadata.keys()) == {"openid_relying_party", "oauth_client",
+                                                "federation_entity"}
+    # Nothing evaluated yet
+    assert _policy.policy_cache.stats()["misses"] == 0
+
+    assert trust_chain.metadata["openid_relying_party"] == {"application_type": "web"}
+    assert set(trust_chain.combined_policy.keys()) == {"openid_relying_party"}
+
+    assert trust_chain.metadata.copy() == {
+        "openid_relying_party": {"application_type": "web"},
+        "oauth_client": {"grant_types": ["authorization_code"]},
+        "federation_entity": {"organization_name": "Example"}
+    }
+    assert _policy.policy_cache.stats()["misses"] == 3
+
+
+def test_lazy_metadata_reapplied():
+    _anchor = {
+        "metadata_policy": {
+            "oauth_client": {"grant_types": {"subset_of": ["authorization_code"]}}
+        }
+    }
+    _leaf = {
+        "metadata": {
+            "oauth_client": {"grant_types": ["authorization_code", "implicit"]},
+            "federation_entity": {"organization_name": "Example"}
+        }
+    }
+
+    _unit = Unit(keyjar=KeyJar())
+    _policy = TrustChainPolicy(upstream_get=_unit.unit_get)
+    trust_chain = TrustChain(verified_chain=[_anchor, _leaf])
+    _policy(trust_chain)
+
+    # New leaf metadata for one entity type, as in a registration response
+    _leaf["metadata"] = {"oauth_client": {"grant_types": ["authorization_code"],
+                                          "client_id": "abcdef"}}
+    _policy(trust_chain)
+
+    assert set(trust_chain.metadata.keys()) == {"oauth_client", "federation_entity"}
+    assert trust_chain.metadata["oauth_client"]["client_id"] == "abcdef"
+    assert trust_chain.metadata["federation_entity"] == {"organization_name": "Example"}
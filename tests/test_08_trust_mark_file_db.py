@@ -1,18 +1,10 @@
-import os
-
 from cryptojwt.jwt import utc_time_sans_frac
 
 from fedservice.trust_mark_entity import FileDB
 
-BASE_PATH = os.path.abspath(os.path.dirname(__file__))
-
 
-def test_add_and_find():
-    file_name = os.path.join(BASE_PATH, 'sirtfi')
-    try:
-        os.unlink(file_name)
-    except FileNotFoundError:
-        pass
+def test_add_and_find(tmp_path):
+    file_name = str(tmp_path / 'sirtfi')
 
     _db = FileDB(**{
         "https://refeds.org/sirtfi": file_name
@@ -26,3 +18,52 @@ def test_add_and_find():
 
     res = _db.find(trust_mark_id="https://refeds.org/sirtfi", sub="https://example.com")
     assert res
+
+
+def test_find_expired_with_iat(tmp_path):
+    file_name = str(tmp_path / 'sirtfi_expired')
+
+    _tm_id = "https://refeds.org/sirtfi"
+    _db = FileDB(**{_tm_id: file_name})
+    now = utc_time_sans_frac()
+    _db.add({'trust_mark_id': _tm_id, "sub": "https://example.com", 'iat': now - 1000,
+             'exp': now - 10})
+    _db.add({'trust_mark_id': _tm_id, "sub": "https://example.com", 'iat': now - 5,
+             'exp': now + 1000})
+
+    # The expiry of the trust mark issued at iat counts, not that of the latest
+    assert _db.find(_tm_id, "https://example.com", iat=now - 1000) is False
+    assert _db.find(_tm_id, "https://example.com", iat=now - 5)
+    assert _db.find(_tm_id, "https://example.com")
+
+
+def test_latest_and_compact(tmp_path):
+    file_name = str(tmp_path / 'sirtfi_compact')
+
+    _tm_id = "https://refeds.org/sirtfi"
+    _db = FileDB(**{_tm_id: file_name})
+    now = utc_time_sans_frac()
+    _db.add({'trust_mark_id': _tm_id, "sub": "https://example.com", 'iat': now - 10})
+    _db.add({'trust_mark_id': _tm_id, "sub": "https://example.org", 'iat': now - 5,
+             'exp': now - 1})
+    _db.add({'trust_mark_id': _tm_id, "sub": "https://example.com", 'iat': now})
+
+    assert _db.latest(_tm_id, "https://example.com")["iat"] == now
+    assert _db.find(_tm_id, "https://example.com", iat=now - 10)
+    # Expired
+    assert _db.find(_tm_id, "https://example.org") is False
+    assert _db.list(_tm_id) == ["https://example.com", "https://example.org"]
+
+    # A write that was cut short is ignored
+    with open(file_name, "a") as fp:
+        fp.write('{"trust_mark_id": "https://refeds.org/sirtfi", "sub": "https://exa')
+    _db = FileDB(**{_tm_id: file_name})
+    assert _db.list(_tm_id) == ["https://example.com", "https://example.org"]
+    _db.add({'trust_mark_id': _tm_id, "sub": "https://example.net", 'iat': now})
+    assert _db.find(_tm_id, "https://example.net")
+
+    _db.compact()
+    with open(file_name) as fp:
+        assert len(fp.readlines()) == 2
+    assert _db.find(_tm_id, "https://example.com")
+    assert _db.find(_tm_id, "https://example.net")
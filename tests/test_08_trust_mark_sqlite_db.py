@@ -0,0 +1,50 @@
+from cryptojwt.jwt import utc_time_sans_frac
+
+from fedservice.trust_mark_entity import SQLiteDB
+
+TM_ID = "https://refeds.org/sirtfi"
+
+
+def test_add_find_and_purge(tmp_path):
+    file_name = str(tmp_path / 'trust_mark.db')
+
+    _db = SQLiteDB(path=file_name)
+    now = utc_time_sans_frac()
+    _db.add({'trust_mark_id': TM_ID, "sub": "https://example.com", 'iat': now - 10})
+    _db.add({'trust_mark_id': TM_ID, "sub": "https://example.org", 'iat': now - 5,
+             'exp': now - 1})
+    _db.add({'trust_mark_id': TM_ID, "sub": "https://example.com", 'iat': now})
+
+    assert _db.find(TM_ID, "https://example.com")
+    assert _db.find(TM_ID, "https://example.com", iat=now - 10)
+    assert _db.find(TM_ID, "https://example.com", iat=now - 1) is False
+    assert _db.find(TM_ID, "https://example.org") is False
+    assert _db.list(TM_ID) == ["https://example.com", "https://example.org"]
+    assert _db.list(TM_ID, sub="https://example.org") == ["https://example.org"]
+    assert TM_ID in _db
+
+    # Shared with another worker
+    _other = SQLiteDB(path=file_name)
+    assert _other.latest(TM_ID, "https://example.com")["iat"] == now
+
+    _dump = _db.dumps()
+    assert _db.purge() == 1
+    assert _db.list(TM_ID) == ["https://example.com"]
+
+    _copy = SQLiteDB(path=file_name, table="copy")
+    _copy.loads(_dump)
+    assert _copy.list(TM_ID) == ["https://example.com", "https://example.org"]
+
+
+def test_find_expired_with_iat(tmp_path):
+    _db = SQLiteDB(path=str(tmp_path / "trust_mark.db"))
+    now = utc_time_sans_frac()
+    _db.add({'trust_mark_id': TM_ID, "sub": "https://example.com", 'iat': now - 1000,
+             'exp': now - 10})
+    _db.add({'trust_mark_id': TM_ID, "sub": "https://example.com", 'iat': now - 5,
+             'exp': now + 1000})
+
+    # The expiry of the trust mark issued at iat counts, not that of the latest
+    assert _db.find(TM_ID, "https://example.com", iat=now - 1000) is False
+    assert _db.find(TM_ID, "https://example.com", iat=now - 5)
+    assert _db.find(TM_ID, "https://example.com")
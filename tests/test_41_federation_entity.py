@@ -1,4 +1,8 @@
+import asyncio
+import copy
+import json
 import os
+import threading
 
 from cryptojwt.jws.jws import factory
 import pytest
@@ -6,14 +10,23 @@ import responses
 
 from fedservice import get_trust_chain
 from fedservice import save_trust_chains
+from fedservice.entity.function import aio
+from fedservice.entity.function import apply_policies
 from fedservice.entity.function import collect_trust_chains
+from fedservice.entity.function import tree2chains
+from fedservice.entity.function import unverified_entity_statement
 from fedservice.entity.function import get_verified_trust_chains
 from fedservice.entity.function import verify_trust_chains
 from fedservice.entity.function.policy import TrustChainPolicy
+from fedservice.entity.function.refresher import TrustChainRefresher
 from fedservice.entity.function.trust_chain_collector import TrustChainCollector
 from fedservice.entity.function.trust_chain_collector import verify_self_signed_signature
 from fedservice.entity.function.trust_mark_verifier import TrustMarkVerifier
 from fedservice.entity.function.verifier import TrustChainVerifier
+from fedservice.entity.server.bulk_resolve import BulkResolve
+from fedservice.entity_statement.cache import ESCache
+from fedservice.entity_statement.statement import SignedStatement
+from fedservice.message import BulkResolveResponse
 from fedservice.message import EntityStatement
 from fedservice.message import ResolveResponse
 from tests import create_trust_chain_messages
@@ -195,12 +208,37 @@ class TestServer():
         _endpoint = self.leaf["federation_entity"].get_endpoint('entity_configuration')
         _req = _endpoint.parse_request({})
         _resp_args = _endpoint.process_request(_req)
-        assert set(_resp_args.keys()) == {'response'}
+        assert set(_resp_args.keys()) == {'response', 'http_headers'}
         entity_configuration = verify_self_signed_signature(_resp_args['response'])
         assert entity_configuration['iss'] == self.leaf.entity_id
         assert entity_configuration['sub'] == self.leaf.entity_id
         assert set(entity_configuration['metadata']['federation_entity'].keys()) == set()
 
+    def test_entity_configuration_cached(self):
+        _endpoint = self.leaf["federation_entity"].get_endpoint('entity_configuration')
+        _req = _endpoint.parse_request({})
+        _first = _endpoint.process_request(_req)['response']
+        assert _endpoint.process_request(_req)['response'] == _first
+
+        # A change in the information in the entity configuration means a new one,
+        # once it has been checked for
+        self.leaf["federation_entity"].context.trust_mark_issuers = {
+            "https://example.com/trust_mark": [self.ta.entity_id]}
+        assert _endpoint.process_request(_req)['response'] == _first
+        _endpoint._signed["checked_at"] -= _endpoint.check_interval
+        _second = _endpoint.process_request(_req)['response']
+        assert _second != _first
+        entity_configuration = verify_self_signed_signature(_second)
+        assert "trust_mark_issuers" in entity_configuration
+
+        # Or at once if told so
+        self.leaf["federation_entity"].context.trust_mark_issuers = {}
+        _endpoint.invalidate()
+        assert _endpoint._signed == {}
+        entity_configuration = verify_self_signed_signature(
+            _endpoint.process_request(_req)['response'])
+        assert "trust_mark_issuers" not in entity_configuration
+
     def test_fetch(self):
         _endpoint = self.ta.get_endpoint('fetch')
         _req = _endpoint.parse_request({"sub": self.intermediate.entity_id})
@@ -215,6 +253,42 @@ class TestServer():
         assert entity_statement['sub'] == self.intermediate.entity_id
         assert entity_statement['authority_hints'] == [self.ta.entity_id]
 
+    def test_fetch_stored(self):
+        _endpoint = self.ta.get_endpoint('fetch')
+        _endpoint.background = False
+        _req = _endpoint.parse_request({"sub": self.intermediate.entity_id})
+        _first = _endpoint.process_request(_req)["response_msg"]
+        assert _endpoint.process_request(_req)["response_msg"] == _first
+        assert _endpoint.statement_store.stats()["hits"] == 1
+
+        # A policy change means a new statement, once it has been checked for
+        self.ta.server.policy[self.intermediate.entity_id] = {
+            "metadata_policy": {"openid_provider": {"contacts": {"add": ["ops@example.com"]}}}}
+        assert _endpoint.process_request(_req)["response_msg"] == _first
+        _key = f"{self.ta.entity_id}!!{self.intermediate.entity_id}"
+        _endpoint.statement_store[_key]["checked_at"] -= _endpoint.check_interval
+        _second = _endpoint.process_request(_req)["response_msg"]
+        assert _second != _first
+        assert "metadata_policy" in factory(_second).jwt.payload()
+
+        # Refreshed before it is replaced
+        _when = _endpoint.scheduler.next_run(f"{self.ta.entity_id}!!{self.intermediate.entity_id}")
+        assert _when
+        assert _endpoint.scheduler.run_pending(now=_when) == 1
+        _refreshed = _endpoint.statement_store.get(_key)
+        assert _refreshed["requested"] is False
+
+        # Not asked for since it was refreshed, so it is not refreshed again
+        _when = _endpoint.scheduler.next_run(_key)
+        assert _endpoint.scheduler.run_pending(now=_when) == 1
+        assert _endpoint.statement_store.get(_key) is _refreshed
+        assert _key not in _endpoint.scheduler
+
+        _endpoint.invalidate(self.intermediate.entity_id)
+        assert len(_endpoint.statement_store) == 0
+        _endpoint.presign()
+        assert len(_endpoint.statement_store) == 1
+
     def test_list(self):
         _endpoint = self.ta.get_endpoint('list')
         _req = _endpoint.parse_request({})
@@ -222,6 +296,89 @@ class TestServer():
         assert _resp_args
         assert _resp_args['response_msg'] == f'["{self.intermediate.entity_id}"]'
 
+    def test_list_filtered(self):
+        _endpoint = self.ta.get_endpoint('list')
+        _endpoint.background = False
+        _req = _endpoint.parse_request({"entity_type": "federation_entity"})
+        _resp_args = _endpoint.process_request(_req)
+        assert _resp_args['response_msg'] == f'["{self.intermediate.entity_id}"]'
+
+        _req = _endpoint.parse_request({"entity_type": "openid_provider"})
+        _resp_args = _endpoint.process_request(_req)
+        assert _resp_args['response_msg'] == '[]'
+
+        # Pretend the trust marks have been collected
+        _db = self.ta.server.subordinate
+        _db.set_trust_marks(self.intermediate.entity_id, ["https://example.com/tm"])
+        _db.trust_marks_updated = 1
+        _req = _endpoint.parse_request({"trust_mark_id": "https://example.com/tm"})
+        _resp_args = _endpoint.process_request(_req)
+        assert _resp_args['response_msg'] == f'["{self.intermediate.entity_id}"]'
+        assert "trust_marks" in _endpoint.scheduler
+
+    def test_list_all_criteria(self):
+        _db = self.ta.server.subordinate
+        _db["https://rp0.example.org"] = {"entity_types": ["openid_relying_party"]}
+        _db["https://rp1.example.org"] = {"entity_types": ["openid_relying_party"]}
+        _db["https://op.example.org"] = {"entity_types": ["openid_provider"]}
+        _db.set_trust_marks("https://rp0.example.org", ["https://example.com/tm"])
+        _db.set_trust_marks("https://op.example.org", ["https://example.com/tm"])
+        _db.trust_marks_updated = 1
+
+        _endpoint = self.ta.get_endpoint('list')
+        _endpoint.background = False
+        # A subordinate must match every criteria, not just one of them
+        _req = _endpoint.parse_request({"entity_type": "openid_relying_party",
+                                        "trust_marked": "true"})
+        _resp_args = _endpoint.process_request(_req)
+        assert json.loads(_resp_args['response_msg']) == ["https://rp0.example.org"]
+
+        _req = _endpoint.parse_request({"entity_type": "openid_provider",
+                                        "trust_mark_id": "https://example.com/tm",
+                                        "intermediate": "true"})
+        _resp_args = _endpoint.process_request(_req)
+        assert json.loads(_resp_args['response_msg']) == []
+
+    def test_list_paginated(self):
+        _db = self.ta.server.subordinate
+        for i in range(5):
+            _db[f"https://rp{i}.example.org"] = {"entity_types": ["openid_relying_party"]}
+
+        _endpoint = self.ta.get_endpoint('list')
+        _req = _endpoint.parse_request({"entity_type": "openid_relying_party", "limit": 2})
+        _resp_args = _endpoint.process_request(_req)
+        assert json.loads(_resp_args['response_msg']) == ["https://rp0.example.org",
+                                                          "https://rp1.example.org"]
+        _headers = dict(_resp_args["http_headers"])
+        assert "from_entity_id=https%3A%2F%2Frp2.example.org" in _headers["Link"]
+
+        _req = _endpoint.parse_request({"entity_type": "openid_relying_party", "limit": 2,
+                                        "from_entity_id": "https://rp4.example.org"})
+        _resp_args = _endpoint.process_request(_req)
+        assert json.loads(_resp_args['response_msg']) == ["https://rp4.example.org"]
+        assert "Link" not in dict(_resp_args["http_headers"])
+
+        _endpoint.stream = True
+        _resp_args = _endpoint.process_request(_endpoint.parse_request({"limit": 3}))
+        assert len(json.loads("".join(_resp_args['response_msg']))) == 3
+
+        _resp_args = _endpoint.process_request(_endpoint.parse_request({"limit": -1}))
+        assert _resp_args["error"] == "invalid_request"
+
+    def test_list_not_modified(self):
+        _endpoint = self.ta.get_endpoint('list')
+        _req = _endpoint.parse_request({})
+        _resp_args = _endpoint.process_request(_req)
+        _headers = dict(_resp_args["http_headers"])
+        assert _headers["Cache-Control"] == "no-cache"
+
+        _http_info = {"headers": {"if-none-match": _headers["ETag"]}}
+        _resp_args = _endpoint.process_request(_req, http_info=_http_info)
+        assert _resp_args["response_code"] == 304
+        _resp = _endpoint.do_response(**_resp_args)
+        assert _resp["response_code"] == 304
+        assert ("Pragma", "no-cache") not in _resp["http_headers"]
+
     def test_resolve(self):
         _msgs = create_trust_chain_messages(self.leaf["federation_entity"],
                                             self.intermediate,
@@ -245,6 +402,41 @@ class TestServer():
         entity_statement = ResolveResponse(**payload)
         entity_statement.verify()
 
+        # Answered from the cache
+        assert _endpoint.process_request(_req) == _resp_args
+        assert _endpoint.response_cache.stats()["hits"] == 1
+        _endpoint.invalidate(self.leaf.entity_id)
+        assert len(_endpoint.response_cache) == 0
+
+    def test_bulk_resolve(self):
+        _msgs = create_trust_chain_messages(self.leaf["federation_entity"],
+                                            self.intermediate,
+                                            self.ta)
+        _unknown = "https://unknown.example.org"
+
+        with responses.RequestsMock() as rsps:
+            for _url, _jwks in _msgs.items():
+                rsps.add("GET", _url, body=_jwks,
+                         adding_headers={"Content-Type": "application/json"}, status=200)
+            rsps.add("GET", f"{_unknown}/.well-known/openid-federation", status=404)
+
+            _endpoint = BulkResolve(self.ta.server.unit_get)
+            _req = _endpoint.parse_request({
+                "sub": [self.leaf.entity_id, _unknown],
+                "anchor": self.ta.entity_id
+            })
+            _resp_args = _endpoint.process_request(_req)
+
+        payload = factory(_resp_args["response_args"]).jwt.payload()
+        _response = BulkResolveResponse(**payload)
+        _response.verify()
+        assert _response["anchor"] == self.ta.entity_id
+        assert set(_response["results"].keys()) == {self.leaf.entity_id, _unknown}
+        assert "metadata" in _response["results"][self.leaf.entity_id]
+        assert "error" in _response["results"][_unknown]
+        # Shares the cache with the resolve endpoint
+        assert len(self.ta.get_endpoint('resolve').result_cache) == 1
+
 
 FEDERATION_CONFIG_3 = {
     TA1_ID: {
@@ -352,6 +544,91 @@ class TestFunction:
         _trust_chains = verify_trust_chains(_federation_entity, _chains, _entity_conf)
         assert len(_trust_chains) == 2
 
+    def test_concurrent_collection(self):
+        _collector = self.leaf["federation_entity"].function.trust_chain_collector
+
+        _msgs = create_trust_chain_messages(self.leaf, self.intermediate, self.ta1)
+        _msgs.update(create_trust_chain_messages(self.leaf, self.ta2))
+
+        with responses.RequestsMock() as rsps:
+            for _url, _jwks in _msgs.items():
+                rsps.add("GET", _url, body=_jwks,
+                         adding_headers={"Content-Type": "application/json"}, status=200)
+
+            _tree, _entity_conf = _collector(self.leaf.entity_id)
+
+            # Start from scratch
+            _collector.config_cache = ESCache(allowed_delta=_collector.allowed_delta)
+            _collector.entity_statement_cache = ESCache(allowed_delta=_collector.allowed_delta)
+            _collector.tree_cache = ESCache(allowed_delta=0)
+            _collector.max_concurrency = 4
+            _concurrent_tree, _ = _collector(self.leaf.entity_id)
+
+        assert _concurrent_tree == _tree
+        assert list(_concurrent_tree.keys()) == [INTERMEDIATE_ID, TA2_ID]
+        assert tree2chains(_concurrent_tree) == tree2chains(_tree)
+
+    def test_async_collection(self):
+        _msgs = create_trust_chain_messages(self.leaf, self.intermediate, self.ta1)
+        _msgs.update(create_trust_chain_messages(self.leaf, self.ta2))
+
+        class Response(object):
+            def __init__(self, text):
+                self.status_code = 200
+                self.headers = {"Content-Type": "application/entity-statement+jwt"}
+                self.text = text
+
+        async def httpc(method, url, **kwargs):
+            # Remove the query part, that is the fetch endpoint
+            return Response(_msgs[url.split("?")[0]])
+
+        leaf_fe = self.leaf["federation_entity"]
+        # The collector uses the HTTP client of the function collection
+        leaf_fe.httpc = leaf_fe.function.httpc = httpc
+        leaf_fe.function.trust_chain_collector = aio.AsyncTrustChainCollector(
+            upstream_get=leaf_fe.function.unit_get,
+            trust_anchors=leaf_fe.function.trust_chain_collector.trust_anchors)
+
+        _trust_chains = asyncio.run(aio.get_verified_trust_chains(leaf_fe, self.leaf.entity_id))
+        assert len(_trust_chains) == 2
+        assert {_tc.anchor for _tc in _trust_chains} == {TA1_ID, TA2_ID}
+
+    def test_async_collector_methods(self):
+        _msgs = create_trust_chain_messages(self.leaf, self.intermediate, self.ta1)
+        _msgs.update(create_trust_chain_messages(self.leaf, self.ta2))
+
+        class Response(object):
+            def __init__(self, text):
+                self.status_code = 200
+                self.headers = {"Content-Type": "application/entity-statement+jwt"}
+                self.text = text
+
+        async def httpc(method, url, **kwargs):
+            return Response(_msgs[url.split("?")[0]])
+
+        leaf_fe = self.leaf["federation_entity"]
+        leaf_fe.httpc = leaf_fe.function.httpc = httpc
+        _collector = aio.AsyncTrustChainCollector(
+            upstream_get=leaf_fe.function.unit_get,
+            trust_anchors=leaf_fe.function.trust_chain_collector.trust_anchors)
+        leaf_fe.function.trust_chain_collector = _collector
+
+        # The blocking paths refuse an asynchronous collector
+        with pytest.raises(TypeError):
+            get_verified_trust_chains(leaf_fe, self.leaf.entity_id)
+
+        _chain = asyncio.run(_collector.get_chain([LEAF_ID, INTERMEDIATE_ID, TA1_ID], TA1_ID,
+                                                  with_ta_ec=True))
+        assert [unverified_entity_statement(_s)["iss"] for _s in _chain] == [
+            LEAF_ID, INTERMEDIATE_ID, TA1_ID, TA1_ID]
+
+        _statement = asyncio.run(_collector.refresh_entity_statement(LEAF_ID, INTERMEDIATE_ID))
+        assert unverified_entity_statement(_statement)["sub"] == LEAF_ID
+        _config = asyncio.run(_collector.refresh_entity_configuration(INTERMEDIATE_ID))
+        assert _config["iss"] == INTERMEDIATE_ID
+        _metadata = asyncio.run(_collector.get_metadata(LEAF_ID))
+        assert "federation_entity" in _metadata
+
     def test_upstream_context_attribute(self):
         leaf_fe = self.leaf["federation_entity"]
         assert leaf_fe.client.upstream_get('context_attribute', 'entity_id') == LEAF_ID
@@ -396,3 +673,182 @@ class TestFunction:
         assert trust_chain
         assert trust_chain.anchor == TA1_ID
         assert trust_chain.iss_path == [LEAF_ID, INTERMEDIATE_ID, TA1_ID]
+
+    def test_cached_trust_chains_not_changed(self):
+        leaf_fe = self.leaf["federation_entity"]
+        _msgs = create_trust_chain_messages(self.leaf, self.intermediate, self.ta1)
+        _msgs.update(create_trust_chain_messages(self.leaf, self.ta2))
+
+        with responses.RequestsMock() as rsps:
+            for _url, _jwks in _msgs.items():
+                rsps.add("GET", _url, body=_jwks,
+                         adding_headers={"Content-Type": "application/json"}, status=200)
+
+            # Not cached before
+            _trust_chains = get_verified_trust_chains(leaf_fe, LEAF_ID)
+
+        _trust_chain = _trust_chains[0]
+        _verified_chain = copy.deepcopy(_trust_chain.verified_chain)
+        _entity_types = set(_trust_chain.metadata.keys())
+
+        # As is done with the metadata from a registration response
+        _trust_chain.verified_chain[-1]["metadata"] = {"oauth_client": {"client_id": "abc"}}
+        apply_policies(leaf_fe, _trust_chains)
+        _trust_chain.export_chain()
+
+        _cached = leaf_fe.trust_chain.get(LEAF_ID)[0]
+        assert _cached.verified_chain == _verified_chain
+        assert set(_cached.metadata.keys()) == _entity_types
+        assert "oauth_client" not in _cached.metadata
+
+    def test_refresh_trust_chains(self):
+        leaf_fe = self.leaf["federation_entity"]
+        # Everything is about to expire
+        _refresher = TrustChainRefresher(upstream_get=leaf_fe.function.unit_get,
+                                         lead_time=10 ** 6, background=False)
+        leaf_fe.function.trust_chain_refresher = _refresher
+
+        _msgs = create_trust_chain_messages(self.leaf, self.intermediate, self.ta1)
+        _msgs.update(create_trust_chain_messages(self.leaf, self.ta2))
+
+        with responses.RequestsMock() as rsps:
+            for _url, _jwks in _msgs.items():
+                rsps.add("GET", _url, body=_jwks,
+                         adding_headers={"Content-Type": "application/json"}, status=200)
+
+            _trust_chains = get_verified_trust_chains(leaf_fe, LEAF_ID)
+
+        assert LEAF_ID in _refresher.scheduler
+
+        # Not used since stored, left to expire
+        _hits = leaf_fe.trust_chain.stats()["hits"]
+        with responses.RequestsMock():
+            _refresher.refresh(LEAF_ID)
+        assert LEAF_ID not in _refresher.scheduler
+        # Looking at them is not a use
+        assert leaf_fe.trust_chain.stats()["hits"] == _hits
+        assert leaf_fe.trust_chain.used(LEAF_ID) is False
+
+        assert leaf_fe.trust_chain.get(LEAF_ID)
+        # No one answers, the cached trust chains are kept
+        with responses.RequestsMock():
+            _refresher.refresh(LEAF_ID)
+        assert [_tc.exp for _tc in leaf_fe.trust_chain[LEAF_ID]] == [_tc.exp for _tc in
+                                                                     _trust_chains]
+        assert LEAF_ID in _refresher.scheduler
+
+        with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+            for _url, _jwks in _msgs.items():
+                rsps.add("GET", _url, body=_jwks,
+                         adding_headers={"Content-Type": "application/json"}, status=200)
+            _refresher.refresh(LEAF_ID)
+            # 4 entity configurations and 3 subordinate statements
+            assert len(rsps.calls) == 7
+
+        _refreshed = leaf_fe.trust_chain[LEAF_ID]
+        assert {_tc.anchor for _tc in _refreshed} == {TA1_ID, TA2_ID}
+        assert _refreshed[0] is not _trust_chains[0]
+        assert LEAF_ID in _refresher.scheduler
+
+    def test_single_flight_trust_chains(self):
+        leaf_fe = self.leaf["federation_entity"]
+        _msgs = create_trust_chain_messages(self.leaf, self.intermediate, self.ta1)
+        _msgs.update(create_trust_chain_messages(self.leaf, self.ta2))
+
+        _results = []
+        with responses.RequestsMock() as rsps:
+            for _url, _jwks in _msgs.items():
+                rsps.add("GET", _url, body=_jwks,
+                         adding_headers={"Content-Type": "application/json"}, status=200)
+
+            _threads = [
+                threading.Thread(
+                    target=lambda: _results.append(get_verified_trust_chains(leaf_fe, LEAF_ID)))
+                for _ in range(5)]
+            for _thread in _threads:
+                _thread.start()
+            for _thread in _threads:
+                _thread.join()
+            # The same as for one caller
+            assert len(rsps.calls) == 7
+
+        assert len(_results) == 5
+        assert {len(_r) for _r in _results} == {2}
+
+    def test_verification_memo(self):
+        leaf_fe = self.leaf["federation_entity"]
+
+        _msgs = create_trust_chain_messages(self.leaf, self.intermediate, self.ta1)
+        _msgs.update(create_trust_chain_messages(self.leaf, self.ta2))
+
+        with responses.RequestsMock() as rsps:
+            for _url, _jwks in _msgs.items():
+                rsps.add("GET", _url, body=_jwks,
+                         adding_headers={"Content-Type": "application/json"}, status=200)
+
+            _chains, _entity_conf = collect_trust_chains(leaf_fe, self.leaf.entity_id)
+
+        _verifier = leaf_fe.function.verifier
+        _trust_chains = verify_trust_chains(leaf_fe, [c[:] for c in _chains], _entity_conf)
+        # The leaf's entity configuration is part of both chains
+        assert _verifier.memo.stats()["hits"] == 1
+
+        _again = verify_trust_chains(leaf_fe, [c[:] for c in _chains], _entity_conf)
+        assert _verifier.memo.stats()["hits"] == 6
+        assert [_tc.verified_chain for _tc in _again] == [_tc.verified_chain for _tc in
+                                                          _trust_chains]
+
+    def test_parsed_statements(self):
+        _msgs = create_trust_chain_messages(self.leaf, self.intermediate, self.ta1)
+        _msgs.update(create_trust_chain_messages(self.leaf, self.ta2))
+
+        with responses.RequestsMock() as rsps:
+            for _url, _jwks in _msgs.items():
+                rsps.add("GET", _url, body=_jwks,
+                         adding_headers={"Content-Type": "application/json"}, status=200)
+
+            _chains, _entity_conf = collect_trust_chains(self.leaf, self.leaf.entity_id)
+
+        assert isinstance(_entity_conf, SignedStatement)
+        for _chain in _chains:
+            for _statement in _chain:
+                assert isinstance(_statement, SignedStatement)
+                assert _statement.payload() == factory(_statement).jwt.payload()
+
+    def test_incremental_collection(self):
+        _collector = self.leaf["federation_entity"].function.trust_chain_collector
+        _collector.incremental = True
+
+        _msgs = create_trust_chain_messages(self.leaf, self.intermediate, self.ta1)
+        _msgs.update(create_trust_chain_messages(self.leaf, self.ta2))
+
+        with responses.RequestsMock() as rsps:
+            for _url, _jwks in _msgs.items():
+                rsps.add("GET", _url, body=_jwks,
+                         adding_headers={"Content-Type": "application/json"}, status=200)
+
+            _tree, _entity_conf = _collector(self.leaf.entity_id)
+
+        # Nothing cached but the previously collected tree
+        _collector.config_cache = ESCache(allowed_delta=_collector.allowed_delta)
+        _collector.entity_statement_cache = ESCache(allowed_delta=_collector.allowed_delta)
+
+        with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+            for _url, _jwks in _msgs.items():
+                rsps.add("GET", _url, body=_jwks,
+                         adding_headers={"Content-Type": "application/json"}, status=200)
+
+            _new_tree, _ = _collector(self.leaf.entity_id)
+            # Only the leaf's entity configuration
+            assert len(rsps.calls) == 1
+
+            # What the resolve endpoint returns, the reused statements included
+            _chain = _collector.get_chain([LEAF_ID, INTERMEDIATE_ID, TA1_ID], TA1_ID,
+                                          with_ta_ec=True)
+            assert len(rsps.calls) == 2
+
+        assert _new_tree == _tree
+        assert len(_chain) == 4
+        assert None not in _chain
+        assert [unverified_entity_statement(_jws)["iss"] for _jws in _chain] == [
+            LEAF_ID, INTERMEDIATE_ID, TA1_ID, TA1_ID]
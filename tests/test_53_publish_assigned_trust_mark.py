@@ -45,7 +45,7 @@ def test_federation_entity_metadata():
 
     _endp = entity.get_endpoint("entity_configuration")
     res = _endp.process_request({})
-    assert set(res.keys()) == {"response"}
+    assert set(res.keys()) == {"response", "http_headers"}
     _jws = factory(res["response"])
     _payload = _jws.jwt.payload()
     assert "trust_marks" in _payload